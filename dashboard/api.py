@@ -0,0 +1,253 @@
+"""
+Локальный JSON API для LTV-метрик
+
+Отдаёт данные загрузчиков дашборда без перезапуска страниц Streamlit.
+ETag и Last-Modified вычисляются по версии данных: условные запросы
+(If-None-Match / If-Modified-Since) получают 304 без обращения к базе.
+Готовые ответы кэшируются в памяти процесса и сжимаются gzip.
+
+Запуск:
+    python dashboard/api.py --port 8600
+
+Эндпоинты:
+    GET /api/summary
+    GET /api/segments
+    GET /api/shooting-types
+    GET /api/ltv-trend?date_from=2024-01-01&date_to=2024-12-31
+    GET /api/search?q=...&limit=50
+    GET /api/companies?page=1&page_size=100&segment=A&shooting_type=...&min_ltv=...&max_ltv=...
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import sys
+from datetime import date
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dashboard.utils import (
+    load_companies_summary,
+    load_companies_dataframe,
+    load_segment_stats,
+    load_shooting_type_stats,
+    load_ltv_trend,
+    search_companies
+)
+from dashboard.utils.cache import get_data_version, get_last_modified, versioned_cache
+from dashboard.utils.writer import read_snapshot
+
+MAX_PAGE_SIZE = 1000
+GZIP_MIN_BYTES = 1024
+
+
+class BadRequest(ValueError):
+    """Некорректные параметры запроса."""
+
+
+def _int_param(params: dict, name: str, default: int, minimum: int = 1, maximum: int = None) -> int:
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise BadRequest(f"Параметр {name} должен быть целым числом")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise BadRequest(f"Параметр {name} вне допустимого диапазона")
+    return value
+
+
+def _float_param(params: dict, name: str):
+    if name not in params:
+        return None
+    try:
+        return float(params[name])
+    except ValueError:
+        raise BadRequest(f"Параметр {name} должен быть числом")
+
+
+def _date_param(params: dict, name: str):
+    if name not in params:
+        return None
+    try:
+        return date.fromisoformat(params[name]).isoformat()
+    except ValueError:
+        raise BadRequest(f"Параметр {name} должен быть датой YYYY-MM-DD")
+
+
+def _companies(params: dict) -> dict:
+    page = _int_param(params, "page", 1)
+    page_size = _int_param(params, "page_size", 100, maximum=MAX_PAGE_SIZE)
+
+    # Запрашиваем на одну запись больше, чтобы узнать о следующей странице
+    df = load_companies_dataframe(
+        segment=params.get("segment"),
+        shooting_type=params.get("shooting_type"),
+        min_ltv=_float_param(params, "min_ltv"),
+        max_ltv=_float_param(params, "max_ltv"),
+        limit=page_size + 1,
+        offset=(page - 1) * page_size
+    )
+
+    return {
+        "page": page,
+        "page_size": page_size,
+        "has_more": len(df) > page_size,
+        "items": df.head(page_size)
+    }
+
+
+def _search(params: dict) -> pd.DataFrame:
+    query = params.get("q", "").strip()
+    if not query:
+        raise BadRequest("Параметр q обязателен")
+    return search_companies(query, limit=_int_param(params, "limit", 50, maximum=MAX_PAGE_SIZE))
+
+
+ROUTES = {
+    "/api/summary": lambda params: load_companies_summary(),
+    "/api/segments": lambda params: load_segment_stats(),
+    "/api/shooting-types": lambda params: load_shooting_type_stats(),
+    "/api/ltv-trend": lambda params: load_ltv_trend(_date_param(params, "date_from"), _date_param(params, "date_to")),
+    "/api/search": _search,
+    "/api/companies": _companies,
+}
+
+
+def _to_jsonable(value):
+    """Преобразует DataFrame и numpy-типы в JSON-совместимые значения."""
+    if isinstance(value, pd.DataFrame):
+        return json.loads(value.to_json(orient="records", force_ascii=False))
+    if isinstance(value, dict):
+        return {key: _to_jsonable(item) for key, item in value.items()}
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+@versioned_cache(maxsize=256)
+def render(path: str, query: tuple) -> tuple:
+    """
+    Формирует тело ответа для эндпоинта.
+
+    Returns:
+        Кортеж (JSON в байтах, тот же JSON в gzip)
+    """
+    data = _to_jsonable(ROUTES[path](dict(query)))
+    body = json.dumps(
+        {"data_version": get_data_version(), "data": data},
+        ensure_ascii=False
+    ).encode("utf-8")
+    return body, gzip.compress(body)
+
+
+def make_etag(version: str, path: str, query: tuple) -> str:
+    """ETag ответа: версия данных + адрес ресурса."""
+    digest = hashlib.sha1(f"{version}|{path}|{query}".encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Обработчик GET-запросов к API."""
+
+    server_version = "FotofactorLTV/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path not in ROUTES:
+            self._send_json(404, {"error": "Неизвестный эндпоинт", "endpoints": sorted(ROUTES)})
+            return
+
+        query = tuple(sorted(parse_qsl(url.query)))
+
+        # Условный запрос проверяется по метаданным файла базы, без соединения
+        etag, last_modified, headers = self._validators(url.path, query)
+        if self._not_modified(etag, last_modified):
+            self._send(304, b"", headers)
+            return
+
+        # Тело строится по одному снимку базы; заголовки пересчитываются под
+        # версию снимка, чтобы ETag соответствовал данным в ответе
+        with read_snapshot():
+            etag, last_modified, headers = self._validators(url.path, query)
+            try:
+                body, body_gzip = render(url.path, query)
+            except BadRequest as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": f"Ошибка загрузки данных: {e}"})
+                return
+
+        headers["Content-Type"] = "application/json; charset=utf-8"
+        if len(body) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            body = body_gzip
+
+        self._send(200, body, headers)
+
+    @staticmethod
+    def _validators(path: str, query: tuple) -> tuple:
+        """ETag, время изменения и заголовки кэширования для текущей версии данных."""
+        etag = make_etag(get_data_version(), path, query)
+        last_modified = get_last_modified().replace(microsecond=0)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(last_modified.timestamp(), usegmt=True),
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        return etag, last_modified, headers
+
+    def _not_modified(self, etag: str, last_modified) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._send(status, body, {"Content-Type": "application/json; charset=utf-8"})
+
+    def _send(self, status: int, body: bytes, headers: dict):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный JSON API для LTV-метрик")
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес для прослушивания")
+    parser.add_argument("--port", type=int, default=8600, help="Порт")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print(f"✅ API запущен: http://{args.host}:{args.port}/api/summary")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ Fotofactor Client Analytics Dashboard
 - Фильтрация и поиск в реальном времени
 - Виджеты с топ-клиентами, трендами, алертами
 """
+import pandas as pd
 import streamlit as st
 from pathlib import Path
 import sys
@@ -21,76 +22,130 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Главная страница
-st.title("📊 Fotofactor Client Analytics Dashboard")
+# Страницы берут поверхностные копии общих таблиц (.copy(deep=False)):
+# без Copy-on-Write изменение такой копии попадает в общий кэш. В pandas 3
+# Copy-on-Write включён всегда, в pandas 2 — включаем здесь
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
-st.markdown("""
-### Добро пожаловать в дашборд аналитики клиентов!
+from dashboard.utils.profiling import profile_rerun
+from dashboard.utils.writer import read_snapshot
 
-Используйте навигацию слева для перехода между разделами:
 
-- **📈 Обзор** - Ключевые метрики и KPI
-- **👥 Клиенты** - Список клиентов с фильтрами
-- **🎯 Сегменты** - Анализ сегментов A/B/C/U
-- **📸 Типы съёмок** - Анализ популярности услуг
-- **📉 Тренды** - Динамика LTV и заказов
+def home():
+    """Главная страница: навигация по разделам и быстрая статистика."""
+    st.title("📊 Fotofactor Client Analytics Dashboard")
 
----
+    st.markdown("""
+    ### Добро пожаловать в дашборд аналитики клиентов!
 
-### Быстрая статистика:
-""")
+    Используйте навигацию слева для перехода между разделами:
 
-# Загружаем базовые данные для главной страницы
-from utils.data_loader import load_companies_summary
+    - **📈 Обзор** - Ключевые метрики и KPI
+    - **👥 Клиенты** - Список клиентов с фильтрами
+    - **🎯 Сегменты** - Анализ сегментов A/B/C/U
+    - **📸 Типы съёмок** - Анализ популярности услуг
+    - **📉 Тренды** - Динамика LTV и заказов
 
-try:
-    summary = load_companies_summary()
+    ---
 
-    col1, col2, col3, col4 = st.columns(4)
+    ### Быстрая статистика:
+    """)
 
-    with col1:
-        st.metric(
-            label="Всего клиентов",
-            value=f"{summary['total_companies']:,}",
-            delta=f"{summary['companies_with_orders']:,} с заказами"
-        )
+    # Загружаем базовые данные для главной страницы
+    from dashboard.utils.data_loader import load_companies_summary
 
-    with col2:
-        st.metric(
-            label="Total LTV",
-            value=f"{summary['total_ltv']:,.0f} ₽",
-            delta=f"{summary['avg_ltv']:,.0f} ₽ средний"
-        )
+    try:
+        summary = load_companies_summary()
 
-    with col3:
-        st.metric(
-            label="Всего заказов",
-            value=f"{summary['total_orders']:,}",
-            delta=f"{summary['avg_orders_per_company']:.1f} на клиента"
-        )
+        col1, col2, col3, col4 = st.columns(4)
 
-    with col4:
-        st.metric(
-            label="Тип съёмки",
-            value=f"{summary['companies_with_shooting_type']:,}",
-            delta=f"{summary['shooting_type_percent']:.1f}% заполнено"
-        )
+        with col1:
+            st.metric(
+                label="Всего клиентов",
+                value=f"{summary['total_companies']:,}",
+                delta=f"{summary['companies_with_orders']:,} с заказами"
+            )
+
+        with col2:
+            st.metric(
+                label="Total LTV",
+                value=f"{summary['total_ltv']:,.0f} ₽",
+                delta=f"{summary['avg_ltv']:,.0f} ₽ средний"
+            )
+
+        with col3:
+            st.metric(
+                label="Всего заказов",
+                value=f"{summary['total_orders']:,}",
+                delta=f"{summary['avg_orders_per_company']:.1f} на клиента"
+            )
+
+        with col4:
+            st.metric(
+                label="Тип съёмки",
+                value=f"{summary['companies_with_shooting_type']:,}",
+                delta=f"{summary['shooting_type_percent']:.1f}% заполнено"
+            )
+
+        st.success("✅ Данные успешно загружены из базы данных")
+
+    except Exception as e:
+        st.error(f"❌ Ошибка загрузки данных: {e}")
+        st.info("Убедитесь, что база данных `platrum.db` существует и содержит данные аналитики.")
 
-    st.success("✅ Данные успешно загружены из базы данных")
+    st.markdown("""
+    ---
+
+    ### Как использовать:
+
+    1. **Фильтры** в боковой панели применяются ко всем графикам
+    2. **Клик на график** для drill-down (детальный просмотр)
+    3. **Hover** на элементы для подсказок
+    4. **Экспорт** данных в Excel доступен на страницах
+
+    💡 **Совет**: Начните с раздела "Обзор" для общей картины, затем углубляйтесь в детали.
+    """)
+
+    # Память процесса: сессии и общий кэш загрузчиков (utils/session_memory.py)
+    from dashboard.utils.session_memory import memory_totals
+
+    with st.expander("🧠 Память сервера"):
+        totals = memory_totals()
+        col1, col2, col3 = st.columns(3)
+        col1.metric(
+            "Сессий",
+            f"{totals['sessions']:,}",
+            help="Открытые сессии дашборда в этом процессе"
+        )
+        col2.metric(
+            "Память сессий",
+            f"{totals['session_bytes'] / 2**20:.1f} МБ",
+            delta=f"макс. {totals['largest_session_bytes'] / 2**20:.1f} из {totals['budget_bytes'] / 2**20:.0f} МБ",
+            delta_color="off",
+            help="Объекты, которые сессии хранят между перезапусками; бюджет сессии — LTV_SESSION_MEMORY_MB"
+        )
+        col3.metric(
+            "Общий кэш",
+            f"{totals['shared_bytes'] / 2**20:.1f} МБ",
+            help="Результаты загрузчиков — одна копия на процесс для всех сессий"
+        )
+        if totals["evictions"]:
+            st.caption(f"Вытеснено объектов по бюджету: {totals['evictions']:,}")
 
-except Exception as e:
-    st.error(f"❌ Ошибка загрузки данных: {e}")
-    st.info("Убедитесь, что база данных `platrum.db` существует и содержит данные аналитики.")
 
-st.markdown("""
----
+# ============================================================================
+# НАВИГАЦИЯ
+# ============================================================================
 
-### Как использовать:
+# Страницы из pages/: названия и адреса берутся из имён файлов, как раньше
+pages = [st.Page(home, title="Главная", icon="📊", default=True)]
+pages += [st.Page(str(path)) for path in sorted((Path(__file__).parent / "pages").glob("*.py"))]
 
-1. **Фильтры** в боковой панели применяются ко всем графикам
-2. **Клик на график** для drill-down (детальный просмотр)
-3. **Hover** на элементы для подсказок
-4. **Экспорт** данных в Excel доступен на страницах
+navigation = st.navigation(pages)
 
-💡 **Совет**: Начните с раздела "Обзор" для общей картины, затем углубляйтесь в детали.
-""")
+# Весь перезапуск страницы читает один снимок базы: запись, завершившаяся
+# посередине, не смешивает на странице старые и новые данные.
+# LTV_PROFILE=1 или ?profile=1 — профиль перезапуска (utils/profiling.py)
+with read_snapshot(), profile_rerun(navigation.url_path or "home"):
+    navigation.run()
@@ -0,0 +1,475 @@
+"""
+Нагрузочный тест страниц дашборда
+
+Моделирует N одновременных пользователей: каждая сессия —
+streamlit.testing.v1.AppTest в своём процессе (AppTest рассчитан на один
+запуск на процесс, поэтому сессии не делят среду выполнения Streamlit).
+Сессия открывает app.py, обходит все страницы и на каждой делает
+несколько случайных действий с виджетами — переключатели, выбор в
+списках, поиск; после каждого действия виджеты страницы берутся заново.
+Каждый перезапуск страницы замеряется.
+
+Кэши загрузчиков и фигур у процесса свои, поэтому перед замером каждая
+сессия один раз обходит страницы (прогрев), а затем все сессии стартуют
+одновременно — как N серверов Streamlit с тёплыми кэшами над одной базой.
+
+База — синтетическая, заданного размера (utils/demo_data.py), создаётся
+во временном каталоге отдельным процессом; --db позволяет взять готовую
+(например, копию рабочей). Путь передаётся процессам сессий через
+LTV_DB_PATH, и каждая сессия проверяет, что data_loader открыл именно
+эту базу. Первый обход страниц одной сессией идёт отдельно («холодный»
+старт: построение материализованных таблиц) и в перцентили нагрузки не
+входит.
+
+Отчёт:
+- задержка перезапуска p50/p95/p99 — по страницам и общая;
+- запросы к базе — всего и в среднем на перезапуск (трассировка
+  sqlite3, включая запросы через курсор драйвера);
+- RSS процесса сессии до нагрузки и пиковый (максимум по процессам);
+- память сессий в конце обхода (utils/session_memory.py) и кэш
+  загрузчиков процесса: на сессию — не больше бюджета LTV_SESSION_MEMORY_MB.
+
+Запуск:
+    python dashboard/loadtest.py --sessions 8 --iterations 3
+    python dashboard/loadtest.py --companies 20000 --deals 300000 --json loadtest.json --max-p95 2.5
+    python dashboard/loadtest.py --smoke
+
+С --max-p95 код выхода 1, если общий p95 больше порога (проверка
+регрессий в cron или CI). --smoke — быстрая проверка самого теста и
+страниц: одна сессия, один обход, маленькая база; код выхода 1 при
+любой ошибке.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+APP_PATH = Path(__file__).parent / "app.py"
+PAGES = sorted((Path(__file__).parent / "pages").glob("*.py"))
+# Генератор запускается файлом: импорт пакета dashboard.utils открывает базу
+DEMO_DATA_PATH = Path(__file__).parent / "utils" / "demo_data.py"
+
+# Строки поиска для текстовых полей
+SEARCH_TERMS = ["ООО", "Альфа", "ип", "Сигма 1", "DEMO_1"]
+# Типы запросов, которые считаются обращениями к базе (без BEGIN/PRAGMA/SAVEPOINT)
+QUERY_PREFIXES = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "CREATE", "DROP")
+RUN_TIMEOUT_SECONDS = 120
+# Сколько сессии ждут друг друга после прогрева
+START_TIMEOUT_SECONDS = 600
+RSS_SAMPLE_SECONDS = 0.05
+SMOKE_COMPANIES = 200
+SMOKE_DEALS = 2000
+
+
+# ============================================================================
+# ЗАМЕРЫ
+# ============================================================================
+
+class QueryCounter:
+    """Счётчик запросов к базе по всем соединениям движка."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def install(self, engine) -> None:
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "connect")
+        def _trace(dbapi_connection, connection_record):
+            dbapi_connection.set_trace_callback(self._on_statement)
+
+    def _on_statement(self, statement: str) -> None:
+        if statement.lstrip().upper().startswith(QUERY_PREFIXES):
+            with self._lock:
+                self.count += 1
+
+
+def current_rss() -> int:
+    """Текущий RSS процесса в байтах (Linux)."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler:
+    """Фоновый поток, запоминающий пиковый RSS."""
+
+    def __init__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, current_rss())
+
+
+# ============================================================================
+# СЕССИИ
+# ============================================================================
+
+def _identity_options(widget) -> list:
+    """Варианты, которые можно выбрать по значению (без format_func-подписей)."""
+    options = []
+    for option in widget.options:
+        try:
+            if str(widget.format_func(option)) == option:
+                options.append(option)
+        except Exception:
+            continue
+    return options
+
+
+def random_action(at, rng: random.Random):
+    """
+    Случайное действие пользователя с виджетами текущей страницы.
+
+    Виджеты берутся из at на момент вызова: после перезапуска прежние
+    ссылки на виджеты устаревают, поэтому действие выбирается заново
+    перед каждым перезапуском.
+
+    Returns:
+        (описание, функция без аргументов, меняющая виджет) или None, если виджетов нет
+    """
+    actions = []
+    for widget in list(at.toggle) + list(at.checkbox):
+        actions.append((f"toggle {widget.label}", lambda w=widget: w.set_value(not w.value)))
+    for widget in list(at.selectbox) + list(at.radio):
+        options = _identity_options(widget)
+        if len(options) > 1:
+            actions.append((f"select {widget.label}", lambda w=widget, o=options: w.set_value(rng.choice(o))))
+    for widget in at.multiselect:
+        options = _identity_options(widget)
+        if options:
+            actions.append((f"multiselect {widget.label}", lambda w=widget, o=options: w.set_value([rng.choice(o)])))
+    for widget in at.text_input:
+        actions.append((f"search {widget.label}", lambda w=widget: w.set_value(rng.choice(SEARCH_TERMS))))
+
+    return rng.choice(actions) if actions else None
+
+
+class SessionResult:
+    """Замеры одной сессии (возвращаются из процесса сессии)."""
+
+    def __init__(self):
+        self.runs: Dict[str, List[float]] = defaultdict(list)
+        self.errors: List[str] = []
+        self.session_bytes = 0
+        self.shared_bytes = 0
+        self.budget_bytes = 0
+        self.queries = 0
+        self.rss_before = 0
+        self.rss_peak = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+
+def _timed_run(at, page: str, result: SessionResult, step) -> None:
+    # step() меняет состояние (переход, значение виджета) и возвращает то, что запускается
+    started = time.perf_counter()
+    step().run(timeout=RUN_TIMEOUT_SECONDS)
+    result.runs[page].append(time.perf_counter() - started)
+    for element in list(at.exception):
+        result.errors.append(f"{page}: {element.message}")
+
+
+def walk_pages(rng: random.Random, iterations: int, actions: int, result: SessionResult):
+    """
+    Одна сессия пользователя: главная страница, затем обход всех страниц.
+
+    Args:
+        rng: Генератор случайных действий
+        iterations: Сколько раз обойти страницы
+        actions: Действий на странице за обход
+        result: Куда записывать замеры
+
+    Returns:
+        AppTest сессии после обхода
+    """
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=RUN_TIMEOUT_SECONDS)
+    _timed_run(at, "app", result, lambda: at)
+
+    for _ in range(iterations):
+        pages = list(PAGES)
+        rng.shuffle(pages)
+        for page in pages:
+            name = page.stem
+            _timed_run(at, name, result, lambda: at.switch_page(f"pages/{page.name}"))
+            for _ in range(actions):
+                action = random_action(at, rng)
+                if action is None:
+                    break
+                _timed_run(at, name, result, action[1])
+    return at
+
+
+# Барьер одновременного старта сессий (задаётся инициализатором процесса)
+_start_barrier = None
+
+
+def _init_worker(barrier) -> None:
+    global _start_barrier
+    _start_barrier = barrier
+
+
+def run_session(db_path: str, seed: int, iterations: int, actions: int, warm_up: bool) -> SessionResult:
+    """
+    Сессия в процессе пула: прогрев, ожидание остальных сессий, замер.
+
+    Args:
+        db_path: База, которую должен открыть data_loader
+        seed: Зерно случайных действий
+        iterations: Сколько раз обойти страницы
+        actions: Действий на странице за обход
+        warm_up: Обойти страницы без замера перед стартом
+
+    Returns:
+        SessionResult
+    """
+    from dashboard.utils import data_loader
+    from dashboard.utils.session_memory import SESSION_KEY, memory_totals
+
+    # Путь к базе читается при импорте data_loader (LTV_DB_PATH от родителя)
+    if data_loader.DB_PATH != Path(db_path):
+        raise RuntimeError(f"Сессия открыла {data_loader.DB_PATH} вместо {db_path}")
+
+    counter = QueryCounter()
+    counter.install(data_loader.engine)
+
+    result = SessionResult()
+    if warm_up:
+        try:
+            walk_pages(random.Random(seed), 1, 0, SessionResult())
+        except Exception as error:
+            result.errors.append(f"прогрев {seed}: {error!r}")
+
+    try:
+        # Сессия с ошибкой прогрева тоже ждёт: иначе остальные не стартуют
+        _start_barrier.wait(timeout=START_TIMEOUT_SECONDS)
+        queries_before = counter.count
+        result.rss_before = current_rss()
+        with RssSampler() as sampler:
+            result.started = time.time()
+            at = walk_pages(random.Random(seed), iterations, actions, result)
+            result.finished = time.time()
+        result.rss_peak = sampler.peak
+        result.queries = counter.count - queries_before
+
+        if SESSION_KEY in at.session_state:
+            result.session_bytes = at.session_state[SESSION_KEY].total_bytes
+        totals = memory_totals()
+        result.shared_bytes = totals["shared_bytes"]
+        result.budget_bytes = totals["budget_bytes"]
+    except Exception as error:
+        result.errors.append(f"сессия {seed}: {error!r}")
+    return result
+
+
+def run_load(
+    db_path: Path,
+    sessions: int,
+    iterations: int,
+    actions: int,
+    seed: int,
+    warm_up: bool = True
+) -> List[SessionResult]:
+    """Запускает сессии в отдельных процессах одновременно и ждёт их завершения."""
+    # spawn: процессы сессий импортируют дашборд заново, уже с LTV_DB_PATH
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(sessions)
+    with ProcessPoolExecutor(
+        max_workers=sessions,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(barrier,)
+    ) as pool:
+        futures = [
+            pool.submit(run_session, str(db_path), seed + i, iterations, actions, warm_up)
+            for i in range(sessions)
+        ]
+        return [future.result() for future in futures]
+
+
+def create_database(db_path: Path, companies: int, deals: int, seed: int) -> None:
+    """Создаёт синтетическую базу отдельным процессом (в этом процессе дашборд не импортируется)."""
+    subprocess.run(
+        [sys.executable, str(DEMO_DATA_PATH), str(db_path),
+         "--companies", str(companies), "--deals", str(deals), "--seed", str(seed)],
+        check=True
+    )
+
+
+# ============================================================================
+# ОТЧЁТ
+# ============================================================================
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 и максимум (секунды)."""
+    if not values:
+        return {"runs": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    array = np.asarray(values)
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return {"runs": len(values), "p50": p50, "p95": p95, "p99": p99, "max": float(array.max())}
+
+
+def summarize(results: List[SessionResult]) -> Dict:
+    by_page: Dict[str, List[float]] = defaultdict(list)
+    for result in results:
+        for page, runs in result.runs.items():
+            by_page[page].extend(runs)
+    all_runs = [value for runs in by_page.values() for value in runs]
+    session_bytes = [result.session_bytes for result in results]
+    finished = [result for result in results if result.finished]
+    return {
+        "pages": {page: percentiles(runs) for page, runs in sorted(by_page.items())},
+        "total": percentiles(all_runs),
+        "errors": [error for result in results for error in result.errors],
+        # От старта первой сессии до конца последней
+        "seconds": (
+            max(result.finished for result in finished) - min(result.started for result in finished)
+            if finished else 0.0
+        ),
+        "queries": sum(result.queries for result in results),
+        "rss_before": max((result.rss_before for result in results), default=0),
+        "rss_peak": max((result.rss_peak for result in results), default=0),
+        "session_bytes_mean": float(np.mean(session_bytes)) if session_bytes else 0.0,
+        "session_bytes_max": max(session_bytes, default=0),
+        "shared_bytes": max((result.shared_bytes for result in results), default=0),
+        "budget_bytes": max((result.budget_bytes for result in results), default=0),
+    }
+
+
+def _format_row(name: str, stats: Dict) -> str:
+    if not stats["runs"]:
+        return f"{name:<28} {0:>6}"
+    return (
+        f"{name:<28} {stats['runs']:>6} {stats['p50'] * 1000:>9.0f} {stats['p95'] * 1000:>9.0f} "
+        f"{stats['p99'] * 1000:>9.0f} {stats['max'] * 1000:>9.0f}"
+    )
+
+
+def print_report(report: Dict) -> None:
+    header = f"{'Страница':<28} {'Запусков':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}"
+    print()
+    load = report["load"]
+    print(f"Холодный старт (одна сессия): {report['cold']['seconds']:.1f} с")
+    print(
+        f"Нагрузка: {report['sessions']} сессий × {report['iterations']} обходов, "
+        f"{load['seconds']:.1f} с, {load['total']['runs'] / max(load['seconds'], 1e-9):.1f} перезапусков/с"
+    )
+    print()
+    print(header)
+    print("-" * len(header))
+    for page, stats in load["pages"].items():
+        print(_format_row(page, stats))
+    print("-" * len(header))
+    print(_format_row("Всего", load["total"]))
+    print()
+    print(
+        f"Запросов к базе: {load['queries']} "
+        f"({load['queries'] / max(load['total']['runs'], 1):.1f} на перезапуск)"
+    )
+    print(
+        f"RSS процесса сессии: {load['rss_before'] / 2**20:.0f} МБ до нагрузки, "
+        f"пик {load['rss_peak'] / 2**20:.0f} МБ (максимум по процессам)"
+    )
+    print(
+        f"Память сессии: в среднем {load['session_bytes_mean'] / 2**20:.2f} МБ, "
+        f"макс. {load['session_bytes_max'] / 2**20:.2f} из {load['budget_bytes'] / 2**20:.0f} МБ; "
+        f"кэш загрузчиков процесса {load['shared_bytes'] / 2**20:.1f} МБ"
+    )
+    errors = report["cold"]["errors"] + load["errors"]
+    if errors:
+        print(f"⚠️ Ошибок на страницах: {len(errors)}")
+        for error in sorted(set(errors))[:10]:
+            print(f"   - {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест страниц дашборда")
+    parser.add_argument("--sessions", type=int, default=4, help="Одновременных сессий")
+    parser.add_argument("--iterations", type=int, default=2, help="Обходов всех страниц на сессию")
+    parser.add_argument("--actions", type=int, default=3, help="Действий с виджетами на странице за обход")
+    parser.add_argument("--companies", type=int, default=2000, help="Компаний в синтетической базе")
+    parser.add_argument("--deals", type=int, default=20000, help="Сделок в синтетической базе")
+    parser.add_argument("--db", type=Path, help="Готовая база вместо синтетической")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно данных и действий")
+    parser.add_argument("--json", type=Path, help="Сохранить отчёт в JSON")
+    parser.add_argument("--max-p95", type=float, help="Порог общего p95 (секунды): выше — код выхода 1")
+    parser.add_argument(
+        "--smoke",
+        action="store_true",
+        help="Быстрая проверка: 1 сессия, 1 обход, маленькая база; код выхода 1 при любой ошибке"
+    )
+    args = parser.parse_args()
+
+    if args.smoke:
+        args.sessions, args.iterations = 1, 1
+        args.companies, args.deals = SMOKE_COMPANIES, SMOKE_DEALS
+    if args.db is not None and not args.db.exists():
+        # Иначе data_loader создал бы на этом месте демо-базу
+        parser.error(f"база не найдена: {args.db}")
+
+    with tempfile.TemporaryDirectory(prefix="ltv-loadtest-") as workdir:
+        if args.db is None:
+            db_path = Path(workdir) / "loadtest.db"
+            create_database(db_path, args.companies, args.deals, args.seed)
+        else:
+            db_path = args.db.resolve()
+
+        # Путь к базе читается при импорте data_loader: процессы сессий
+        # получают его через окружение (в этом процессе дашборд не импортируется)
+        os.environ["LTV_DB_PATH"] = str(db_path)
+
+        cold = run_load(db_path, 1, 1, 0, args.seed, warm_up=False)
+        load = run_load(db_path, args.sessions, args.iterations, args.actions, args.seed)
+
+        report = {
+            "db": str(db_path),
+            "sessions": args.sessions,
+            "iterations": args.iterations,
+            "cold": summarize(cold),
+            "load": summarize(load),
+        }
+
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2, default=float), encoding="utf-8")
+        print(f"📄 Отчёт: {args.json}")
+
+    if args.smoke and (report["cold"]["errors"] or report["load"]["errors"]):
+        print("❌ Ошибки на страницах")
+        sys.exit(1)
+    if args.max_p95 is not None and report["load"]["total"]["p95"] > args.max_p95:
+        print(f"❌ p95 {report['load']['total']['p95']:.2f} с больше порога {args.max_p95:.2f} с")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 """
 Страница "Обзор" - главная страница дашборда
 
-KPI карточки, круговая диаграмма сегментов, барчарт типов съёмки, таблица топ клиентов, линейный график тренда LTV.
+KPI карточки, алерты по выручке, круговая диаграмма сегментов, барчарт типов съёмки, таблица топ клиентов, линейный график тренда LTV.
 """
 import streamlit as st
 import plotly.express as px
@@ -19,13 +19,35 @@ from dashboard.utils import (
     load_segment_stats,
     load_shooting_type_stats,
     load_top_companies,
-    load_ltv_trend
+    load_ltv_trend,
+    company_page_link,
+    load_ltv_histogram,
+    load_ltv_quantiles,
+    load_ltv_concentration
+)
+from dashboard.utils.alerts import (
+    ALERT_TYPE_NAMES,
+    SCOPE_NAMES,
+    load_alerts_checked_at,
+    load_revenue_alerts
+)
+from dashboard.utils.date_range import ALL_TIME, describe_date_range, render_date_range_filter
+from dashboard.utils.figures import cached_figure
+from dashboard.utils.segmentation import (
+    SEGMENT_COLORS,
+    SEGMENT_EMOJI,
+    SEGMENT_NAMES,
+    describe_segments,
+    get_segment_thresholds
 )
 
 st.set_page_config(page_title="Обзор", page_icon="📈", layout="wide")
 
 st.title("📈 Обзор - Ключевые метрики")
 
+thresholds = get_segment_thresholds()
+date_from, date_to = render_date_range_filter()
+
 # ============================================================================
 # KPI КАРТОЧКИ
 # ============================================================================
@@ -69,6 +91,81 @@ try:
 
     st.divider()
 
+    # ============================================================================
+    # АЛЕРТЫ ПО ВЫРУЧКЕ
+    # ============================================================================
+
+    st.markdown("### 🚨 Алерты")
+
+    # Таблицу пересчитывают приём вебхуков и cron, страница только читает
+    alerts = load_revenue_alerts(limit=200)
+
+    if alerts.empty and load_alerts_checked_at() is None:
+        st.info("ℹ️ Алерты ещё не пересчитывались: `python -m dashboard.utils.alerts`")
+    elif alerts.empty:
+        st.success("✅ Аномалий выручки за последние закрытые месяцы не найдено")
+    else:
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            st.metric(
+                label="🔥 Высокая важность",
+                value=f"{(alerts['severity'] == 'high').sum():,}",
+                help="Падение с z-оценкой ≤ -3 или пропавший клиент A"
+            )
+
+        with col2:
+            st.metric(
+                label=ALERT_TYPE_NAMES['revenue_drop'],
+                value=f"{(alerts['alert_type'] == 'revenue_drop').sum():,}",
+                help="Выручка месяца заметно ниже скользящей базы за 6 предыдущих месяцев"
+            )
+
+        with col3:
+            st.metric(
+                label=ALERT_TYPE_NAMES['a_client_silence'],
+                value=f"{(alerts['alert_type'] == 'a_client_silence').sum():,}",
+                help="Регулярный клиент сегмента A без сделок 3 последних месяца"
+            )
+
+        alerts_display = pd.DataFrame({
+            'Важность': alerts['severity'].map({'high': '🔥', 'medium': '⚠️'}),
+            'Алерт': alerts['alert_type'].map(ALERT_TYPE_NAMES),
+            'Уровень': alerts['scope'].map(SCOPE_NAMES),
+            'Ряд': alerts['label'].fillna(alerts['series_key']),
+            'Месяц': alerts['month'],
+            'Выручка': alerts['revenue'],
+            'База': alerts['baseline'],
+            'Изменение': alerts['revenue'] / alerts['baseline'] - 1,
+            'z': alerts['zscore'],
+            'Карточка': alerts['series_key'].where(alerts['scope'] == 'company').map(
+                company_page_link, na_action='ignore'
+            )
+        })
+
+        st.dataframe(
+            alerts_display,
+            width="stretch",
+            hide_index=True,
+            column_config={
+                'Выручка': st.column_config.NumberColumn('Выручка', format="%.0f ₽"),
+                'База': st.column_config.NumberColumn(
+                    'База', format="%.0f ₽", help="Средняя выручка за 6 месяцев до алерта"
+                ),
+                'Изменение': st.column_config.NumberColumn('Изменение', format="percent"),
+                'z': st.column_config.NumberColumn('z', format="%.1f", help="z-оценка относительно базы"),
+                'Карточка': st.column_config.LinkColumn(
+                    'Карточка',
+                    help="Открыть карточку клиента со сделками",
+                    display_text="🔎 Открыть",
+                    width="small"
+                )
+            }
+        )
+        st.caption(f"Пересчитано {alerts['created_at'].iloc[0]} по закрытым месяцам")
+
+    st.divider()
+
     # ============================================================================
     # КРУГОВАЯ ДИАГРАММА: СЕГМЕНТЫ A/B/C/U
     # ============================================================================
@@ -78,35 +175,34 @@ try:
     col_left, col_right = st.columns([1, 1])
 
     with col_left:
-        segment_stats = load_segment_stats()
+        segment_stats = load_segment_stats(thresholds=thresholds)
 
         # Круговая диаграмма
-        fig_segments = px.pie(
-            segment_stats,
-            values='count',
-            names='segment',
-            title='Количество клиентов по сегментам',
-            color='segment',
-            color_discrete_map={
-                'A': '#FF6B6B',  # Красный
-                'B': '#4ECDC4',  # Бирюзовый
-                'C': '#FFE66D',  # Жёлтый
-                'U': '#95E1D3'   # Светло-зелёный
-            },
-            hole=0.4  # Donut chart
-        )
-        fig_segments.update_traces(
-            textposition='inside',
-            textinfo='percent+label+value',
-            hovertemplate='<b>%{label}</b><br>Клиентов: %{value}<br>Процент: %{percent}<extra></extra>'
-        )
+        def build_segments_figure():
+            fig_segments = px.pie(
+                segment_stats,
+                values='count',
+                names='segment',
+                title='Количество клиентов по сегментам',
+                color='segment',
+                color_discrete_map=SEGMENT_COLORS,
+                hole=0.4  # Donut chart
+            )
+            fig_segments.update_traces(
+                textposition='inside',
+                textinfo='percent+label+value',
+                hovertemplate='<b>%{label}</b><br>Клиентов: %{value}<br>Процент: %{percent}<extra></extra>'
+            )
+            return fig_segments
+
+        fig_segments = cached_figure("overview.segments", thresholds, build_segments_figure)
         st.plotly_chart(fig_segments, width="stretch")
 
     with col_right:
         # Таблица со статистикой по сегментам
         st.markdown("#### 📋 Детальная статистика")
 
-        segment_table = segment_stats.copy()
+        segment_table = segment_stats.copy(deep=False)
         segment_table['total_ltv'] = segment_table['total_ltv'].apply(lambda x: f"{x:,.0f} ₽")
         segment_table['avg_ltv'] = segment_table['avg_ltv'].apply(lambda x: f"{x:,.0f} ₽")
         segment_table['avg_orders'] = segment_table['avg_orders'].apply(lambda x: f"{x:.1f}")
@@ -125,13 +221,83 @@ try:
 
         st.dataframe(segment_table, width="stretch", hide_index=True)
 
-        st.info("""
-        **Сегменты:**
-        - 🔴 **A**: LTV ≥ 100,000 ₽ (премиум-клиенты)
-        - 🔵 **B**: 20,000 ₽ ≤ LTV < 100,000 ₽
-        - 🟡 **C**: 10,000 ₽ ≤ LTV < 20,000 ₽
-        - 🟢 **U**: LTV < 10,000 ₽ (новички)
-        """)
+        st.info("**Сегменты:**\n" + "\n".join(
+            f"- {SEGMENT_EMOJI[label]} **{label}**: {condition} ({SEGMENT_NAMES[label].lower()})"
+            for label, condition in describe_segments(thresholds)
+        ))
+
+    st.divider()
+
+    # ============================================================================
+    # ГИСТОГРАММА: РАСПРЕДЕЛЕНИЕ LTV
+    # ============================================================================
+
+    st.markdown("### 📊 Распределение LTV")
+
+    distribution_options = {
+        None: 'Все клиенты',
+        'segment': 'По сегментам',
+        'shooting_type': 'По типам съёмки'
+    }
+    distribution_by = st.radio(
+        "Разбивка",
+        list(distribution_options),
+        format_func=distribution_options.get,
+        horizontal=True,
+        help="Гистограмма и квантили считаются в базе данных"
+    )
+
+    histogram = load_ltv_histogram(by=distribution_by, thresholds=thresholds)
+    quantiles = load_ltv_quantiles(by=distribution_by, thresholds=thresholds)
+
+    if not histogram.empty:
+        # Для типов съёмки показываем на графике только 5 крупнейших
+        chart_groups = quantiles['group'].head(5).tolist()
+        histogram_chart = histogram[histogram['group'].isin(chart_groups)].copy(deep=False)
+        histogram_chart['range'] = histogram_chart.apply(
+            lambda row: f"{row['bin_low']:,.0f} – {row['bin_high']:,.0f}", axis=1
+        )
+
+        col_left, col_right = st.columns([2, 1])
+
+        with col_left:
+            def build_distribution_figure():
+                fig_distribution = px.bar(
+                    histogram_chart,
+                    x='range',
+                    y='count',
+                    color='group' if distribution_by else None,
+                    title='Количество клиентов по диапазонам LTV (логарифмическая шкала)',
+                    labels={'range': 'LTV (₽)', 'count': 'Клиентов', 'group': ''},
+                    category_orders={'range': histogram_chart.sort_values('bin')['range'].unique().tolist()},
+                    color_discrete_map=SEGMENT_COLORS,
+                    color_discrete_sequence=px.colors.qualitative.Set2
+                )
+                fig_distribution.update_layout(bargap=0.05)
+                fig_distribution.update_traces(
+                    hovertemplate='<b>%{x} ₽</b><br>Клиентов: %{y:,}<extra></extra>'
+                )
+                return fig_distribution
+
+            fig_distribution = cached_figure("overview.distribution", (distribution_by, thresholds), build_distribution_figure)
+            st.plotly_chart(fig_distribution, width="stretch")
+
+        with col_right:
+            st.markdown("#### 📐 Квантили LTV")
+            st.dataframe(
+                quantiles[['group', 'count', 'p50', 'p90', 'p99']],
+                width="stretch",
+                hide_index=True,
+                column_config={
+                    'group': 'Группа',
+                    'count': 'Клиентов',
+                    'p50': st.column_config.NumberColumn('p50', format="%.0f ₽"),
+                    'p90': st.column_config.NumberColumn('p90', format="%.0f ₽"),
+                    'p99': st.column_config.NumberColumn('p99', format="%.0f ₽")
+                }
+            )
+    else:
+        st.warning("⚠️ Нет данных для построения распределения")
 
     st.divider()
 
@@ -144,23 +310,27 @@ try:
     shooting_stats = load_shooting_type_stats()
     top_10_shooting = shooting_stats.head(10)
 
-    fig_shooting = px.bar(
-        top_10_shooting,
-        x='count',
-        y='shooting_type',
-        orientation='h',
-        title='Количество клиентов по типам съёмки',
-        labels={'count': 'Количество клиентов', 'shooting_type': 'Тип съёмки'},
-        color='count',
-        color_continuous_scale='Blues'
-    )
-    fig_shooting.update_layout(
-        yaxis={'categoryorder': 'total ascending'},
-        showlegend=False
-    )
-    fig_shooting.update_traces(
-        hovertemplate='<b>%{y}</b><br>Клиентов: %{x}<extra></extra>'
-    )
+    def build_shooting_figure():
+        fig_shooting = px.bar(
+            top_10_shooting,
+            x='count',
+            y='shooting_type',
+            orientation='h',
+            title='Количество клиентов по типам съёмки',
+            labels={'count': 'Количество клиентов', 'shooting_type': 'Тип съёмки'},
+            color='count',
+            color_continuous_scale='Blues'
+        )
+        fig_shooting.update_layout(
+            yaxis={'categoryorder': 'total ascending'},
+            showlegend=False
+        )
+        fig_shooting.update_traces(
+            hovertemplate='<b>%{y}</b><br>Клиентов: %{x}<extra></extra>'
+        )
+        return fig_shooting
+
+    fig_shooting = cached_figure("overview.shooting_types", None, build_shooting_figure)
     st.plotly_chart(fig_shooting, width="stretch")
 
     # Дополнительная статистика по съёмкам
@@ -168,48 +338,56 @@ try:
 
     with col1:
         st.markdown("#### 💰 Средний чек по типу съёмки")
-        top_10_shooting_avg = top_10_shooting.copy()
+        top_10_shooting_avg = top_10_shooting.copy(deep=False)
         top_10_shooting_avg = top_10_shooting_avg.sort_values('avg_ltv', ascending=False)
 
-        fig_avg_ltv = px.bar(
-            top_10_shooting_avg,
-            x='avg_ltv',
-            y='shooting_type',
-            orientation='h',
-            labels={'avg_ltv': 'Средний LTV (₽)', 'shooting_type': 'Тип съёмки'},
-            color='avg_ltv',
-            color_continuous_scale='Greens'
-        )
-        fig_avg_ltv.update_layout(
-            yaxis={'categoryorder': 'total ascending'},
-            showlegend=False
-        )
-        fig_avg_ltv.update_traces(
-            hovertemplate='<b>%{y}</b><br>Средний LTV: %{x:,.0f} ₽<extra></extra>'
-        )
+        def build_avg_ltv_figure():
+            fig_avg_ltv = px.bar(
+                top_10_shooting_avg,
+                x='avg_ltv',
+                y='shooting_type',
+                orientation='h',
+                labels={'avg_ltv': 'Средний LTV (₽)', 'shooting_type': 'Тип съёмки'},
+                color='avg_ltv',
+                color_continuous_scale='Greens'
+            )
+            fig_avg_ltv.update_layout(
+                yaxis={'categoryorder': 'total ascending'},
+                showlegend=False
+            )
+            fig_avg_ltv.update_traces(
+                hovertemplate='<b>%{y}</b><br>Средний LTV: %{x:,.0f} ₽<extra></extra>'
+            )
+            return fig_avg_ltv
+
+        fig_avg_ltv = cached_figure("overview.shooting_avg_ltv", None, build_avg_ltv_figure)
         st.plotly_chart(fig_avg_ltv, width="stretch")
 
     with col2:
         st.markdown("#### 📦 Всего заказов по типу съёмки")
-        top_10_shooting_orders = top_10_shooting.copy()
+        top_10_shooting_orders = top_10_shooting.copy(deep=False)
         top_10_shooting_orders = top_10_shooting_orders.sort_values('total_orders', ascending=False)
 
-        fig_orders = px.bar(
-            top_10_shooting_orders,
-            x='total_orders',
-            y='shooting_type',
-            orientation='h',
-            labels={'total_orders': 'Всего заказов', 'shooting_type': 'Тип съёмки'},
-            color='total_orders',
-            color_continuous_scale='Oranges'
-        )
-        fig_orders.update_layout(
-            yaxis={'categoryorder': 'total ascending'},
-            showlegend=False
-        )
-        fig_orders.update_traces(
-            hovertemplate='<b>%{y}</b><br>Заказов: %{x}<extra></extra>'
-        )
+        def build_orders_figure():
+            fig_orders = px.bar(
+                top_10_shooting_orders,
+                x='total_orders',
+                y='shooting_type',
+                orientation='h',
+                labels={'total_orders': 'Всего заказов', 'shooting_type': 'Тип съёмки'},
+                color='total_orders',
+                color_continuous_scale='Oranges'
+            )
+            fig_orders.update_layout(
+                yaxis={'categoryorder': 'total ascending'},
+                showlegend=False
+            )
+            fig_orders.update_traces(
+                hovertemplate='<b>%{y}</b><br>Заказов: %{x}<extra></extra>'
+            )
+            return fig_orders
+
+        fig_orders = cached_figure("overview.shooting_orders", None, build_orders_figure)
         st.plotly_chart(fig_orders, width="stretch")
 
     st.divider()
@@ -224,21 +402,27 @@ try:
     top_df = pd.DataFrame(top_companies)
 
     # Форматирование для отображения
-    top_df_display = top_df.copy()
+    top_df_display = top_df.copy(deep=False)
     top_df_display['ltv'] = top_df_display['ltv'].apply(lambda x: f"{x:,.0f} ₽")
-    top_df_display['orders_count_median'] = top_df_display['orders_count_median'].apply(lambda x: f"{x:.1f}")
-    top_df_display['orders_count_mean'] = top_df_display['orders_count_mean'].apply(lambda x: f"{x:.1f}")
-
-    top_df_display.columns = [
-        'Bitrix ID',
-        'Компания',
-        'LTV',
-        'Сегмент',
-        'Заказов',
-        'Медиана в год',
-        'Среднее в год',
-        'Тип съёмки'
-    ]
+    top_df_display['orders_count_median'] = top_df_display['orders_count_median'].apply(
+        lambda x: f"{x:.1f}" if pd.notna(x) else "—"
+    )
+    top_df_display['orders_count_mean'] = top_df_display['orders_count_mean'].apply(
+        lambda x: f"{x:.1f}" if pd.notna(x) else "—"
+    )
+
+    top_df_display = top_df_display.drop(columns=['days_since_last', 'churn_risk']).rename(columns={
+        'bitrix_id': 'Bitrix ID',
+        'title': 'Компания',
+        'ltv': 'LTV',
+        'segment': 'Сегмент',
+        'orders_count': 'Заказов',
+        'orders_count_median': 'Медиана в год',
+        'orders_count_mean': 'Среднее в год',
+        'primary_shooting_type': 'Тип съёмки',
+        'last_deal': 'Последняя сделка'
+    })
+    top_df_display['Карточка'] = top_df['bitrix_id'].map(company_page_link)
 
     st.dataframe(
         top_df_display,
@@ -249,40 +433,162 @@ try:
                 "Сегмент",
                 help="A/B/C/U сегмент",
                 width="small"
+            ),
+            "Карточка": st.column_config.LinkColumn(
+                "Карточка",
+                help="Открыть карточку клиента со сделками",
+                display_text="🔎 Открыть",
+                width="small"
             )
         }
     )
 
     st.divider()
 
+    # ============================================================================
+    # КРИВАЯ ПАРЕТО: КОНЦЕНТРАЦИЯ ВЫРУЧКИ
+    # ============================================================================
+
+    st.markdown("### 🏔️ Концентрация выручки")
+
+    concentration_by = st.radio(
+        "Разбивка концентрации",
+        list(distribution_options),
+        format_func=distribution_options.get,
+        horizontal=True,
+        help="Накопленная доля LTV по клиентам, отсортированным по убыванию LTV"
+    )
+
+    concentration = load_ltv_concentration(by=concentration_by, thresholds=thresholds)
+    curve = concentration['curve']
+    concentration_summary = concentration['summary']
+
+    if not concentration_summary.empty:
+        overall = concentration_summary.iloc[0]
+
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            st.metric(
+                label="🥇 Топ-1% клиентов",
+                value=f"{overall['top_1_share']:.1%}",
+                delta=f"LTV от {overall['top_1_threshold']:,.0f} ₽",
+                delta_color="off",
+                help=f"Доля выручки самых крупных 1% клиентов ({overall['group']})"
+            )
+
+        with col2:
+            st.metric(
+                label="🥈 Топ-5% клиентов",
+                value=f"{overall['top_5_share']:.1%}",
+                delta=f"LTV от {overall['top_5_threshold']:,.0f} ₽",
+                delta_color="off",
+                help=f"Доля выручки самых крупных 5% клиентов ({overall['group']})"
+            )
+
+        with col3:
+            st.metric(
+                label="🥉 Топ-20% клиентов",
+                value=f"{overall['top_20_share']:.1%}",
+                delta=f"LTV от {overall['top_20_threshold']:,.0f} ₽",
+                delta_color="off",
+                help=f"Доля выручки самых крупных 20% клиентов ({overall['group']})"
+            )
+
+        with col4:
+            st.metric(
+                label="⚖️ Коэффициент Джини",
+                value=f"{overall['gini']:.2f}",
+                delta=f"80% выручки — {overall['clients_for_80pct'] / overall['clients']:.1%} клиентов",
+                delta_color="off",
+                help="0 — выручка распределена равномерно, 1 — вся выручка у одного клиента"
+            )
+
+        curve_chart = curve[curve['group'].isin(concentration_summary['group'].head(5))]
+
+        def build_pareto_figure():
+            fig_pareto = px.line(
+                curve_chart,
+                x='client_share',
+                y='revenue_share',
+                color='group' if concentration_by else None,
+                title='Кривая Парето: доля выручки от доли клиентов',
+                labels={'client_share': 'Доля клиентов', 'revenue_share': 'Доля выручки', 'group': ''},
+                color_discrete_map=SEGMENT_COLORS
+            )
+            fig_pareto.add_trace(go.Scatter(
+                x=[0, 1],
+                y=[0, 1],
+                mode='lines',
+                name='Равномерное распределение',
+                line=dict(color='#AAAAAA', dash='dot'),
+                hoverinfo='skip'
+            ))
+            fig_pareto.update_layout(
+                xaxis_tickformat='.0%',
+                yaxis_tickformat='.0%',
+                hovermode='x unified'
+            )
+            fig_pareto.update_traces(
+                hovertemplate='Клиентов: %{x:.1%}<br>Выручки: %{y:.1%}<extra></extra>',
+                selector=dict(mode='lines')
+            )
+            return fig_pareto
+
+        fig_pareto = cached_figure("overview.pareto", (concentration_by, thresholds), build_pareto_figure)
+        st.plotly_chart(fig_pareto, width="stretch")
+
+        if concentration_by:
+            st.dataframe(
+                concentration_summary[['group', 'clients', 'gini', 'top_1_share', 'top_5_share', 'top_20_share']],
+                width="stretch",
+                hide_index=True,
+                column_config={
+                    'group': 'Группа',
+                    'clients': 'Клиентов',
+                    'gini': st.column_config.NumberColumn('Джини', format="%.2f"),
+                    'top_1_share': st.column_config.NumberColumn('Топ-1%', format="percent"),
+                    'top_5_share': st.column_config.NumberColumn('Топ-5%', format="percent"),
+                    'top_20_share': st.column_config.NumberColumn('Топ-20%', format="percent")
+                }
+            )
+
+    st.divider()
+
     # ============================================================================
     # ЛИНЕЙНЫЙ ГРАФИК: ТРЕНД LTV ПО ГОДАМ
     # ============================================================================
 
     st.markdown("### 📉 Тренд выручки по годам")
 
-    ltv_trend = load_ltv_trend()
+    if (date_from, date_to) != ALL_TIME:
+        st.caption(f"📅 Период анализа: {describe_date_range(date_from, date_to)}")
 
-    if not ltv_trend.empty:
-        fig_trend = go.Figure()
-
-        fig_trend.add_trace(go.Scatter(
-            x=ltv_trend['year'],
-            y=ltv_trend['total_revenue'],
-            mode='lines+markers',
-            name='Выручка',
-            line=dict(color='#4ECDC4', width=3),
-            marker=dict(size=10),
-            hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<br><extra></extra>'
-        ))
+    ltv_trend = load_ltv_trend(date_from, date_to)
 
-        fig_trend.update_layout(
-            title='Динамика выручки по годам (на основе дат закрытия сделок)',
-            xaxis_title='Год',
-            yaxis_title='Выручка (₽)',
-            hovermode='x unified'
-        )
+    if not ltv_trend.empty:
+        def build_trend_figure():
+            fig_trend = go.Figure()
+
+            fig_trend.add_trace(go.Scatter(
+                x=ltv_trend['year'],
+                y=ltv_trend['total_revenue'],
+                mode='lines+markers',
+                name='Выручка',
+                line=dict(color='#4ECDC4', width=3),
+                marker=dict(size=10),
+                hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<br><extra></extra>'
+            ))
+
+            fig_trend.update_layout(
+                title='Динамика выручки по годам (на основе дат закрытия сделок)',
+                xaxis_title='Год',
+                yaxis_title='Выручка (₽)',
+                hovermode='x unified'
+            )
+            return fig_trend
 
+        fig_trend = cached_figure("overview.ltv_trend", (date_from, date_to), build_trend_figure)
         st.plotly_chart(fig_trend, width="stretch")
 
         # Дополнительная статистика
@@ -8,6 +8,7 @@ import streamlit as st
 import pandas as pd
 from pathlib import Path
 import sys
+import time
 from io import BytesIO
 
 # Добавить корневую директорию в PYTHONPATH
@@ -18,8 +19,17 @@ from dashboard.utils import (
     load_companies_dataframe,
     search_companies,
     load_segment_stats,
-    load_shooting_type_stats
+    load_shooting_type_stats,
+    company_page_link,
+    load_company_index,
+    load_company_profile,
+    find_similar
 )
+from dashboard.utils.activity import ACTIVITY_ORDERS, RECENCY_FILTERS
+from dashboard.utils.cache import get_data_version
+from dashboard.utils.company_index import COMPANY_INDEX_MAX_BYTES
+from dashboard.utils.segmentation import get_segment_thresholds
+from dashboard.utils.session_memory import session_memory
 
 st.set_page_config(page_title="Клиенты", page_icon="👥", layout="wide")
 
@@ -31,8 +41,10 @@ st.title("👥 Клиенты - Полный список с фильтрами"
 
 st.sidebar.markdown("### 🔍 Фильтры")
 
+thresholds = get_segment_thresholds()
+
 # Получить уникальные значения для фильтров
-segment_stats = load_segment_stats()
+segment_stats = load_segment_stats(thresholds=thresholds)
 shooting_stats = load_shooting_type_stats()
 
 # Фильтр по сегменту
@@ -73,6 +85,21 @@ with col2:
         help="Максимальный LTV"
     )
 
+# Давность заказов (по таблице активности с индексом по дате последней сделки)
+recency_options = {None: 'Все'} | {key: label for key, (label, _) in RECENCY_FILTERS.items()}
+selected_recency = st.sidebar.selectbox(
+    "Давность заказов",
+    list(recency_options),
+    format_func=recency_options.get,
+    help="Риск оттока — пауза с последней сделки больше двух обычных интервалов между заказами клиента"
+)
+
+order_by = st.sidebar.selectbox(
+    "Сортировка",
+    list(ACTIVITY_ORDERS),
+    format_func=lambda key: ACTIVITY_ORDERS[key][0]
+)
+
 # Лимит записей
 limit = st.sidebar.slider(
     "Количество записей",
@@ -83,6 +110,13 @@ limit = st.sidebar.slider(
     help="Максимальное количество клиентов для отображения"
 )
 
+# Режим фильтрации
+in_memory = st.sidebar.toggle(
+    "⚡ Фильтрация в памяти",
+    value=True,
+    help="Фильтровать снимок клиентов в памяти вместо SQL-запроса на каждое изменение фильтров"
+)
+
 # Поиск по названию
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🔎 Поиск по названию")
@@ -97,22 +131,42 @@ search_query = st.sidebar.text_input(
 # ============================================================================
 
 try:
+    memory = session_memory()
+
     if search_query:
         # Поиск по названию
-        df = search_companies(search_query, limit=limit)
+        df = search_companies(search_query, limit=limit, thresholds=thresholds)
         st.info(f"🔍 Найдено {len(df)} компаний по запросу: **{search_query}**")
     else:
         # Фильтрация по выбранным параметрам
-        segment_filter = None if selected_segment == 'Все' else selected_segment
-        shooting_filter = None if selected_shooting_type == 'Все' else selected_shooting_type
-
-        df = load_companies_dataframe(
-            segment=segment_filter,
-            shooting_type=shooting_filter,
-            min_ltv=min_ltv if min_ltv > 0 else None,
-            max_ltv=max_ltv if max_ltv < 10000000 else None,
-            limit=limit
-        )
+        filters = {
+            "segment": None if selected_segment == 'Все' else selected_segment,
+            "shooting_type": None if selected_shooting_type == 'Все' else selected_shooting_type,
+            "min_ltv": min_ltv if min_ltv > 0 else None,
+            "max_ltv": max_ltv if max_ltv < 10000000 else None,
+            "limit": limit,
+            "thresholds": thresholds
+        }
+
+        # Снимок в памяти упорядочен по LTV: давность фильтруется и сортируется в SQL
+        by_activity = selected_recency is not None or order_by != 'ltv'
+        index = load_company_index() if in_memory and not by_activity else None
+
+        if index is not None:
+            started = time.perf_counter()
+            df = index.filter(**filters)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            st.sidebar.caption(
+                f"⚡ Снимок в памяти: {len(index):,} клиентов, "
+                f"{index.memory_bytes / 2**20:.2f} из {COMPANY_INDEX_MAX_BYTES / 2**20:.0f} МБ · "
+                f"фильтрация {elapsed_ms:.1f} мс"
+            )
+        else:
+            if in_memory and by_activity:
+                st.sidebar.caption("🕐 Фильтр и сортировка по давности — запросом по индексу активности")
+            elif in_memory:
+                st.sidebar.caption("⚠️ Снимок не помещается в лимит памяти — фильтрация через SQL")
+            df = load_companies_dataframe(recency=selected_recency, order_by=order_by, **filters)
 
     # ============================================================================
     # СТАТИСТИКА ПО ВЫБОРКЕ
@@ -160,28 +214,47 @@ try:
 
         st.markdown("### 📋 Список клиентов")
 
-        # Форматирование для отображения
-        df_display = df.copy()
-        df_display['ltv'] = df_display['ltv'].apply(lambda x: f"{x:,.0f} ₽")
-        df_display['orders_count_median'] = df_display['orders_count_median'].apply(
-            lambda x: f"{x:.1f}" if pd.notna(x) else "—"
+        def format_clients() -> pd.DataFrame:
+            # Поверхностная копия: отформатированные колонки новые, остальные общие с df
+            df_display = df.copy(deep=False)
+            df_display['ltv'] = df_display['ltv'].apply(lambda x: f"{x:,.0f} ₽")
+            df_display['orders_count_median'] = df_display['orders_count_median'].apply(
+                lambda x: f"{x:.1f}" if pd.notna(x) else "—"
+            )
+            df_display['orders_count_mean'] = df_display['orders_count_mean'].apply(
+                lambda x: f"{x:.1f}" if pd.notna(x) else "—"
+            )
+            df_display['primary_shooting_type'] = df_display['primary_shooting_type'].astype(object).fillna('—')
+            df_display['churn_risk'] = df_display['churn_risk'].map(lambda x: "🔴" if pd.notna(x) and x else "")
+
+            # Переименование колонок
+            df_display = df_display.rename(columns={
+                'bitrix_id': 'Bitrix ID',
+                'title': 'Компания',
+                'ltv': 'LTV',
+                'segment': 'Сегмент',
+                'orders_count': 'Заказов',
+                'orders_count_median': 'Медиана в год',
+                'orders_count_mean': 'Среднее в год',
+                'primary_shooting_type': 'Тип съёмки',
+                'last_deal': 'Последняя сделка',
+                'days_since_last': 'Дней без заказов',
+                'churn_risk': 'Отток'
+            })
+            df_display['Карточка'] = df['bitrix_id'].map(company_page_link)
+            return df_display
+
+        # Выборка определяется данными и фильтрами: при перезапуске с той же
+        # выборкой (кнопка выгрузки, раскрытие подсказок) таблица уже готова
+        selection = (
+            get_data_version(), search_query, selected_segment, selected_shooting_type,
+            min_ltv, max_ltv, selected_recency, order_by, limit, in_memory, thresholds
         )
-        df_display['orders_count_mean'] = df_display['orders_count_mean'].apply(
-            lambda x: f"{x:.1f}" if pd.notna(x) else "—"
+        df_display = memory.cached("clients_display", selection, format_clients)
+        st.sidebar.caption(
+            f"🧠 Память сессии: {memory.total_bytes / 2**20:.2f} "
+            f"из {memory.budget_bytes / 2**20:.0f} МБ"
         )
-        df_display['primary_shooting_type'] = df_display['primary_shooting_type'].fillna('—')
-
-        # Переименование колонок
-        df_display.columns = [
-            'Bitrix ID',
-            'Компания',
-            'LTV',
-            'Сегмент',
-            'Заказов',
-            'Медиана в год',
-            'Среднее в год',
-            'Тип съёмки'
-        ]
 
         # Отображаем таблицу
         st.dataframe(
@@ -199,33 +272,116 @@ try:
                     "Заказов",
                     help="Общее количество заказов",
                     width="small"
+                ),
+                "Отток": st.column_config.TextColumn(
+                    "Отток",
+                    help="Риск оттока: пауза длиннее двух обычных интервалов между заказами",
+                    width="small"
+                ),
+                "Карточка": st.column_config.LinkColumn(
+                    "Карточка",
+                    help="Открыть карточку клиента со сделками",
+                    display_text="🔎 Открыть",
+                    width="small"
                 )
             }
         )
 
         # ============================================================================
-        # ЭКСПОРТ В EXCEL
+        # ПОХОЖИЕ КЛИЕНТЫ
         # ============================================================================
 
         st.divider()
-        st.markdown("### 💾 Экспорт данных")
+        st.markdown("### 👯 Похожие клиенты")
+        st.caption(
+            "Клиенты с близкими LTV, частотой и ритмом заказов, средним чеком и тем же типом съёмки — "
+            "кандидаты для допродаж по образцу выбранного клиента"
+        )
 
-        col1, col2, col3 = st.columns([1, 2, 1])
+        clients = dict(zip(df['bitrix_id'], df['title']))
+        # Выбранный образец остаётся в списке, даже если новые фильтры его исключили
+        selected = st.session_state.get("lookalike_reference")
+        if selected is not None and selected not in clients:
+            profile = load_company_profile(selected)
+            if profile is not None:
+                clients = {selected: profile['title'], **clients}
 
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            reference = st.selectbox(
+                "Клиент-образец",
+                list(clients),
+                format_func=lambda x: f"{clients[x]} ({x})",
+                key="lookalike_reference",
+                help="Клиент из текущей выборки, на которого должны быть похожи найденные"
+            )
         with col2:
-            # Подготовка данных для экспорта (используем исходный df без форматирования)
-            df_export = df.copy()
+            neighbours = st.number_input(
+                "Сколько найти", min_value=1, max_value=100, value=10, step=5, key="lookalike_neighbours"
+            )
 
-            # Создаём Excel файл в памяти
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df_export.to_excel(writer, index=False, sheet_name='Клиенты')
+        if reference is not None:
+            started = time.perf_counter()
+            similar = find_similar(reference, int(neighbours))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            if similar.empty:
+                st.info("ℹ️ У клиента нет заказов — искать похожих не по чему")
+            else:
+                similar = similar.assign(card=similar['bitrix_id'].map(company_page_link))
+                st.dataframe(
+                    similar,
+                    width="stretch",
+                    hide_index=True,
+                    column_order=[
+                        'title', 'similarity', 'ltv', 'segment', 'orders_count',
+                        'primary_shooting_type', 'days_since_last', 'card'
+                    ],
+                    column_config={
+                        'title': 'Компания',
+                        'similarity': st.column_config.ProgressColumn(
+                            "Похожесть",
+                            help="1 / (1 + расстояние между признаками клиентов)",
+                            format="%.2f",
+                            min_value=0,
+                            max_value=1
+                        ),
+                        'ltv': st.column_config.NumberColumn("LTV", format="%.0f ₽"),
+                        'segment': 'Сегмент',
+                        'orders_count': 'Заказов',
+                        'primary_shooting_type': 'Тип съёмки',
+                        'days_since_last': 'Дней без заказов',
+                        'card': st.column_config.LinkColumn(
+                            "Карточка",
+                            display_text="🔎 Открыть",
+                            width="small"
+                        )
+                    }
+                )
+                st.caption(f"⚡ Поиск по индексу ближайших соседей: {elapsed_ms:.1f} мс")
 
-            excel_data = output.getvalue()
+        # ============================================================================
+        # ЭКСПОРТ В EXCEL
+        # ============================================================================
 
+        st.divider()
+        st.markdown("### 💾 Экспорт данных")
+
+        col1, col2, col3 = st.columns([1, 2, 1])
+
+        with col2:
+            def build_excel() -> bytes:
+                # Исходный df без форматирования; файл в памяти
+                output = BytesIO()
+                with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                    df.to_excel(writer, index=False, sheet_name='Клиенты')
+                return output.getvalue()
+
+            # Файл собирается только по нажатию кнопки и хранится в памяти
+            # сессии для повторного скачивания той же выборки
             st.download_button(
                 label="📥 Скачать в Excel",
-                data=excel_data,
+                data=lambda: memory.cached("clients_excel", selection, build_excel),
                 file_name=f"fotofactor_clients_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 help="Скачать текущую выборку в формате Excel"
@@ -253,7 +409,14 @@ with st.expander("💡 Как использовать фильтры"):
     2. **Тип съёмки** - выберите конкретный тип или "Все"
     3. **Диапазон LTV** - задайте минимальный и максимальный LTV
     4. **Количество записей** - установите лимит для отображения
-    5. **Поиск** - введите часть названия компании для быстрого поиска
+    5. **Давность заказов** - клиенты, заказывавшие недавно, давно или с риском оттока
+    6. **Сортировка** - по LTV или по дате последней сделки
+    7. **Поиск** - введите часть названия компании для быстрого поиска
+
+    ### Похожие клиенты:
+
+    - Выберите клиента-образец из текущей выборки (например, клиента сегмента A)
+    - Таблица покажет ближайших к нему клиентов по LTV, частоте и ритму заказов, среднему чеку и типу съёмки
 
     ### Экспорт данных:
 
@@ -1,7 +1,8 @@
 """
 Страница "Сегменты" - детальный анализ сегментов A/B/C/U
 
-Сравнение сегментов, основные типы съёмок, прогноз перехода в следующий сегмент.
+Сравнение сегментов, основные типы съёмок, RFM-ячейки внутри сегментов,
+прогноз перехода в следующий сегмент.
 """
 import streamlit as st
 import plotly.express as px
@@ -16,14 +17,65 @@ sys.path.insert(0, str(ROOT_DIR))
 
 from dashboard.utils import (
     load_segment_stats,
-    load_companies_dataframe
+    load_companies_dataframe,
+    load_segment_shooting_types,
+    load_rfm_grid,
+    load_rfm_segment_matrix
+)
+from dashboard.utils.rfm import RFM_SEGMENT_ORDER
+from dashboard.utils.segmentation import (
+    DEFAULT_SEGMENT_THRESHOLDS,
+    SEGMENT_COLORS,
+    SEGMENT_EMOJI,
+    SEGMENT_NAMES,
+    TRANSITION_WINDOW,
+    describe_segments,
+    get_segment_thresholds,
+    make_thresholds,
+    segment_labels,
+    set_segment_thresholds,
+    transition_windows
 )
-from sqlalchemy import create_engine, text
 
 st.set_page_config(page_title="Сегменты", page_icon="🎯", layout="wide")
 
 st.title("🎯 Сегментный анализ A/B/C/U")
 
+# ============================================================================
+# ПОРОГИ СЕГМЕНТОВ
+# ============================================================================
+
+st.sidebar.markdown("### ⚙️ Пороги сегментов")
+
+current_thresholds = get_segment_thresholds()
+
+threshold_values = []
+for label, minimum in current_thresholds:
+    threshold_values.append(st.sidebar.number_input(
+        f"{SEGMENT_EMOJI[label]} {label}: LTV от (₽)",
+        min_value=0,
+        value=int(minimum),
+        step=1000,
+        help=f"Минимальный LTV для сегмента {label}"
+    ))
+
+try:
+    selected_thresholds = make_thresholds(threshold_values)
+    if selected_thresholds != current_thresholds:
+        set_segment_thresholds(selected_thresholds)
+        current_thresholds = selected_thresholds
+except ValueError as e:
+    st.sidebar.error(f"❌ {e}")
+
+if st.sidebar.button("↩️ Пороги по умолчанию"):
+    set_segment_thresholds(None)
+    st.rerun()
+
+thresholds = current_thresholds
+
+if thresholds != DEFAULT_SEGMENT_THRESHOLDS:
+    st.info("⚙️ Используются пользовательские пороги сегментов — они действуют на всех страницах в этой сессии.")
+
 # ============================================================================
 # СРАВНЕНИЕ СЕГМЕНТОВ
 # ============================================================================
@@ -31,7 +83,7 @@ st.title("🎯 Сегментный анализ A/B/C/U")
 st.markdown("### 📊 Сравнение сегментов")
 
 try:
-    segment_stats = load_segment_stats()
+    segment_stats = load_segment_stats(thresholds=thresholds).copy(deep=False)
 
     # Добавляем процентное соотношение
     total_companies = segment_stats['count'].sum()
@@ -42,7 +94,7 @@ try:
 
     with col1:
         # Форматируем для отображения
-        display_stats = segment_stats.copy()
+        display_stats = segment_stats.copy(deep=False)
         display_stats['count'] = display_stats['count'].apply(lambda x: f"{x:,}")
         display_stats['percent'] = display_stats['percent'].apply(lambda x: f"{x:.1f}%")
         display_stats['total_ltv'] = display_stats['total_ltv'].apply(lambda x: f"{x:,.0f} ₽")
@@ -66,23 +118,10 @@ try:
 
     with col2:
         st.markdown("#### 📝 Критерии сегментации")
-        st.markdown("""
-        **🔴 Сегмент A** (Премиум):
-        - LTV ≥ 100,000 ₽
-        - Топовые клиенты
-
-        **🔵 Сегмент B** (Активные):
-        - 20,000 ₽ ≤ LTV < 100,000 ₽
-        - Стабильные клиенты
-
-        **🟡 Сегмент C** (Средние):
-        - 10,000 ₽ ≤ LTV < 20,000 ₽
-        - Растущие клиенты
-
-        **🟢 Сегмент U** (Новички):
-        - LTV < 10,000 ₽
-        - Потенциал роста
-        """)
+        st.markdown("\n\n".join(
+            f"**{SEGMENT_EMOJI[label]} Сегмент {label}** ({SEGMENT_NAMES[label]}):\n- {condition}"
+            for label, condition in describe_segments(thresholds)
+        ))
 
     st.divider()
 
@@ -103,12 +142,7 @@ try:
             title='Средний LTV по сегментам',
             labels={'segment': 'Сегмент', 'avg_ltv': 'Средний LTV (₽)'},
             color='segment',
-            color_discrete_map={
-                'A': '#FF6B6B',
-                'B': '#4ECDC4',
-                'C': '#FFE66D',
-                'U': '#95E1D3'
-            }
+            color_discrete_map=SEGMENT_COLORS
         )
         fig_avg_ltv.update_traces(
             hovertemplate='<b>%{x}</b><br>Средний LTV: %{y:,.0f} ₽<extra></extra>'
@@ -124,12 +158,7 @@ try:
             title='Среднее заказов в год по сегментам',
             labels={'segment': 'Сегмент', 'avg_mean': 'Среднее заказов в год'},
             color='segment',
-            color_discrete_map={
-                'A': '#FF6B6B',
-                'B': '#4ECDC4',
-                'C': '#FFE66D',
-                'U': '#95E1D3'
-            }
+            color_discrete_map=SEGMENT_COLORS
         )
         fig_avg_mean.update_traces(
             hovertemplate='<b>%{x}</b><br>Среднее заказов в год: %{y:.1f}<extra></extra>'
@@ -144,12 +173,7 @@ try:
         title='Total LTV по сегментам',
         labels={'segment': 'Сегмент', 'total_ltv': 'Total LTV (₽)'},
         color='segment',
-        color_discrete_map={
-            'A': '#FF6B6B',
-            'B': '#4ECDC4',
-            'C': '#FFE66D',
-            'U': '#95E1D3'
-        }
+        color_discrete_map=SEGMENT_COLORS
     )
     fig_total_ltv.update_traces(
         hovertemplate='<b>%{x}</b><br>Total LTV: %{y:,.0f} ₽<extra></extra>'
@@ -164,35 +188,13 @@ try:
 
     st.markdown("### 📸 Топ-5 типов съёмок по сегментам")
 
-    # Загрузить данные по типам съёмок для каждого сегмента
-    DB_PATH = ROOT_DIR / "platrum.db"
-    DATABASE_URL = f"sqlite:///{DB_PATH}"
-    engine = create_engine(DATABASE_URL)
+    segments = segment_labels(thresholds)
+    tabs = st.tabs([f"{SEGMENT_EMOJI[segment]} Сегмент {segment}" for segment in segments])
 
-    tabs = st.tabs(['🔴 Сегмент A', '🔵 Сегмент B', '🟡 Сегмент C', '🟢 Сегмент U'])
-
-    segments = ['A', 'B', 'C', 'U']
-    colors = ['#FF6B6B', '#4ECDC4', '#FFE66D', '#95E1D3']
-
-    for idx, (tab, segment, color) in enumerate(zip(tabs, segments, colors)):
+    for tab, segment in zip(tabs, segments):
+        color = SEGMENT_COLORS[segment]
         with tab:
-            query = """
-                SELECT
-                    primary_shooting_type as shooting_type,
-                    COUNT(*) as count,
-                    AVG(ltv) as avg_ltv,
-                    SUM(orders_count) as total_orders
-                FROM bitrix_companies
-                WHERE segment = :segment
-                  AND primary_shooting_type IS NOT NULL
-                  AND primary_shooting_type != ''
-                GROUP BY primary_shooting_type
-                ORDER BY count DESC
-                LIMIT 5
-            """
-
-            with engine.connect() as conn:
-                df_shooting = pd.read_sql_query(text(query), conn, params={'segment': segment})
+            df_shooting = load_segment_shooting_types(segment, thresholds=thresholds)
 
             if not df_shooting.empty:
                 col1, col2 = st.columns([2, 1])
@@ -224,77 +226,90 @@ try:
     st.divider()
 
     # ============================================================================
-    # ПРОГНОЗ: КТО МОЖЕТ ПЕРЕЙТИ В СЛЕДУЮЩИЙ СЕГМЕНТ
+    # RFM: ДАВНОСТЬ, ЧАСТОТА, СУММА ВНУТРИ СЕГМЕНТОВ
     # ============================================================================
 
-    st.markdown("### 🚀 Прогноз: Клиенты на грани перехода в следующий сегмент")
+    st.markdown("### 🧮 RFM-анализ")
 
-    st.info("""
-    💡 **Логика прогноза**: Клиенты, которые близки к порогу следующего сегмента.
+    rfm_grid = load_rfm_grid()
+    rfm_matrix = load_rfm_segment_matrix(thresholds=thresholds)
 
-    - **C → B**: LTV от 18,000 до 20,000 ₽ (осталось < 2,000 ₽)
-    - **B → A**: LTV от 90,000 до 100,000 ₽ (осталось < 10,000 ₽)
-    - **U → C**: LTV от 9,000 до 10,000 ₽ (осталось < 1,000 ₽)
-    """)
+    if not rfm_grid.empty:
+        col_left, col_right = st.columns([1, 1])
 
-    col1, col2, col3 = st.columns(3)
-
-    # C → B (18-20K)
-    with col1:
-        st.markdown("#### 🟡 → 🔵 C → B")
-        df_c_to_b = load_companies_dataframe(segment='C', min_ltv=18000, max_ltv=20000, limit=20)
-        if not df_c_to_b.empty:
-            st.metric("Клиентов на грани", len(df_c_to_b))
-            st.dataframe(
-                df_c_to_b[['title', 'ltv', 'orders_count']].head(10),
-                width="stretch",
-                hide_index=True,
-                column_config={
-                    'title': 'Компания',
-                    'ltv': st.column_config.NumberColumn('LTV', format="%.0f ₽"),
-                    'orders_count': 'Заказов'
-                }
+        with col_left:
+            grid = rfm_grid.pivot(index='f_score', columns='r_score', values='count').fillna(0)
+            fig_rfm = px.imshow(
+                grid.sort_index(ascending=False),
+                text_auto=True,
+                color_continuous_scale='Blues',
+                labels={'x': 'R — давность (5 = недавно)', 'y': 'F — частота (5 = часто)', 'color': 'Клиентов'},
+                title='Клиенты по ячейкам R × F',
+                aspect='auto'
             )
-        else:
-            st.info("Нет клиентов на грани перехода")
+            st.plotly_chart(fig_rfm, width="stretch")
+
+        with col_right:
+            st.markdown("#### 🎯 Группы RFM в сегментах A/B/C/U")
+            crosstab = rfm_matrix.pivot(index='rfm_segment', columns='segment', values='count').fillna(0).astype(int)
+            crosstab = crosstab.reindex([name for name in RFM_SEGMENT_ORDER if name in crosstab.index])
+            crosstab = crosstab[[label for label in segment_labels(thresholds) if label in crosstab.columns]]
+            crosstab.columns = [f"{SEGMENT_EMOJI[label]} {label}" for label in crosstab.columns]
+            crosstab['Всего'] = crosstab.sum(axis=1)
+            st.dataframe(crosstab.rename_axis('Группа RFM'), width="stretch")
+
+        st.caption(
+            "Баллы 1–5 — квинтили по всем клиентам: R — дней с последней сделки, "
+            "F — количество сделок, M — сумма сделок. Пересчитываются при новых сделках и раз в день."
+        )
+    else:
+        st.warning("⚠️ Нет сделок для RFM-скоринга")
 
-    # B → A (90-100K)
-    with col2:
-        st.markdown("#### 🔵 → 🔴 B → A")
-        df_b_to_a = load_companies_dataframe(segment='B', min_ltv=90000, max_ltv=100000, limit=20)
-        if not df_b_to_a.empty:
-            st.metric("Клиентов на грани", len(df_b_to_a))
-            st.dataframe(
-                df_b_to_a[['title', 'ltv', 'orders_count']].head(10),
-                width="stretch",
-                hide_index=True,
-                column_config={
-                    'title': 'Компания',
-                    'ltv': st.column_config.NumberColumn('LTV', format="%.0f ₽"),
-                    'orders_count': 'Заказов'
-                }
-            )
-        else:
-            st.info("Нет клиентов на грани перехода")
-
-    # U → C (9-10K)
-    with col3:
-        st.markdown("#### 🟢 → 🟡 U → C")
-        df_u_to_c = load_companies_dataframe(segment='U', min_ltv=9000, max_ltv=10000, limit=20)
-        if not df_u_to_c.empty:
-            st.metric("Клиентов на грани", len(df_u_to_c))
-            st.dataframe(
-                df_u_to_c[['title', 'ltv', 'orders_count']].head(10),
-                width="stretch",
-                hide_index=True,
-                column_config={
-                    'title': 'Компания',
-                    'ltv': st.column_config.NumberColumn('LTV', format="%.0f ₽"),
-                    'orders_count': 'Заказов'
-                }
+    st.divider()
+
+    # ============================================================================
+    # ПРОГНОЗ: КТО МОЖЕТ ПЕРЕЙТИ В СЛЕДУЮЩИЙ СЕГМЕНТ
+    # ============================================================================
+
+    st.markdown("### 🚀 Прогноз: Клиенты на грани перехода в следующий сегмент")
+
+    windows = transition_windows(thresholds)
+
+    st.info(
+        "💡 **Логика прогноза**: Клиенты, которые близки к порогу следующего сегмента "
+        f"(в пределах {TRANSITION_WINDOW:.0%} от порога).\n\n"
+        + "\n".join(
+            f"- **{source} → {target}**: LTV от {low:,.0f} до {high:,.0f} ₽ (осталось < {high - low:,.0f} ₽)"
+            for source, target, low, high in reversed(windows)
+        )
+    )
+
+    columns = st.columns(len(windows))
+
+    for column, (source, target, low, high) in zip(columns, reversed(windows)):
+        with column:
+            st.markdown(f"#### {SEGMENT_EMOJI[source]} → {SEGMENT_EMOJI[target]} {source} → {target}")
+            df_candidates = load_companies_dataframe(
+                segment=source,
+                min_ltv=low,
+                max_ltv=high,
+                limit=20,
+                thresholds=thresholds
             )
-        else:
-            st.info("Нет клиентов на грани перехода")
+            if not df_candidates.empty:
+                st.metric("Клиентов на грани", len(df_candidates))
+                st.dataframe(
+                    df_candidates[['title', 'ltv', 'orders_count']].head(10),
+                    width="stretch",
+                    hide_index=True,
+                    column_config={
+                        'title': 'Компания',
+                        'ltv': st.column_config.NumberColumn('LTV', format="%.0f ₽"),
+                        'orders_count': 'Заказов'
+                    }
+                )
+            else:
+                st.info("Нет клиентов на грани перехода")
 
 except Exception as e:
     st.error(f"❌ Ошибка загрузки данных: {e}")
@@ -14,8 +14,11 @@ import sys
 ROOT_DIR = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(ROOT_DIR))
 
-from dashboard.utils import load_shooting_type_stats
-from sqlalchemy import create_engine, text
+from dashboard.utils import (
+    load_shooting_type_stats,
+    load_shooting_type_segments
+)
+from dashboard.utils.segmentation import SEGMENT_COLORS, get_segment_thresholds
 
 st.set_page_config(page_title="Типы съёмок", page_icon="📸", layout="wide")
 
@@ -26,7 +29,7 @@ st.title("📸 Анализ типов съёмок")
 # ============================================================================
 
 try:
-    shooting_stats = load_shooting_type_stats()
+    shooting_stats = load_shooting_type_stats().copy(deep=False)
 
     # Добавляем процент
     total_clients = shooting_stats['count'].sum()
@@ -100,7 +103,7 @@ try:
 
     with col2:
         st.markdown("#### 📋 Топ-5 детально")
-        top_5 = top_10_shooting.head(5).copy()
+        top_5 = top_10_shooting.head(5).copy(deep=False)
         top_5['count'] = top_5['count'].apply(lambda x: f"{x:,}")
         top_5['percent'] = top_5['percent'].apply(lambda x: f"{x:.1f}%")
         top_5['avg_ltv'] = top_5['avg_ltv'].apply(lambda x: f"{x:,.0f} ₽")
@@ -188,12 +191,12 @@ try:
         help="Фильтровать типы съёмок по минимальному количеству клиентов"
     )
 
-    filtered_stats = shooting_stats[shooting_stats['count'] >= min_clients].copy()
+    filtered_stats = shooting_stats[shooting_stats['count'] >= min_clients].copy(deep=False)
 
     st.info(f"📊 Показано **{len(filtered_stats)}** типов съёмок (из {len(shooting_stats)} всего)")
 
     # Форматирование для отображения
-    display_stats = filtered_stats.copy()
+    display_stats = filtered_stats.copy(deep=False)
     display_stats['count'] = display_stats['count'].apply(lambda x: f"{x:,}")
     display_stats['total_ltv'] = display_stats['total_ltv'].apply(lambda x: f"{x:,.0f} ₽")
     display_stats['avg_ltv'] = display_stats['avg_ltv'].apply(lambda x: f"{x:,.0f} ₽")
@@ -231,30 +234,7 @@ try:
     )
 
     if selected_type:
-        DB_PATH = ROOT_DIR / "platrum.db"
-        DATABASE_URL = f"sqlite:///{DB_PATH}"
-        engine = create_engine(DATABASE_URL)
-
-        query = """
-            SELECT
-                segment,
-                COUNT(*) as count,
-                AVG(ltv) as avg_ltv,
-                SUM(orders_count) as total_orders
-            FROM bitrix_companies
-            WHERE primary_shooting_type = :shooting_type
-            GROUP BY segment
-            ORDER BY
-                CASE segment
-                    WHEN 'A' THEN 1
-                    WHEN 'B' THEN 2
-                    WHEN 'C' THEN 3
-                    WHEN 'U' THEN 4
-                END
-        """
-
-        with engine.connect() as conn:
-            df_segments = pd.read_sql_query(text(query), conn, params={'shooting_type': selected_type})
+        df_segments = load_shooting_type_segments(selected_type, thresholds=get_segment_thresholds())
 
         if not df_segments.empty:
             col1, col2 = st.columns([1, 1])
@@ -267,12 +247,7 @@ try:
                     names='segment',
                     title=f'Распределение клиентов по сегментам: {selected_type}',
                     color='segment',
-                    color_discrete_map={
-                        'A': '#FF6B6B',
-                        'B': '#4ECDC4',
-                        'C': '#FFE66D',
-                        'U': '#95E1D3'
-                    },
+                    color_discrete_map=SEGMENT_COLORS,
                     hole=0.4
                 )
                 fig_pie.update_traces(
@@ -285,7 +260,7 @@ try:
             with col2:
                 # Таблица статистики
                 st.markdown("#### 📊 Статистика по сегментам")
-                display_segments = df_segments.copy()
+                display_segments = df_segments.copy(deep=False)
                 display_segments['count'] = display_segments['count'].apply(lambda x: f"{x:,}")
                 display_segments['avg_ltv'] = display_segments['avg_ltv'].apply(lambda x: f"{x:,.0f} ₽")
                 display_segments['total_orders'] = display_segments['total_orders'].apply(lambda x: f"{x:,}")
@@ -1,7 +1,9 @@
 """
 Страница "Тренды" - временной анализ
 
-LTV по месяцам, количество заказов, сезонность.
+LTV по месяцам, количество заказов, сезонность, дневная и недельная
+динамика с прореживанием LTTB и приближением выделенного диапазона,
+перекрёстный срез по сегментам и типам съёмок из куба продаж.
 """
 import streamlit as st
 import plotly.express as px
@@ -15,13 +17,51 @@ from datetime import datetime
 ROOT_DIR = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(ROOT_DIR))
 
-from dashboard.utils import load_ltv_trend
-from sqlalchemy import create_engine, text
+from dashboard.utils import (
+    load_ltv_trend,
+    load_monthly_trend,
+    load_ltv_trend_approx,
+    load_monthly_trend_approx,
+    load_ltv_trend_sampled
+)
+from dashboard.utils.cube import CUBE_DIMENSIONS, CUBE_MEASURES, load_cube
+from dashboard.utils.date_range import ALL_TIME, describe_date_range, render_date_range_filter
+from dashboard.utils.figures import cached_figure
+from dashboard.utils.segmentation import SEGMENT_COLORS, get_segment_thresholds
+from dashboard.utils.sketches import HLL_RELATIVE_ERROR
+from dashboard.utils.timeseries import (
+    DEFAULT_MAX_POINTS,
+    GRANULARITIES,
+    downsample_timeseries,
+    load_revenue_timeseries
+)
 
 st.set_page_config(page_title="Тренды", page_icon="📉", layout="wide")
 
 st.title("📉 Тренды и динамика")
 
+# ============================================================================
+# ПЕРИОД И РЕЖИМ РАСЧЁТА
+# ============================================================================
+
+thresholds = get_segment_thresholds()
+date_range = render_date_range_filter()
+date_from, date_to = date_range
+
+if date_range != ALL_TIME:
+    st.caption(f"📅 Период анализа: {describe_date_range(date_from, date_to)}")
+
+st.sidebar.markdown("### ⚡ Режим расчёта")
+approx_mode = st.sidebar.toggle(
+    "Приближённый режим",
+    value=False,
+    help=f"Количество клиентов по HyperLogLog-скетчам (±{HLL_RELATIVE_ERROR:.1%}) вместо COUNT(DISTINCT). "
+         "Выручка и количество сделок остаются точными."
+)
+
+if approx_mode:
+    st.caption(f"⚡ Приближённый режим: число клиентов — оценка HyperLogLog (±{HLL_RELATIVE_ERROR:.1%})")
+
 # ============================================================================
 # ТРЕНД ВЫРУЧКИ ПО ГОДАМ
 # ============================================================================
@@ -29,60 +69,66 @@ st.title("📉 Тренды и динамика")
 st.markdown("### 📈 Динамика выручки по годам")
 
 try:
-    ltv_trend = load_ltv_trend()
+    if approx_mode:
+        ltv_trend = load_ltv_trend_approx(date_from, date_to).copy(deep=False)
+    else:
+        ltv_trend = load_ltv_trend(date_from, date_to).copy(deep=False)
 
     if not ltv_trend.empty:
         # График с двумя осями: выручка и количество сделок
-        fig = go.Figure()
-
-        # Выручка (левая ось)
-        fig.add_trace(go.Scatter(
-            x=ltv_trend['year'],
-            y=ltv_trend['total_revenue'],
-            mode='lines+markers',
-            name='Выручка',
-            line=dict(color='#4ECDC4', width=3),
-            marker=dict(size=10),
-            yaxis='y',
-            hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<extra></extra>'
-        ))
-
-        # Количество сделок (правая ось)
-        fig.add_trace(go.Scatter(
-            x=ltv_trend['year'],
-            y=ltv_trend['deals_count'],
-            mode='lines+markers',
-            name='Количество сделок',
-            line=dict(color='#FF6B6B', width=3, dash='dash'),
-            marker=dict(size=10, symbol='diamond'),
-            yaxis='y2',
-            hovertemplate='<b>%{x}</b><br>Сделок: %{y:,}<extra></extra>'
-        ))
-
-        # Настройка осей
-        fig.update_layout(
-            title='Тренд выручки и количества сделок по годам',
-            xaxis_title='Год',
-            yaxis=dict(
-                title=dict(text='Выручка (₽)', font=dict(color='#4ECDC4')),
-                tickfont=dict(color='#4ECDC4')
-            ),
-            yaxis2=dict(
-                title=dict(text='Количество сделок', font=dict(color='#FF6B6B')),
-                tickfont=dict(color='#FF6B6B'),
-                overlaying='y',
-                side='right'
-            ),
-            hovermode='x unified',
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
+        def build_yearly_figure():
+            fig = go.Figure()
+
+            # Выручка (левая ось)
+            fig.add_trace(go.Scatter(
+                x=ltv_trend['year'],
+                y=ltv_trend['total_revenue'],
+                mode='lines+markers',
+                name='Выручка',
+                line=dict(color='#4ECDC4', width=3),
+                marker=dict(size=10),
+                yaxis='y',
+                hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<extra></extra>'
+            ))
+
+            # Количество сделок (правая ось)
+            fig.add_trace(go.Scatter(
+                x=ltv_trend['year'],
+                y=ltv_trend['deals_count'],
+                mode='lines+markers',
+                name='Количество сделок',
+                line=dict(color='#FF6B6B', width=3, dash='dash'),
+                marker=dict(size=10, symbol='diamond'),
+                yaxis='y2',
+                hovertemplate='<b>%{x}</b><br>Сделок: %{y:,}<extra></extra>'
+            ))
+
+            # Настройка осей
+            fig.update_layout(
+                title='Тренд выручки и количества сделок по годам',
+                xaxis_title='Год',
+                yaxis=dict(
+                    title=dict(text='Выручка (₽)', font=dict(color='#4ECDC4')),
+                    tickfont=dict(color='#4ECDC4')
+                ),
+                yaxis2=dict(
+                    title=dict(text='Количество сделок', font=dict(color='#FF6B6B')),
+                    tickfont=dict(color='#FF6B6B'),
+                    overlaying='y',
+                    side='right'
+                ),
+                hovermode='x unified',
+                legend=dict(
+                    orientation="h",
+                    yanchor="bottom",
+                    y=1.02,
+                    xanchor="right",
+                    x=1
+                )
             )
-        )
+            return fig
 
+        fig = cached_figure("trends.yearly", (approx_mode, date_from, date_to), build_yearly_figure)
         st.plotly_chart(fig, width="stretch")
 
         # Статистика по годам
@@ -121,56 +167,85 @@ try:
             st.metric(
                 label="💰 Total выручка",
                 value=f"{total_revenue:,.0f} ₽",
-                help="Общая выручка за все годы"
+                help="Общая выручка за выбранный период"
             )
 
+        if approx_mode:
+            with st.expander("🎲 Выборочная оценка выручки"):
+                sample_percent = st.slider(
+                    "Размер выборки (% сделок)",
+                    min_value=1,
+                    max_value=100,
+                    value=10,
+                    help="Выручка оценивается по случайной выборке сделок с 95% доверительным интервалом"
+                )
+                sampled = load_ltv_trend_sampled(
+                    sample_rate=sample_percent / 100,
+                    date_from=date_from,
+                    date_to=date_to
+                )
+
+                def build_sampled_figure():
+                    fig_sampled = go.Figure(go.Bar(
+                        x=sampled['year'],
+                        y=sampled['total_revenue'],
+                        marker_color='#4ECDC4',
+                        error_y=dict(
+                            type='data',
+                            symmetric=False,
+                            array=sampled['revenue_high'] - sampled['total_revenue'],
+                            arrayminus=sampled['total_revenue'] - sampled['revenue_low']
+                        ),
+                        hovertemplate='<b>%{x}</b><br>Оценка выручки: %{y:,.0f} ₽<extra></extra>'
+                    ))
+                    fig_sampled.update_layout(
+                        title=f'Оценка выручки по выборке {sample_percent}% сделок (95% интервал)',
+                        xaxis_title='Год',
+                        yaxis_title='Выручка (₽)'
+                    )
+                    return fig_sampled
+
+                fig_sampled = cached_figure("trends.sampled", (sample_percent, date_from, date_to), build_sampled_figure)
+                st.plotly_chart(fig_sampled, width="stretch")
+
         st.divider()
 
         # ============================================================================
         # ПОМЕСЯЧНЫЙ АНАЛИЗ
         # ============================================================================
 
-        st.markdown("### 📅 Помесячный анализ (последние 24 месяца)")
-
-        DB_PATH = ROOT_DIR / "platrum.db"
-        DATABASE_URL = f"sqlite:///{DB_PATH}"
-        engine = create_engine(DATABASE_URL)
-
-        query = """
-            SELECT
-                strftime('%Y-%m', close_date) as month,
-                COUNT(DISTINCT company_id) as companies,
-                SUM(opportunity) as revenue,
-                COUNT(*) as deals_count
-            FROM bitrix_deals
-            WHERE close_date IS NOT NULL
-              AND close_date >= date('now', '-24 months')
-            GROUP BY month
-            ORDER BY month
-        """
+        if date_from is None:
+            st.markdown("### 📅 Помесячный анализ (последние 24 месяца)")
+        else:
+            st.markdown(f"### 📅 Помесячный анализ ({describe_date_range(date_from, date_to)})")
 
-        with engine.connect() as conn:
-            df_monthly = pd.read_sql_query(text(query), conn)
+        if approx_mode:
+            df_monthly = load_monthly_trend_approx(months=24, date_from=date_from, date_to=date_to).copy(deep=False)
+        else:
+            df_monthly = load_monthly_trend(months=24, date_from=date_from, date_to=date_to).copy(deep=False)
 
         if not df_monthly.empty:
             # График помесячной выручки
-            fig_monthly = go.Figure()
-
-            fig_monthly.add_trace(go.Bar(
-                x=df_monthly['month'],
-                y=df_monthly['revenue'],
-                name='Выручка',
-                marker_color='#4ECDC4',
-                hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<extra></extra>'
-            ))
-
-            fig_monthly.update_layout(
-                title='Помесячная выручка (последние 24 месяца)',
-                xaxis_title='Месяц',
-                yaxis_title='Выручка (₽)',
-                hovermode='x unified'
-            )
+            def build_monthly_figure():
+                fig_monthly = go.Figure()
+
+                fig_monthly.add_trace(go.Bar(
+                    x=df_monthly['month'],
+                    y=df_monthly['revenue'],
+                    name='Выручка',
+                    marker_color='#4ECDC4',
+                    hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<extra></extra>'
+                ))
+
+                fig_monthly.update_layout(
+                    title='Помесячная выручка (последние 24 месяца)',
+                    xaxis_title='Месяц',
+                    yaxis_title='Выручка (₽)',
+                    hovermode='x unified'
+                )
+                return fig_monthly
 
+            fig_monthly = cached_figure("trends.monthly", (approx_mode, date_from, date_to), build_monthly_figure)
             st.plotly_chart(fig_monthly, width="stretch")
 
             # Статистика по месяцам
@@ -231,34 +306,42 @@ try:
 
             with col1:
                 # График сезонности выручки
-                fig_season_revenue = px.bar(
-                    seasonality,
-                    x='month_name',
-                    y='revenue',
-                    title='Средняя выручка по месяцам года',
-                    labels={'month_name': 'Месяц', 'revenue': 'Средняя выручка (₽)'},
-                    color='revenue',
-                    color_continuous_scale='Blues'
-                )
-                fig_season_revenue.update_traces(
-                    hovertemplate='<b>%{x}</b><br>Средняя выручка: %{y:,.0f} ₽<extra></extra>'
-                )
+                def build_season_revenue_figure():
+                    fig_season_revenue = px.bar(
+                        seasonality,
+                        x='month_name',
+                        y='revenue',
+                        title='Средняя выручка по месяцам года',
+                        labels={'month_name': 'Месяц', 'revenue': 'Средняя выручка (₽)'},
+                        color='revenue',
+                        color_continuous_scale='Blues'
+                    )
+                    fig_season_revenue.update_traces(
+                        hovertemplate='<b>%{x}</b><br>Средняя выручка: %{y:,.0f} ₽<extra></extra>'
+                    )
+                    return fig_season_revenue
+
+                fig_season_revenue = cached_figure("trends.season_revenue", (approx_mode, date_from, date_to), build_season_revenue_figure)
                 st.plotly_chart(fig_season_revenue, width="stretch")
 
             with col2:
                 # График сезонности количества сделок
-                fig_season_deals = px.bar(
-                    seasonality,
-                    x='month_name',
-                    y='deals_count',
-                    title='Среднее количество сделок по месяцам года',
-                    labels={'month_name': 'Месяц', 'deals_count': 'Среднее кол-во сделок'},
-                    color='deals_count',
-                    color_continuous_scale='Greens'
-                )
-                fig_season_deals.update_traces(
-                    hovertemplate='<b>%{x}</b><br>Среднее сделок: %{y:.1f}<extra></extra>'
-                )
+                def build_season_deals_figure():
+                    fig_season_deals = px.bar(
+                        seasonality,
+                        x='month_name',
+                        y='deals_count',
+                        title='Среднее количество сделок по месяцам года',
+                        labels={'month_name': 'Месяц', 'deals_count': 'Среднее кол-во сделок'},
+                        color='deals_count',
+                        color_continuous_scale='Greens'
+                    )
+                    fig_season_deals.update_traces(
+                        hovertemplate='<b>%{x}</b><br>Среднее сделок: %{y:.1f}<extra></extra>'
+                    )
+                    return fig_season_deals
+
+                fig_season_deals = cached_figure("trends.season_deals", (approx_mode, date_from, date_to), build_season_deals_figure)
                 st.plotly_chart(fig_season_deals, width="stretch")
 
             # Топ-3 и низ-3 месяца
@@ -286,6 +369,193 @@ try:
 
     st.divider()
 
+    # ============================================================================
+    # ДЕТАЛЬНАЯ ДИНАМИКА: ДНИ И НЕДЕЛИ
+    # ============================================================================
+
+    st.markdown("### 🔬 Детальная динамика по дням и неделям")
+
+    col1, col2, col3 = st.columns([1, 1, 2])
+
+    with col1:
+        granularity = st.radio(
+            "Шаг",
+            list(GRANULARITIES),
+            format_func=lambda key: GRANULARITIES[key][0],
+            horizontal=True
+        )
+
+    with col2:
+        split_by_segment = st.toggle("По сегментам", value=False)
+
+    with col3:
+        max_points = st.slider(
+            "Точек на ряд",
+            min_value=200,
+            max_value=3000,
+            value=DEFAULT_MAX_POINTS,
+            step=100,
+            help="Ряд прореживается (LTTB) примерно до ширины графика в пикселях: "
+                 "форма кривой сохраняется, а в браузер уходит меньше данных"
+        )
+
+    # Приближение хранится вместе с периодом анализа, для которого оно выбрано
+    zoom = st.session_state.get("trend_zoom")
+    if zoom is not None and zoom[0] != date_range:
+        zoom = None
+    visible_from, visible_to = zoom[1] if zoom else date_range
+
+    by = 'segment' if split_by_segment else None
+    series_thresholds = thresholds if split_by_segment else None
+
+    # Запрашивается только видимый диапазон
+    detail = load_revenue_timeseries(granularity, visible_from, visible_to, by, series_thresholds)
+    detail_chart = downsample_timeseries(detail, max_points=max_points, by=by)
+
+    if not detail.empty:
+        def build_detail_figure():
+            fig_detail = px.line(
+                detail_chart,
+                x='period',
+                y='revenue',
+                color=by,
+                color_discrete_map=SEGMENT_COLORS,
+                labels={'period': 'Дата', 'revenue': 'Выручка (₽)', 'segment': 'Сегмент'},
+                title=f"Выручка по {'дням' if granularity == 'day' else 'неделям'}"
+            )
+            fig_detail.update_traces(hovertemplate='%{x|%d.%m.%Y}<br>Выручка: %{y:,.0f} ₽')
+            fig_detail.update_layout(hovermode='x unified', dragmode='select', selectdirection='h')
+            return fig_detail
+
+        fig_detail = cached_figure(
+            "trends.detail",
+            (granularity, by, series_thresholds, visible_from, visible_to, max_points),
+            build_detail_figure
+        )
+        event = st.plotly_chart(
+            fig_detail,
+            width="stretch",
+            key="trend_detail",
+            on_select="rerun",
+            selection_mode="box"
+        )
+
+        # Выделение рамкой по оси X — новый видимый диапазон, запрашиваемый заново
+        boxes = event.selection.get("box", []) if event else []
+        if boxes:
+            x_range = sorted(pd.to_datetime(boxes[0]["x"]))
+            selected = (x_range[0].date().isoformat(), x_range[-1].date().isoformat())
+            if selected != (visible_from, visible_to):
+                st.session_state["trend_zoom"] = (date_range, selected)
+                st.rerun()
+
+        caption = (
+            f"Показано {len(detail_chart):,} из {len(detail):,} точек · "
+            "выделите участок графика рамкой, чтобы загрузить его подробнее"
+        )
+        if zoom:
+            caption = f"🔍 {describe_date_range(visible_from, visible_to)} · " + caption
+        st.caption(caption)
+    else:
+        st.warning("⚠️ Нет сделок в выбранном диапазоне")
+
+    if zoom and st.button("↩️ Сбросить приближение"):
+        st.session_state.pop("trend_zoom", None)
+        st.rerun()
+
+    st.divider()
+
+    # ============================================================================
+    # ПЕРЕКРЁСТНЫЙ СРЕЗ: СЕГМЕНТ × ТИП СЪЁМКИ
+    # ============================================================================
+
+    st.markdown("### 🧊 Перекрёстный срез")
+    st.caption("Сегменты по сохранённой сегментации, данные — из предагрегированного куба продаж")
+
+    cube_options = load_cube(("segment", "shooting_type"))
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        cube_segments = st.multiselect(
+            "Сегменты",
+            sorted(cube_options['segment'].unique()),
+            placeholder="Все сегменты"
+        )
+
+    with col2:
+        cube_types = st.multiselect(
+            "Типы съёмок",
+            sorted(cube_options['shooting_type'].unique()),
+            placeholder="Все типы съёмок"
+        )
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        cube_step = st.radio(
+            "Шаг",
+            ["month", "year"],
+            format_func=lambda key: CUBE_DIMENSIONS[key][0],
+            horizontal=True,
+            key="cube_step"
+        )
+
+    with col2:
+        cube_split = st.selectbox(
+            "Разбить по",
+            [None, "segment", "shooting_type"],
+            format_func=lambda key: CUBE_DIMENSIONS[key][0] if key else "—"
+        )
+
+    with col3:
+        cube_measure = st.selectbox(
+            "Показатель",
+            list(CUBE_MEASURES),
+            format_func=CUBE_MEASURES.get
+        )
+
+    cube_group = (cube_step, cube_split) if cube_split else (cube_step,)
+    cube_df = load_cube(
+        cube_group,
+        tuple(cube_segments) or None,
+        tuple(cube_types) or None,
+        date_from,
+        date_to
+    )
+
+    if not cube_df.empty:
+        def build_cube_figure():
+            fig_cube = px.bar(
+                cube_df,
+                x=cube_step,
+                y=cube_measure,
+                color=cube_split,
+                color_discrete_map=SEGMENT_COLORS if cube_split == 'segment' else None,
+                labels={key: label for key, (label, _) in CUBE_DIMENSIONS.items()} | CUBE_MEASURES,
+                title=f"{CUBE_MEASURES[cube_measure]} по {'месяцам' if cube_step == 'month' else 'годам'}"
+            )
+            fig_cube.update_layout(hovermode='x unified', barmode='stack')
+            return fig_cube
+
+        fig_cube = cached_figure(
+            "trends.cube",
+            (cube_group, tuple(cube_segments), tuple(cube_types), cube_measure, date_from, date_to),
+            build_cube_figure
+        )
+        st.plotly_chart(fig_cube, width="stretch")
+
+        cube_total = load_cube((), tuple(cube_segments) or None, tuple(cube_types) or None, date_from, date_to)
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("💰 Выручка", f"{cube_total['revenue'].iloc[0]:,.0f} ₽")
+        col2.metric("🧾 Сделок", f"{cube_total['deals'].iloc[0]:,}")
+        col3.metric("📦 Заказов", f"{cube_total['orders'].iloc[0]:,}")
+        col4.metric("👥 Компаний", f"{cube_total['companies'].iloc[0]:,}")
+    else:
+        st.warning("⚠️ Нет сделок для выбранного среза")
+
+    st.divider()
+
     # ============================================================================
     # ПРОГНОЗ НА СЛЕДУЮЩИЙ ГОД (ПРОСТОЙ LINEAR TREND)
     # ============================================================================
@@ -348,44 +618,47 @@ try:
             )
 
         # График с прогнозом
-        fig_forecast = go.Figure()
-
-        # Исторические данные
-        fig_forecast.add_trace(go.Scatter(
-            x=ltv_trend['year'],
-            y=ltv_trend['total_revenue'],
-            mode='lines+markers',
-            name='Фактическая выручка',
-            line=dict(color='#4ECDC4', width=3),
-            marker=dict(size=10)
-        ))
-
-        # Линия тренда
-        trend_line = model.predict(X)
-        fig_forecast.add_trace(go.Scatter(
-            x=ltv_trend['year'],
-            y=trend_line,
-            mode='lines',
-            name='Линия тренда',
-            line=dict(color='#95E1D3', width=2, dash='dash')
-        ))
-
-        # Прогноз
-        fig_forecast.add_trace(go.Scatter(
-            x=[str(next_year)],
-            y=[forecast_revenue],
-            mode='markers',
-            name='Прогноз',
-            marker=dict(size=15, color='#FF6B6B', symbol='star')
-        ))
-
-        fig_forecast.update_layout(
-            title='Выручка с прогнозом на следующий год',
-            xaxis_title='Год',
-            yaxis_title='Выручка (₽)',
-            hovermode='x unified'
-        )
+        def build_forecast_figure():
+            fig_forecast = go.Figure()
+
+            # Исторические данные
+            fig_forecast.add_trace(go.Scatter(
+                x=ltv_trend['year'],
+                y=ltv_trend['total_revenue'],
+                mode='lines+markers',
+                name='Фактическая выручка',
+                line=dict(color='#4ECDC4', width=3),
+                marker=dict(size=10)
+            ))
+
+            # Линия тренда
+            trend_line = model.predict(X)
+            fig_forecast.add_trace(go.Scatter(
+                x=ltv_trend['year'],
+                y=trend_line,
+                mode='lines',
+                name='Линия тренда',
+                line=dict(color='#95E1D3', width=2, dash='dash')
+            ))
+
+            # Прогноз
+            fig_forecast.add_trace(go.Scatter(
+                x=[str(next_year)],
+                y=[forecast_revenue],
+                mode='markers',
+                name='Прогноз',
+                marker=dict(size=15, color='#FF6B6B', symbol='star')
+            ))
+
+            fig_forecast.update_layout(
+                title='Выручка с прогнозом на следующий год',
+                xaxis_title='Год',
+                yaxis_title='Выручка (₽)',
+                hovermode='x unified'
+            )
+            return fig_forecast
 
+        fig_forecast = cached_figure("trends.forecast", (approx_mode, date_from, date_to), build_forecast_figure)
         st.plotly_chart(fig_forecast, width="stretch")
 
         st.warning("⚠️ **Примечание**: Этот прогноз является упрощённым и служит для ориентировочной оценки. Для точного планирования рекомендуется использовать более сложные модели с учётом сезонности, маркетинговых активностей и экономической ситуации.")
@@ -0,0 +1,187 @@
+"""
+Страница "Сверка данных" - контроль качества LTV
+
+Сравнение сохранённых LTV / количества заказов в bitrix_companies
+с суммами сделок в bitrix_deals, сделки без компании.
+"""
+import streamlit as st
+import plotly.express as px
+import pandas as pd
+from pathlib import Path
+import sys
+from io import BytesIO
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dashboard.utils import (
+    run_ltv_reconciliation,
+    load_reconciliation_summary,
+    load_reconciliation_report
+)
+from dashboard.utils.cache import get_data_version
+from dashboard.utils.reconciliation import ISSUE_LABELS
+from dashboard.utils.session_memory import session_memory
+
+st.set_page_config(page_title="Сверка данных", page_icon="🧮", layout="wide")
+
+st.title("🧮 Сверка LTV со сделками")
+
+# ============================================================================
+# ЗАПУСК СВЕРКИ
+# ============================================================================
+
+st.sidebar.markdown("### ▶️ Запуск сверки")
+
+tolerance = st.sidebar.number_input(
+    "Допустимое расхождение LTV (₽)",
+    min_value=0.0,
+    value=0.01,
+    step=1.0,
+    help="Расхождения меньше этого значения не считаются ошибкой"
+)
+
+run_incremental = st.sidebar.button(
+    "⚡ Проверить изменения",
+    help="Проверить только компании с новыми сделками или записями после прошлого запуска"
+)
+run_full = st.sidebar.button(
+    "🔄 Полная сверка",
+    help="Пересчитать отчёт по всем компаниям"
+)
+
+try:
+    if run_incremental or run_full:
+        with st.spinner("Выполняется сверка..."):
+            result = run_ltv_reconciliation(incremental=run_incremental, tolerance=tolerance)
+        mode_label = "инкрементальная" if result['mode'] == 'incremental' else "полная"
+        st.success(
+            f"✅ Сверка ({mode_label}) завершена: проверено {result['checked']:,} компаний, "
+            f"найдено {result['issues_found']:,} расхождений"
+        )
+
+    summary = load_reconciliation_summary()
+
+    if summary['last_run'] is None:
+        st.info("💡 Сверка ещё не запускалась. Нажмите «Полная сверка» в боковой панели.")
+        st.stop()
+
+    # ============================================================================
+    # СВОДКА
+    # ============================================================================
+
+    st.markdown("### 📊 Сводка")
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.metric(
+            label="🕒 Последний запуск",
+            value=summary['last_run'].replace('T', ' '),
+            help="Время последней сверки"
+        )
+
+    with col2:
+        st.metric(
+            label="⚠️ Всего расхождений",
+            value=f"{summary['total_issues']:,}",
+            help="Компаний с расхождениями и идентификаторов сделок без компании"
+        )
+
+    with col3:
+        st.metric(
+            label="👻 Сделки без компании",
+            value=f"{summary['issues'].get('orphan_deals', 0):,}",
+            help="company_id в bitrix_deals, которых нет в bitrix_companies"
+        )
+
+    with col4:
+        st.metric(
+            label="💰 Сумма расхождений LTV",
+            value=f"{summary['total_abs_ltv_diff']:,.0f} ₽",
+            help="Сумма модулей разницы между сохранённым LTV и суммой сделок"
+        )
+
+    if summary['issues']:
+        issues_df = pd.DataFrame(
+            [(ISSUE_LABELS.get(issue, issue), count) for issue, count in summary['issues'].items()],
+            columns=['issue', 'count']
+        )
+        fig_issues = px.bar(
+            issues_df,
+            x='count',
+            y='issue',
+            orientation='h',
+            title='Расхождения по типам',
+            labels={'count': 'Количество', 'issue': 'Тип расхождения'},
+            color_discrete_sequence=['#FF6B6B']
+        )
+        fig_issues.update_layout(yaxis={'categoryorder': 'total ascending'})
+        fig_issues.update_traces(
+            hovertemplate='<b>%{y}</b><br>Количество: %{x:,}<extra></extra>'
+        )
+        st.plotly_chart(fig_issues, width="stretch")
+
+    st.divider()
+
+    # ============================================================================
+    # ОТЧЁТ
+    # ============================================================================
+
+    st.markdown("### 📋 Отчёт о расхождениях")
+
+    issue_options = ['Все'] + list(ISSUE_LABELS)
+    selected_issue = st.selectbox(
+        "Тип расхождения",
+        issue_options,
+        format_func=lambda x: x if x == 'Все' else ISSUE_LABELS[x]
+    )
+
+    report = load_reconciliation_report(issue=None if selected_issue == 'Все' else selected_issue)
+
+    if not report.empty:
+        report_display = report.copy(deep=False)
+        report_display['issue'] = report_display['issue'].map(ISSUE_LABELS)
+        report_display['title'] = report_display['title'].fillna('—')
+
+        st.dataframe(
+            report_display,
+            width="stretch",
+            hide_index=True,
+            height=600,
+            column_config={
+                'company_id': 'Bitrix ID',
+                'title': 'Компания',
+                'issue': 'Проблема',
+                'stored_ltv': st.column_config.NumberColumn('LTV (компания)', format="%.0f ₽"),
+                'deals_ltv': st.column_config.NumberColumn('LTV (сделки)', format="%.0f ₽"),
+                'ltv_diff': st.column_config.NumberColumn('Разница LTV', format="%.0f ₽"),
+                'stored_orders': 'Заказов (компания)',
+                'deals_count': 'Сделок',
+                'orders_diff': 'Разница заказов',
+                'checked_at': 'Проверено'
+            }
+        )
+
+        def build_excel() -> bytes:
+            output = BytesIO()
+            with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                report.to_excel(writer, index=False, sheet_name='Сверка')
+            return output.getvalue()
+
+        # Файл собирается по нажатию и хранится в памяти сессии (в пределах бюджета)
+        memory = session_memory()
+        selection = (get_data_version(), selected_issue)
+        st.download_button(
+            label="📥 Скачать отчёт в Excel",
+            data=lambda: memory.cached("reconciliation_excel", selection, build_excel),
+            file_name=f"fotofactor_reconciliation_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+    else:
+        st.success("✅ Расхождений не найдено")
+
+except Exception as e:
+    st.error(f"❌ Ошибка загрузки данных: {e}")
+    st.exception(e)
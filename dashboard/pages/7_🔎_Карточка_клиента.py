@@ -0,0 +1,235 @@
+"""
+Страница "Карточка клиента" - детализация по одной компании
+
+Хронология сделок, выручка по годам, интервалы между заказами.
+Открывается по ссылке из таблиц "Обзор" и "Клиенты" (?company=<bitrix_id>).
+"""
+import streamlit as st
+import plotly.express as px
+import plotly.graph_objects as go
+import pandas as pd
+from pathlib import Path
+import sys
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dashboard.utils import (
+    load_company_profile,
+    load_company_deals,
+    search_companies
+)
+from dashboard.utils.date_range import ALL_TIME, describe_date_range, render_date_range_filter
+from dashboard.utils.segmentation import SEGMENT_COLORS
+
+st.set_page_config(page_title="Карточка клиента", page_icon="🔎", layout="wide")
+
+st.title("🔎 Карточка клиента")
+
+# ============================================================================
+# ВЫБОР КЛИЕНТА
+# ============================================================================
+
+st.sidebar.markdown("### 🔎 Выбор клиента")
+search_query = st.sidebar.text_input(
+    "Поиск по названию",
+    placeholder="Например: ГЕЙДАРОВ",
+    help="Найти клиента по части названия"
+)
+
+if search_query:
+    found = search_companies(search_query, limit=50)
+    if not found.empty:
+        options = dict(zip(found['bitrix_id'], found['title']))
+        picked = st.sidebar.selectbox(
+            "Найденные клиенты",
+            list(options),
+            format_func=lambda x: f"{options[x]} ({x})"
+        )
+        if picked and picked != st.query_params.get("company"):
+            st.query_params["company"] = picked
+    else:
+        st.sidebar.warning("Ничего не найдено")
+
+date_from, date_to = render_date_range_filter()
+
+bitrix_id = st.query_params.get("company")
+
+if not bitrix_id:
+    st.info("💡 Откройте карточку по ссылке из таблиц на страницах «Обзор» и «Клиенты» или найдите клиента в боковой панели.")
+    st.stop()
+
+try:
+    profile = load_company_profile(bitrix_id)
+
+    if profile is None:
+        st.warning(f"⚠️ Клиент с Bitrix ID {bitrix_id} не найден")
+        st.stop()
+
+    st.markdown(f"## {profile['title']}")
+    st.caption(
+        f"Bitrix ID: {profile['bitrix_id']} · Сегмент: {profile['segment'] or '—'} · "
+        f"Тип съёмки: {profile['primary_shooting_type'] or '—'}"
+    )
+
+    if (date_from, date_to) != ALL_TIME:
+        st.caption(f"📅 Сделки за период: {describe_date_range(date_from, date_to)}")
+
+    deals = load_company_deals(bitrix_id, date_from, date_to)
+    dated = deals.dropna(subset=['close_date'])
+
+    # ============================================================================
+    # KPI КАРТОЧКИ
+    # ============================================================================
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.metric(
+            label="💰 LTV",
+            value=f"{profile['ltv'] or 0:,.0f} ₽",
+            delta=f"{deals['opportunity'].sum():,.0f} ₽ по сделкам",
+            delta_color="off",
+            help="Сохранённый LTV компании и сумма её сделок"
+        )
+
+    with col2:
+        st.metric(
+            label="📦 Сделок",
+            value=f"{len(deals):,}",
+            delta=f"{profile['orders_count'] or 0:,} заказов в карточке",
+            delta_color="off",
+            help="Количество сделок в bitrix_deals"
+        )
+
+    with col3:
+        st.metric(
+            label="📅 Последняя сделка",
+            value=dated['close_date'].max().strftime('%Y-%m-%d') if not dated.empty else "—",
+            delta=f"первая {dated['close_date'].min().strftime('%Y-%m-%d')}" if not dated.empty else None,
+            delta_color="off",
+            help="Даты первой и последней закрытой сделки"
+        )
+
+    gaps = dated['close_date'].diff().dt.days.dropna()
+
+    with col4:
+        st.metric(
+            label="⏱️ Медианный интервал",
+            value=f"{gaps.median():.0f} дн." if not gaps.empty else "—",
+            help="Медиана дней между соседними сделками"
+        )
+
+    if deals.empty:
+        st.warning("⚠️ У клиента нет сделок в bitrix_deals")
+        st.stop()
+
+    st.divider()
+
+    # ============================================================================
+    # ХРОНОЛОГИЯ СДЕЛОК
+    # ============================================================================
+
+    st.markdown("### 🕒 Хронология сделок")
+
+    color = SEGMENT_COLORS.get(profile['segment'], '#4ECDC4')
+
+    fig_timeline = go.Figure()
+    fig_timeline.add_trace(go.Scatter(
+        x=dated['close_date'],
+        y=dated['opportunity'],
+        mode='markers+lines',
+        name='Сделка',
+        line=dict(color=color, width=1),
+        marker=dict(size=10, color=color),
+        customdata=dated[['title', 'stage']],
+        hovertemplate='<b>%{x|%Y-%m-%d}</b><br>%{customdata[0]}<br>Сумма: %{y:,.0f} ₽<br>Стадия: %{customdata[1]}<extra></extra>'
+    ))
+    fig_timeline.update_layout(
+        title='Сделки по датам закрытия',
+        xaxis_title='Дата закрытия',
+        yaxis_title='Сумма сделки (₽)',
+        hovermode='closest'
+    )
+    st.plotly_chart(fig_timeline, width="stretch")
+
+    col1, col2 = st.columns(2)
+
+    # ============================================================================
+    # ВЫРУЧКА ПО ГОДАМ
+    # ============================================================================
+
+    with col1:
+        st.markdown("#### 📈 Выручка по годам")
+        yearly = dated.groupby(dated['close_date'].dt.year).agg(
+            revenue=('opportunity', 'sum'),
+            deals_count=('opportunity', 'size')
+        ).reset_index().rename(columns={'close_date': 'year'})
+        yearly['year'] = yearly['year'].astype(str)
+
+        fig_yearly = px.bar(
+            yearly,
+            x='year',
+            y='revenue',
+            labels={'year': 'Год', 'revenue': 'Выручка (₽)'},
+            color_discrete_sequence=[color],
+            text='deals_count'
+        )
+        fig_yearly.update_traces(
+            texttemplate='%{text} сделок',
+            textposition='outside',
+            hovertemplate='<b>%{x}</b><br>Выручка: %{y:,.0f} ₽<extra></extra>'
+        )
+        st.plotly_chart(fig_yearly, width="stretch")
+
+    # ============================================================================
+    # ИНТЕРВАЛЫ МЕЖДУ ЗАКАЗАМИ
+    # ============================================================================
+
+    with col2:
+        st.markdown("#### ⏱️ Интервалы между заказами")
+        if not gaps.empty:
+            fig_gaps = px.bar(
+                x=dated['close_date'].iloc[1:].dt.strftime('%Y-%m-%d'),
+                y=gaps,
+                labels={'x': 'Дата сделки', 'y': 'Дней с предыдущей сделки'},
+                color_discrete_sequence=['#95E1D3']
+            )
+            fig_gaps.add_hline(
+                y=gaps.median(),
+                line_dash='dash',
+                line_color='#FF6B6B',
+                annotation_text=f"медиана {gaps.median():.0f} дн."
+            )
+            fig_gaps.update_traces(
+                hovertemplate='<b>%{x}</b><br>Интервал: %{y:.0f} дн.<extra></extra>'
+            )
+            st.plotly_chart(fig_gaps, width="stretch")
+        else:
+            st.info("Недостаточно сделок для расчёта интервалов")
+
+    st.divider()
+
+    # ============================================================================
+    # ТАБЛИЦА СДЕЛОК
+    # ============================================================================
+
+    st.markdown("### 📋 Все сделки")
+
+    st.dataframe(
+        deals,
+        width="stretch",
+        hide_index=True,
+        column_config={
+            'bitrix_id': 'Bitrix ID',
+            'title': 'Сделка',
+            'opportunity': st.column_config.NumberColumn('Сумма', format="%.0f ₽"),
+            'close_date': st.column_config.DateColumn('Дата закрытия', format="YYYY-MM-DD"),
+            'stage': 'Стадия'
+        }
+    )
+
+except Exception as e:
+    st.error(f"❌ Ошибка загрузки данных: {e}")
+    st.exception(e)
@@ -0,0 +1,272 @@
+"""
+Страница "Воронка" - сделки по стадиям Bitrix
+
+Конверсия по стадиям, доля выигранных сделок по месяцам и сегментам,
+среднее время в стадиях. Данные читаются из предагрегированных таблиц
+воронки (см. utils/funnel.py).
+"""
+import streamlit as st
+import plotly.express as px
+import pandas as pd
+from pathlib import Path
+import sys
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dashboard.utils import load_stage_stats, load_stage_durations
+from dashboard.utils.date_range import describe_date_range, render_date_range_filter
+from dashboard.utils.figures import cached_figure
+from dashboard.utils.funnel import (
+    FUNNEL_STAGES,
+    LOST_STAGES,
+    STAGE_NAMES,
+    WON_STAGES_ENV,
+    build_funnel,
+    configured_won_stages,
+    win_rate
+)
+from dashboard.utils.segmentation import SEGMENT_COLORS
+
+st.set_page_config(page_title="Воронка", page_icon="🔻", layout="wide")
+
+st.title("🔻 Воронка сделок")
+
+# ============================================================================
+# ФИЛЬТРЫ
+# ============================================================================
+
+date_range = render_date_range_filter()
+date_from, date_to = date_range
+
+try:
+    all_segments = sorted(load_stage_stats("segment")['segment'].unique())
+    segments = st.sidebar.multiselect("Сегменты", all_segments, placeholder="Все сегменты")
+    segments = tuple(segments) or None
+
+    caption = f"📅 Период: {describe_date_range(date_from, date_to)} (по месяцу закрытия сделки)"
+    won_stages = configured_won_stages()
+    caption += (
+        f" · выручка дашборда считается по стадиям: {', '.join(won_stages)}"
+        if won_stages else " · выручка дашборда считается по всем сделкам"
+    )
+    st.caption(caption + f" (переменная окружения {WON_STAGES_ENV})")
+
+    stats = load_stage_stats(None, date_from, date_to, segments)
+
+    if stats.empty:
+        st.warning("⚠️ Нет сделок за выбранный период")
+        st.stop()
+
+    # ============================================================================
+    # КЛЮЧЕВЫЕ МЕТРИКИ
+    # ============================================================================
+
+    funnel = build_funnel(stats)
+    totals = win_rate(stats).iloc[0]
+    open_deals = int(stats.loc[stats['stage'].isin(FUNNEL_STAGES[:-1]), 'deals'].sum())
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("📋 Всего сделок", f"{int(stats['deals'].sum()):,}")
+    col2.metric("⏳ В работе", f"{open_deals:,}")
+    col3.metric("✅ Выиграно", f"{int(totals['won']):,}")
+    col4.metric("❌ Проиграно", f"{int(totals['lost']):,}")
+    col5.metric(
+        "🏆 Доля выигранных",
+        f"{totals['win_rate']:.1%}" if pd.notna(totals['win_rate']) else "—",
+        help="Выигранные среди закрытых (выигранных и проигранных) сделок"
+    )
+
+    st.divider()
+
+    # ============================================================================
+    # ВОРОНКА ПО СТАДИЯМ
+    # ============================================================================
+
+    st.markdown("### 🔻 Конверсия по стадиям")
+    st.caption("Сделка на стадии учитывается во всех предыдущих стадиях воронки")
+
+    col1, col2 = st.columns([3, 2])
+
+    with col1:
+        def build_funnel_figure():
+            stages = funnel[funnel['stage'].isin(FUNNEL_STAGES)]
+            fig_funnel = px.funnel(
+                stages,
+                x='reached',
+                y='stage_name',
+                labels={'reached': 'Дошли до стадии', 'stage_name': 'Стадия'}
+            )
+            fig_funnel.update_traces(textinfo='value+percent initial')
+            return fig_funnel
+
+        fig_funnel = cached_figure(
+            "funnel.stages",
+            (date_from, date_to, segments),
+            build_funnel_figure
+        )
+        st.plotly_chart(fig_funnel, width="stretch")
+
+    with col2:
+        funnel_table = funnel[['stage_name', 'deals', 'reached', 'conversion', 'step_conversion', 'revenue']]
+        st.dataframe(
+            funnel_table,
+            width="stretch",
+            hide_index=True,
+            column_config={
+                'stage_name': 'Стадия',
+                'deals': st.column_config.NumberColumn('Сейчас на стадии', format="%d"),
+                'reached': st.column_config.NumberColumn('Дошли', format="%d"),
+                'conversion': st.column_config.ProgressColumn('От начала', format="percent", min_value=0, max_value=1),
+                'step_conversion': st.column_config.NumberColumn('От предыдущей', format="percent"),
+                'revenue': st.column_config.NumberColumn('Сумма (₽)', format="%.0f")
+            }
+        )
+
+    st.divider()
+
+    # ============================================================================
+    # ДИНАМИКА ПО МЕСЯЦАМ
+    # ============================================================================
+
+    st.markdown("### 📅 Стадии по месяцам")
+
+    monthly = load_stage_stats("month", date_from, date_to, segments)
+
+    if not monthly.empty:
+        monthly_rate = win_rate(monthly, "month")
+
+        def build_monthly_figure():
+            chart = monthly.assign(stage_name=monthly['stage'].map(lambda stage: STAGE_NAMES.get(stage, stage)))
+            fig_monthly = px.bar(
+                chart,
+                x='month',
+                y='deals',
+                color='stage_name',
+                category_orders={'stage_name': [STAGE_NAMES[stage] for stage in FUNNEL_STAGES + LOST_STAGES]},
+                labels={'month': 'Месяц', 'deals': 'Сделок', 'stage_name': 'Стадия'},
+                title='Сделки по месяцу закрытия и текущей стадии'
+            )
+            fig_monthly.update_layout(barmode='stack', hovermode='x unified')
+            return fig_monthly
+
+        def build_win_rate_figure():
+            fig_rate = px.line(
+                monthly_rate,
+                x='month',
+                y='win_rate',
+                markers=True,
+                labels={'month': 'Месяц', 'win_rate': 'Доля выигранных'},
+                title='Доля выигранных сделок по месяцам'
+            )
+            fig_rate.update_layout(yaxis_tickformat='.0%', hovermode='x unified')
+            return fig_rate
+
+        params = (date_from, date_to, segments)
+        st.plotly_chart(cached_figure("funnel.monthly", params, build_monthly_figure), width="stretch")
+        st.plotly_chart(cached_figure("funnel.win_rate", params, build_win_rate_figure), width="stretch")
+    else:
+        st.info("ℹ️ Нет сделок с датой закрытия за выбранный период")
+
+    st.divider()
+
+    # ============================================================================
+    # СЕГМЕНТЫ
+    # ============================================================================
+
+    st.markdown("### 🎯 Воронка по сегментам")
+
+    by_segment = load_stage_stats("segment", date_from, date_to, segments)
+    segment_rate = win_rate(by_segment, "segment")
+    segment_table = (
+        by_segment
+        .pivot_table(index='segment', columns='stage', values='deals', aggfunc='sum', fill_value=0)
+        .reindex(columns=[stage for stage in FUNNEL_STAGES + LOST_STAGES if stage in set(by_segment['stage'])])
+        .rename(columns=STAGE_NAMES)
+        .join(segment_rate.set_index('segment')[['win_rate']])
+        .reset_index()
+    )
+
+    col1, col2 = st.columns([3, 2])
+
+    with col1:
+        st.dataframe(
+            segment_table,
+            width="stretch",
+            hide_index=True,
+            column_config={
+                'segment': 'Сегмент',
+                'win_rate': st.column_config.ProgressColumn('Доля выигранных', format="percent", min_value=0, max_value=1)
+            }
+        )
+
+    with col2:
+        def build_segment_figure():
+            fig_segment = px.bar(
+                segment_rate,
+                x='segment',
+                y='win_rate',
+                color='segment',
+                color_discrete_map=SEGMENT_COLORS,
+                labels={'segment': 'Сегмент', 'win_rate': 'Доля выигранных'}
+            )
+            fig_segment.update_layout(yaxis_tickformat='.0%', showlegend=False)
+            return fig_segment
+
+        st.plotly_chart(
+            cached_figure("funnel.segments", (date_from, date_to, segments), build_segment_figure),
+            width="stretch"
+        )
+
+    st.divider()
+
+    # ============================================================================
+    # ВРЕМЯ В СТАДИЯХ
+    # ============================================================================
+
+    st.markdown("### ⏱️ Время в стадиях")
+
+    durations = load_stage_durations(date_from, date_to, segments)
+
+    if not durations.empty:
+        st.caption("Среднее время от входа в стадию до следующего перехода (по истории стадий, месяц входа в стадию)")
+
+        def build_durations_figure():
+            fig_durations = px.bar(
+                durations,
+                x='avg_days',
+                y='stage_name',
+                orientation='h',
+                text_auto='.1f',
+                labels={'avg_days': 'Дней в стадии (среднее)', 'stage_name': 'Стадия'}
+            )
+            fig_durations.update_layout(yaxis={'categoryorder': 'array', 'categoryarray': list(durations['stage_name'])[::-1]})
+            return fig_durations
+
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.plotly_chart(
+                cached_figure("funnel.durations", (date_from, date_to, segments), build_durations_figure),
+                width="stretch"
+            )
+        with col2:
+            st.dataframe(
+                durations[['stage_name', 'stays', 'avg_days']],
+                width="stretch",
+                hide_index=True,
+                column_config={
+                    'stage_name': 'Стадия',
+                    'stays': st.column_config.NumberColumn('Переходов', format="%d"),
+                    'avg_days': st.column_config.NumberColumn('Дней (среднее)', format="%.1f")
+                }
+            )
+    else:
+        st.info(
+            "ℹ️ Нет истории переходов по стадиям. Время в стадиях считается по таблице "
+            "`bitrix_deal_stage_history` (выгрузка crm.stagehistory.list из Bitrix)."
+        )
+
+except Exception as e:
+    st.error(f"❌ Ошибка загрузки данных: {e}")
+    st.exception(e)
@@ -0,0 +1,323 @@
+"""
+Пакетный отчёт по LTV без запуска дашборда
+
+Собирает разделы страниц "Обзор", "Сегменты", "Типы съёмок", "Тренды"
+и топ клиентов загрузчиками из dashboard.utils и сохраняет:
+- XLSX: по листу на раздел (openpyxl в режиме write_only, строки
+  пишутся потоком);
+- HTML: таблицы и графики Plotly (JSON фигур встраивается в страницу,
+  plotly.js — с CDN или целиком в файл с --inline-plotlyjs).
+
+Разделы независимы и строятся параллельно в пуле процессов; файлы
+дописываются по мере готовности разделов в порядке SECTIONS.
+
+Запуск (например, еженедельно из cron):
+    python dashboard/report.py --output-dir reports
+    python dashboard/report.py --date-from 2024-01-01 --date-to 2024-12-31 --top 200
+"""
+import argparse
+import html
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from openpyxl import Workbook
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dashboard.utils import (
+    load_companies_summary,
+    load_companies_dataframe,
+    load_segment_stats,
+    load_shooting_type_stats,
+    load_ltv_trend,
+    load_monthly_trend
+)
+from dashboard.utils.activity import ensure_company_activity
+from dashboard.utils.data_loader import engine
+from dashboard.utils.date_range import describe_date_range
+from dashboard.utils.schema import ensure_analytics_indexes
+from dashboard.utils.segmentation import SEGMENT_COLORS, get_segment_thresholds
+from dashboard.utils.shooting_types import ensure_shooting_types
+
+Section = Tuple[pd.DataFrame, Optional[str]]
+
+
+# ============================================================================
+# РАЗДЕЛЫ ОТЧЁТА
+# ============================================================================
+# Каждый раздел получает параметры отчёта и возвращает (таблица, JSON фигуры Plotly или None)
+
+def _kpi_section(params: dict) -> Section:
+    summary = load_companies_summary()
+    rows = [
+        ("Total LTV, ₽", summary["total_ltv"]),
+        ("Клиентов всего", summary["total_companies"]),
+        ("Клиентов с заказами", summary["companies_with_orders"]),
+        ("Средний LTV, ₽", summary["avg_ltv"]),
+        ("Всего заказов", summary["total_orders"]),
+        ("Заказов на клиента", summary["avg_orders_per_company"]),
+        ("Тип съёмки заполнен, %", summary["shooting_type_percent"]),
+    ]
+    return pd.DataFrame(rows, columns=["Показатель", "Значение"]), None
+
+
+def _segments_section(params: dict) -> Section:
+    df = load_segment_stats(thresholds=params["thresholds"])
+    fig = px.pie(
+        df,
+        values="count",
+        names="segment",
+        color="segment",
+        color_discrete_map=SEGMENT_COLORS,
+        title="Клиенты по сегментам"
+    )
+    return df, fig.to_json()
+
+
+def _shooting_types_section(params: dict) -> Section:
+    df = load_shooting_type_stats()
+    fig = px.bar(
+        df.head(15),
+        x="count",
+        y="shooting_type",
+        orientation="h",
+        title="Топ-15 типов съёмок по количеству клиентов",
+        labels={"count": "Клиентов", "shooting_type": "Тип съёмки"}
+    )
+    fig.update_layout(yaxis={"categoryorder": "total ascending"})
+    return df, fig.to_json()
+
+
+def _yearly_trend_section(params: dict) -> Section:
+    df = load_ltv_trend(params["date_from"], params["date_to"])
+    fig = go.Figure(go.Scatter(x=df["year"], y=df["total_revenue"], mode="lines+markers", name="Выручка"))
+    fig.update_layout(title="Выручка по годам", xaxis_title="Год", yaxis_title="Выручка (₽)")
+    return df, fig.to_json()
+
+
+def _monthly_trend_section(params: dict) -> Section:
+    df = load_monthly_trend(params["months"], params["date_from"], params["date_to"])
+    fig = go.Figure(go.Bar(x=df["month"], y=df["revenue"], name="Выручка"))
+    fig.update_layout(title="Выручка по месяцам", xaxis_title="Месяц", yaxis_title="Выручка (₽)")
+    return df, fig.to_json()
+
+
+def _top_clients_section(params: dict) -> Section:
+    df = load_companies_dataframe(limit=params["top"], thresholds=params["thresholds"])
+    return df, None
+
+
+# Раздел -> (название листа / заголовок, построитель); порядок — порядок в отчёте
+SECTIONS: Dict[str, Tuple[str, Callable[[dict], Section]]] = {
+    "kpi": ("Обзор", _kpi_section),
+    "segments": ("Сегменты", _segments_section),
+    "shooting_types": ("Типы съёмок", _shooting_types_section),
+    "yearly_trend": ("Тренд по годам", _yearly_trend_section),
+    "monthly_trend": ("Тренд по месяцам", _monthly_trend_section),
+    "top_clients": ("Топ клиентов", _top_clients_section),
+}
+
+
+def build_section(name: str, params: dict) -> Section:
+    """Строит раздел отчёта (выполняется в процессе пула)."""
+    return SECTIONS[name][1](params)
+
+
+def _init_worker() -> None:
+    # Соединения родительского процесса не должны использоваться после fork
+    engine.dispose(close=False)
+
+
+# ============================================================================
+# ПОТОКОВЫЕ ЗАПИСЫВАТЕЛИ
+# ============================================================================
+
+def _cell(value):
+    """Значение ячейки Excel: пропуски -> None, numpy/Arrow-скаляры -> Python."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def write_sheet(workbook: Workbook, title: str, df: pd.DataFrame) -> None:
+    """Дописывает лист в книгу write_only построчно."""
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append(list(df.columns))
+    for row in df.itertuples(index=False, name=None):
+        sheet.append([_cell(value) for value in row])
+
+
+PLOTLY_CDN = "https://cdn.plot.ly/plotly-{version}.min.js"
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{plotly}
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; font-size: 0.9em; }}
+th, td {{ border: 1px solid #ddd; padding: 4px 8px; text-align: right; }}
+th {{ background: #f4f4f4; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>{subtitle}</p>
+"""
+
+
+def plotly_script_tag(inline: bool) -> str:
+    """Тег подключения plotly.js: ссылка на CDN или библиотека целиком."""
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+    if inline:
+        return f"<script>{get_plotlyjs()}</script>"
+    return f'<script src="{PLOTLY_CDN.format(version=get_plotlyjs_version())}"></script>'
+
+
+def write_html_section(stream, name: str, title: str, df: pd.DataFrame, figure_json: Optional[str]) -> None:
+    """Дописывает раздел в HTML-отчёт: заголовок, график, таблица."""
+    stream.write(f"<h2>{html.escape(title)}</h2>\n")
+    if figure_json:
+        # "</" внутри JSON не должен закрыть тег <script>
+        figure_json = figure_json.replace("</", "<\\/")
+        stream.write(f'<div id="fig-{name}"></div>\n')
+        stream.write(
+            f"<script>(function() {{ var fig = {figure_json}; "
+            f"Plotly.newPlot('fig-{name}', fig.data, fig.layout, {{responsive: true}}); }})();</script>\n"
+        )
+    stream.write(df.to_html(index=False, na_rep="—", float_format=lambda x: f"{x:,.2f}", border=0))
+    stream.write("\n")
+
+
+# ============================================================================
+# СБОРКА ОТЧЁТА
+# ============================================================================
+
+def generate_report(
+    output_dir: Path,
+    date_from: str = None,
+    date_to: str = None,
+    months: int = 24,
+    top: int = 100,
+    workers: int = None,
+    formats: tuple = ("xlsx", "html"),
+    inline_plotlyjs: bool = False
+) -> Dict[str, Path]:
+    """
+    Строит все разделы и записывает отчёт.
+
+    Args:
+        output_dir: Каталог для файлов отчёта
+        date_from: Начало периода для трендов ('YYYY-MM-DD') или None
+        date_to: Конец периода для трендов ('YYYY-MM-DD') или None
+        months: Глубина помесячного тренда, если начало периода не задано
+        top: Количество клиентов в топе
+        workers: Количество процессов (None — по числу CPU)
+        formats: Форматы отчёта: 'xlsx', 'html'
+        inline_plotlyjs: Встроить plotly.js в HTML вместо ссылки на CDN
+
+    Returns:
+        Dict формат -> путь к файлу
+    """
+    params = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "months": months,
+        "top": top,
+        "thresholds": get_segment_thresholds(),
+    }
+
+    # Служебные записи в базу делаем до запуска пула, чтобы процессы только читали
+    ensure_analytics_indexes()
+    ensure_shooting_types()
+    ensure_company_activity()
+    engine.dispose()
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d")
+    paths = {fmt: output_dir / f"ltv_report_{stamp}.{fmt}" for fmt in formats}
+
+    title = "LTV-отчёт"
+    subtitle = (
+        f"Сформирован {datetime.now():%d.%m.%Y %H:%M} · "
+        f"период трендов: {describe_date_range(date_from, date_to)}"
+    )
+
+    workbook = Workbook(write_only=True) if "xlsx" in formats else None
+    html_stream = paths["html"].open("w", encoding="utf-8") if "html" in formats else None
+
+    try:
+        if html_stream:
+            html_stream.write(HTML_HEAD.format(
+                title=title,
+                subtitle=html.escape(subtitle),
+                plotly=plotly_script_tag(inline_plotlyjs)
+            ))
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {name: pool.submit(build_section, name, params) for name in SECTIONS}
+
+            # Разделы пишутся в порядке SECTIONS, остальные тем временем достраиваются
+            for name, future in futures.items():
+                df, figure_json = future.result()
+                section_title = SECTIONS[name][0]
+                if workbook is not None:
+                    write_sheet(workbook, section_title, df)
+                if html_stream:
+                    write_html_section(html_stream, name, section_title, df, figure_json)
+
+        if html_stream:
+            html_stream.write("</body>\n</html>\n")
+    finally:
+        if html_stream:
+            html_stream.close()
+
+    if workbook is not None:
+        workbook.save(paths["xlsx"])
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный LTV-отчёт (XLSX + HTML)")
+    parser.add_argument("--output-dir", type=Path, default=Path("reports"), help="Каталог для отчёта")
+    parser.add_argument("--date-from", type=date.fromisoformat, help="Начало периода трендов (YYYY-MM-DD)")
+    parser.add_argument("--date-to", type=date.fromisoformat, help="Конец периода трендов (YYYY-MM-DD)")
+    parser.add_argument("--months", type=int, default=24, help="Глубина помесячного тренда без --date-from")
+    parser.add_argument("--top", type=int, default=100, help="Количество клиентов в топе")
+    parser.add_argument("--workers", type=int, help="Количество процессов")
+    parser.add_argument("--format", nargs="+", choices=["xlsx", "html"], default=["xlsx", "html"], help="Форматы")
+    parser.add_argument("--inline-plotlyjs", action="store_true", help="Встроить plotly.js в HTML (для офлайн-просмотра)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    paths = generate_report(
+        args.output_dir,
+        date_from=args.date_from.isoformat() if args.date_from else None,
+        date_to=args.date_to.isoformat() if args.date_to else None,
+        months=args.months,
+        top=args.top,
+        workers=args.workers,
+        formats=tuple(args.format),
+        inline_plotlyjs=args.inline_plotlyjs
+    )
+
+    for path in paths.values():
+        print(f"✅ {path}")
+    print(f"⏱️ Готово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
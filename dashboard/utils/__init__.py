@@ -5,9 +5,42 @@ from .data_loader import (
     load_segment_stats,
     load_shooting_type_stats,
     load_ltv_trend,
+    load_monthly_trend,
     load_top_companies,
-    search_companies
+    search_companies,
+    load_segment_shooting_types,
+    load_shooting_type_segments
 )
+from .sketches import (
+    load_ltv_trend_approx,
+    load_monthly_trend_approx,
+    load_ltv_trend_sampled,
+    refresh_deal_sketches
+)
+from .reconciliation import (
+    run_ltv_reconciliation,
+    load_reconciliation_summary,
+    load_reconciliation_report
+)
+from .company import (
+    load_company_profile,
+    load_company_deals,
+    company_page_link
+)
+from .distribution import (
+    load_ltv_histogram,
+    load_ltv_quantiles
+)
+from .concentration import load_ltv_concentration
+from .shooting_types import sync_shooting_types
+from .company_index import load_company_index
+from .alerts import refresh_revenue_alerts, load_revenue_alerts
+from .activity import refresh_company_activity
+from .rfm import refresh_rfm_scores, load_rfm_grid, load_rfm_segment_matrix
+from .timeseries import load_revenue_timeseries, downsample_timeseries
+from .cube import refresh_deal_cube, load_cube
+from .funnel import refresh_deal_funnel, load_stage_stats, load_stage_durations
+from .lookalike import find_similar
 
 __all__ = [
     "load_companies_summary",
@@ -15,6 +48,38 @@ __all__ = [
     "load_segment_stats",
     "load_shooting_type_stats",
     "load_ltv_trend",
+    "load_monthly_trend",
     "load_top_companies",
-    "search_companies"
+    "search_companies",
+    "load_segment_shooting_types",
+    "load_shooting_type_segments",
+    "load_ltv_trend_approx",
+    "load_monthly_trend_approx",
+    "load_ltv_trend_sampled",
+    "refresh_deal_sketches",
+    "run_ltv_reconciliation",
+    "load_reconciliation_summary",
+    "load_reconciliation_report",
+    "load_company_profile",
+    "load_company_deals",
+    "company_page_link",
+    "load_ltv_histogram",
+    "load_ltv_quantiles",
+    "load_ltv_concentration",
+    "sync_shooting_types",
+    "load_company_index",
+    "refresh_revenue_alerts",
+    "load_revenue_alerts",
+    "refresh_company_activity",
+    "refresh_rfm_scores",
+    "load_rfm_grid",
+    "load_rfm_segment_matrix",
+    "load_revenue_timeseries",
+    "downsample_timeseries",
+    "refresh_deal_cube",
+    "load_cube",
+    "refresh_deal_funnel",
+    "load_stage_stats",
+    "load_stage_durations",
+    "find_similar"
 ]
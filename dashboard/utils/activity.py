@@ -0,0 +1,265 @@
+"""
+Давность заказов и риск оттока
+
+Таблица `company_activity` — материализованная по выигранным сделкам
+bitrix_deals (см. funnel.won_stage_sql) активность каждой компании:
+первая и последняя сделка, дней с последней сделки, число сделок за 90
+и 365 дней, средний интервал между заказами и флаг риска оттока.
+Строится одним агрегирующим проходом по сделкам.
+
+Риск оттока оценивается относительно собственного ритма клиента: пауза
+с последней сделки длиннее CHURN_FACTOR средних интервалов между его
+заказами. Для клиентов с одной сделкой вместо интервала берётся
+SINGLE_DEAL_INTERVAL_DAYS.
+
+Обновление инкрементальное (водяные отметки в analytics_state):
+- новые сделки (id выше отметки) — пересчёт строк затронутых компаний
+  по индексу bitrix_deals(company_id, close_date);
+- новый день — сдвиг окон 90/365 дней диапазонным сканом по
+  bitrix_deals(close_date) и пересчёт давности без чтения сделок.
+Смена настройки выигранных стадий ведёт к полному пересчёту.
+Изменения и удаления существующих сделок по отметке не видны: их
+компании передаются явно (refresh_company_activity(companies=...), так
+делает приём событий Bitrix), иначе нужен полный пересчёт:
+    python -m dashboard.utils.activity [--full]
+"""
+from datetime import date, timedelta
+from typing import Any, Dict, Sequence, Tuple
+
+from sqlalchemy import text
+
+from .cache import versioned_cache
+from .funnel import won_stage_sql
+from .schema import ensure_deal_indexes, ensure_state_table, get_state, set_state, tables_exist
+from .writer import get_write_queue, read_connection, writer_busy
+
+# Пауза длиннее CHURN_FACTOR средних интервалов между заказами — риск оттока
+CHURN_FACTOR = 2.0
+# Интервал для клиентов с единственной сделкой (дней)
+SINGLE_DEAL_INTERVAL_DAYS = 180
+
+WATERMARK_KEY = "company_activity_deals_watermark"
+AS_OF_KEY = "company_activity_as_of"
+WON_STAGES_KEY = "company_activity_won_stages"
+
+# Фильтр давности: ключ -> (подпись, SQL-условие по a.last_deal / a.churn_risk)
+RECENCY_FILTERS: Dict[str, Tuple[str, str]] = {
+    "active_90": ("🟢 Заказывали за 90 дней", "a.last_deal >= :since_90"),
+    "active_365": ("🔵 Заказывали за год", "a.last_deal >= :since_365"),
+    "stale_365": ("⚪ Нет заказов больше года", "a.last_deal < :since_365"),
+    "churn_risk": ("🔴 Риск оттока", "a.churn_risk = 1"),
+}
+
+# Сортировка: ключ -> (подпись, ORDER BY)
+ACTIVITY_ORDERS: Dict[str, Tuple[str, str]] = {
+    "ltv": ("💰 По LTV", "ltv DESC"),
+    "recent": ("🕐 Недавние заказы сначала", "a.last_deal DESC"),
+    "stale": ("⏳ Давние заказы сначала", "a.last_deal ASC NULLS LAST"),
+}
+
+# Агрегат по сделкам; {won} — условие выигранной сделки, {scope} — ограничение набора компаний
+ACTIVITY_QUERY = """
+    INSERT INTO company_activity
+    (company_id, first_deal, last_deal, deals_count, deals_90d, deals_365d, avg_interval_days)
+    SELECT
+        company_id,
+        MIN(date(close_date)),
+        MAX(date(close_date)),
+        COUNT(*),
+        SUM(close_date >= :since_90),
+        SUM(close_date >= :since_365),
+        CASE
+            WHEN COUNT(*) > 1
+            THEN (julianday(MAX(date(close_date))) - julianday(MIN(date(close_date)))) / (COUNT(*) - 1)
+        END
+    FROM bitrix_deals
+    WHERE company_id IS NOT NULL
+      AND close_date IS NOT NULL
+      AND {won}
+      {scope}
+    GROUP BY company_id
+"""
+
+# Давность и флаг оттока из сохранённых колонок (без чтения сделок)
+RECENCY_UPDATE = """
+    UPDATE company_activity
+    SET
+        days_since_last = CAST(julianday(:today) - julianday(last_deal) AS INTEGER),
+        churn_risk = (
+            julianday(:today) - julianday(last_deal)
+            > :churn_factor * MAX(COALESCE(avg_interval_days, :single_interval), 1)
+        )
+    {scope}
+"""
+
+
+def ensure_activity_table(conn) -> None:
+    """Создаёт таблицу активности и её индексы, если их нет."""
+    ensure_state_table(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS company_activity (
+            company_id TEXT PRIMARY KEY,
+            first_deal TEXT,
+            last_deal TEXT,
+            deals_count INTEGER,
+            deals_90d INTEGER,
+            deals_365d INTEGER,
+            avg_interval_days REAL,
+            days_since_last INTEGER,
+            churn_risk INTEGER
+        )
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_company_activity_last_deal
+        ON company_activity (last_deal)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_company_activity_churn
+        ON company_activity (churn_risk, last_deal)
+    """))
+
+
+def recency_params(today: date = None) -> Dict[str, str]:
+    """Границы окон давности для RECENCY_FILTERS и ACTIVITY_QUERY."""
+    today = today or date.today()
+    return {
+        "today": today.isoformat(),
+        "since_90": (today - timedelta(days=90)).isoformat(),
+        "since_365": (today - timedelta(days=365)).isoformat(),
+    }
+
+
+def refresh_company_activity(full: bool = False, companies: Sequence[str] = None) -> Dict[str, Any]:
+    """
+    Обновляет таблицу company_activity.
+
+    Без изменений в сделках и в пределах того же дня ничего не пишет.
+
+    Args:
+        full: Пересобрать таблицу целиком
+        companies: Дополнительно пересчитать эти компании (bitrix_id),
+            например после изменения или удаления их сделок
+
+    Returns:
+        Dict: mode (full / incremental / up_to_date), companies — пересчитано строк
+    """
+    today = date.today()
+    params = recency_params(today)
+    params.update({"churn_factor": CHURN_FACTOR, "single_interval": SINGLE_DEAL_INTERVAL_DAYS})
+    won = won_stage_sql()
+
+    def write(conn):
+        nonlocal full, companies
+        ensure_deal_indexes(conn)
+        ensure_activity_table(conn)
+
+        watermark = int(get_state(conn, WATERMARK_KEY, 0))
+        as_of = get_state(conn, AS_OF_KEY)
+        max_deal_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+
+        if as_of is None or get_state(conn, WON_STAGES_KEY) != won:
+            full = True
+        elif not full and not companies and watermark == max_deal_id and as_of == params["today"]:
+            return {"mode": "up_to_date", "companies": 0}
+
+        if full:
+            conn.execute(text("DELETE FROM company_activity"))
+            conn.execute(text(ACTIVITY_QUERY.format(won=won, scope="")), params)
+            companies = conn.execute(text("SELECT changes()")).scalar()
+            conn.execute(text(RECENCY_UPDATE.format(scope="")), params)
+        else:
+            # Компании с новыми сделками пересчитываются целиком
+            extra = ""
+            if companies:
+                keys = [f"company_{i}" for i in range(len(companies))]
+                params.update(zip(keys, companies))
+                extra = f"OR company_id IN ({', '.join(':' + key for key in keys)})"
+            scope = f"""
+                AND (
+                    company_id IN (
+                        SELECT company_id FROM bitrix_deals
+                        WHERE id > :deals_after AND id <= :deals_upto
+                    )
+                    {extra}
+                )
+            """
+            params.update({"deals_after": watermark, "deals_upto": max_deal_id})
+            conn.execute(text(f"DELETE FROM company_activity WHERE 1 = 1 {scope}"), params)
+            conn.execute(text(ACTIVITY_QUERY.format(won=won, scope=scope)), params)
+            companies = conn.execute(text("SELECT changes()")).scalar()
+
+            if as_of != params["today"]:
+                # Новый день: окна 90/365 дней сдвигаются для всех компаний
+                conn.execute(text("""
+                    UPDATE company_activity SET deals_90d = 0, deals_365d = 0
+                    WHERE deals_365d > 0
+                """))
+                conn.execute(text(f"""
+                    UPDATE company_activity
+                    SET deals_90d = w.deals_90d, deals_365d = w.deals_365d
+                    FROM (
+                        SELECT
+                            company_id,
+                            SUM(close_date >= :since_90) as deals_90d,
+                            COUNT(*) as deals_365d
+                        FROM bitrix_deals
+                        WHERE close_date >= :since_365
+                          AND company_id IS NOT NULL
+                          AND {won}
+                        GROUP BY company_id
+                    ) w
+                    WHERE w.company_id = company_activity.company_id
+                """), params)
+                conn.execute(text(RECENCY_UPDATE.format(scope="")), params)
+            else:
+                conn.execute(text(RECENCY_UPDATE.format(scope=f"WHERE 1 = 1 {scope}")), params)
+
+        set_state(conn, WATERMARK_KEY, max_deal_id)
+        set_state(conn, AS_OF_KEY, params["today"])
+        set_state(conn, WON_STAGES_KEY, won)
+        return {"mode": "full" if full else "incremental", "companies": companies}
+
+    return get_write_queue().run(write)
+
+
+def _activity_state(today: str) -> Tuple[bool, bool]:
+    """
+    Состояние таблицы активности (чтение без блокировки записи).
+
+    Returns:
+        (построена для текущей настройки стадий, актуальна на сегодня)
+    """
+    won = won_stage_sql()
+    with read_connection() as conn:
+        if not tables_exist(conn, "company_activity", "analytics_state"):
+            return False, False
+        as_of = get_state(conn, AS_OF_KEY)
+        built = as_of is not None and get_state(conn, WON_STAGES_KEY) == won
+        watermark = int(get_state(conn, WATERMARK_KEY, 0))
+        max_deal_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+    return built, built and watermark == max_deal_id and as_of == today
+
+
+@versioned_cache(maxsize=1)
+def _ensure_company_activity(today: str) -> None:
+    built, current = _activity_state(today)
+    if current or (built and writer_busy()):
+        return
+    refresh_company_activity()
+
+
+def ensure_company_activity() -> None:
+    """
+    Обновляет активность не чаще одного раза на версию данных и день.
+
+    Актуальность проверяется чтением; уже построенная таблица при занятой
+    другой записью базе не обновляется — страница не ждёт писателя.
+    """
+    _ensure_company_activity(date.today().isoformat())
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = refresh_company_activity(full="--full" in sys.argv)
+    print(f"✅ Активность клиентов ({result['mode']}): пересчитано {result['companies']} компаний")
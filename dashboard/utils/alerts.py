@@ -0,0 +1,374 @@
+"""
+Алерты по выручке
+
+Помесячная выручка строится одним сгруппированным проходом по
+bitrix_deals (компания × месяц) за последние закрытые месяцы. Ряды
+сегментов и типов съёмок — суммы рядов компаний, поэтому все ряды
+(компании, сегменты, типы съёмок) лежат в одной матрице «ряд × месяц», и
+скользящие среднее, стандартное отклонение и z-оценка считаются для
+всех рядов сразу, без цикла по рядам.
+
+Типы алертов:
+- revenue_drop — выручка месяца ниже скользящей базы за ROLLING_WINDOW
+  предыдущих месяцев: z-оценка не выше -Z_THRESHOLD и падение не меньше
+  MIN_DROP_SHARE от базы;
+- a_client_silence — клиент сегмента A без сделок SILENCE_MONTHS
+  последних месяцев, хотя до этого покупал в большинстве месяцев
+  (доля месяцев со сделками не меньше MIN_ACTIVE_SHARE).
+
+Сегмент берётся из сохранённой колонки segment: таблица алертов общая
+для всех сессий и не зависит от порогов, выбранных на странице "Сегменты".
+
+Результат хранится в таблице revenue_alerts и пересчитывается, когда
+меняются сделки, компании или наступает новый месяц (отпечаток источника
+хранится в analytics_state). Пересчёт запускает приём вебхуков
+(ingest.EventBuffer — когда поток событий затихает) и cron после
+импорта; дашборд только читает таблицу. Запуск вручную:
+    python -m dashboard.utils.alerts [--force]
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import text
+
+from .cache import versioned_cache
+from .funnel import won_stage_sql
+from .schema import (
+    ensure_analytics_indexes,
+    ensure_state_table,
+    get_source_version,
+    get_state,
+    set_state,
+    tables_exist
+)
+from .shooting_types import ensure_shooting_types
+from .writer import get_write_queue, read_connection
+
+# Месяцев в скользящей базе
+ROLLING_WINDOW = 6
+# Последних закрытых месяцев, для которых ищутся падения
+LOOKBACK_MONTHS = 3
+# Падение: z-оценка не выше -Z_THRESHOLD (≤ -HIGH_Z — высокая важность)
+Z_THRESHOLD = 2.0
+HIGH_Z = 3.0
+# ... и выручка ниже базы хотя бы на эту долю
+MIN_DROP_SHARE = 0.3
+# Молчание клиента A: месяцев подряд без сделок
+SILENCE_MONTHS = 3
+# Доля месяцев со сделками в базе, при которой клиент считается регулярным
+MIN_ACTIVE_SHARE = 0.5
+
+SOURCE_KEY = "revenue_alerts_source"
+LAST_RUN_KEY = "revenue_alerts_last_run"
+
+ALERT_TYPE_NAMES: Dict[str, str] = {
+    "revenue_drop": "📉 Падение выручки",
+    "a_client_silence": "🔕 Клиент A пропал",
+}
+
+SCOPE_NAMES: Dict[str, str] = {
+    "company": "Клиент",
+    "segment": "Сегмент",
+    "shooting_type": "Тип съёмки",
+}
+
+# Колонки load_revenue_alerts
+ALERT_COLUMNS = [
+    "alert_type", "scope", "series_key", "label", "month",
+    "revenue", "baseline", "zscore", "severity", "created_at",
+]
+
+
+def ensure_alert_tables(conn) -> None:
+    """Создаёт таблицу алертов, если её нет."""
+    ensure_state_table(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS revenue_alerts (
+            id INTEGER PRIMARY KEY,
+            alert_type TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            series_key TEXT NOT NULL,
+            label TEXT,
+            month TEXT NOT NULL,
+            revenue REAL,
+            baseline REAL,
+            zscore REAL,
+            severity TEXT NOT NULL,
+            created_at TEXT
+        )
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_revenue_alerts_month
+        ON revenue_alerts (month, severity)
+    """))
+
+
+def _month_axis(today: date) -> pd.PeriodIndex:
+    """Закрытые месяцы, нужные для оценки: база + проверяемые месяцы."""
+    last_closed = pd.Period(today, freq="M") - 1
+    length = ROLLING_WINDOW + max(LOOKBACK_MONTHS, SILENCE_MONTHS)
+    return pd.period_range(end=last_closed, periods=length, freq="M")
+
+
+def _source_fingerprint(conn, today: date, won: str) -> str:
+    """Отпечаток источника: меняется с новыми и изменёнными сделками, компаниями, месяцем и выигранными стадиями."""
+    deals = conn.execute(text("SELECT MAX(id), MAX(close_date) FROM bitrix_deals")).fetchone()
+    max_company_id = conn.execute(text("SELECT MAX(id) FROM bitrix_companies")).scalar()
+    return f"{deals[0]}:{deals[1]}:{max_company_id}:{get_source_version(conn)}:{today:%Y-%m}:{won}"
+
+
+def load_monthly_series(months: pd.PeriodIndex) -> pd.DataFrame:
+    """
+    Помесячная выручка компаний (выигранные сделки) за период одним сгруппированным запросом.
+
+    Args:
+        months: Месяцы оценки (непрерывный диапазон)
+
+    Returns:
+        DataFrame: company_id, title, segment, shooting_type_id, shooting_type, month, revenue
+    """
+    ensure_analytics_indexes()
+    ensure_shooting_types()
+
+    query = f"""
+        WITH monthly AS (
+            SELECT
+                company_id,
+                strftime('%Y-%m', close_date) as month,
+                SUM(opportunity) as revenue
+            FROM bitrix_deals
+            WHERE close_date >= :date_from
+              AND close_date < :date_until
+              AND company_id IS NOT NULL
+              AND {won_stage_sql()}
+            GROUP BY company_id, month
+        )
+        SELECT
+            m.company_id,
+            c.title,
+            c.segment,
+            c.shooting_type_id,
+            t.name as shooting_type,
+            m.month,
+            m.revenue
+        FROM monthly m
+        LEFT JOIN bitrix_companies c ON c.bitrix_id = m.company_id
+        LEFT JOIN shooting_types t ON t.id = c.shooting_type_id
+    """
+    params = {
+        "date_from": months[0].start_time.date().isoformat(),
+        "date_until": (months[-1] + 1).start_time.date().isoformat(),
+    }
+
+    with read_connection() as conn:
+        return pd.read_sql_query(text(query), conn, params=params)
+
+
+def _group_series(codes: np.ndarray, matrix: np.ndarray, groups: int) -> np.ndarray:
+    """Суммирует строки matrix по кодам групп (код -1 — без группы)."""
+    result = np.zeros((groups, matrix.shape[1]))
+    valid = codes >= 0
+    np.add.at(result, codes[valid], matrix[valid])
+    return result
+
+
+def compute_revenue_alerts(monthly: pd.DataFrame, months: pd.PeriodIndex) -> pd.DataFrame:
+    """
+    Находит аномалии во всех рядах выручки одной матричной операцией.
+
+    Args:
+        monthly: Результат load_monthly_series
+        months: Месяцы оценки
+
+    Returns:
+        DataFrame алертов: alert_type, scope, series_key, label, month,
+        revenue, baseline, zscore, severity
+    """
+    columns = ["alert_type", "scope", "series_key", "label", "month", "revenue", "baseline", "zscore", "severity"]
+    if monthly.empty:
+        return pd.DataFrame(columns=columns)
+
+    # Матрица компаний: строка — компания, столбец — месяц
+    company_codes, company_ids = pd.factorize(monthly["company_id"])
+    month_codes = pd.Index(months.strftime("%Y-%m")).get_indexer(monthly["month"])
+    companies = np.zeros((len(company_ids), len(months)))
+    np.add.at(companies, (company_codes, month_codes), monthly["revenue"].fillna(0).to_numpy(dtype=float))
+
+    attributes = monthly.drop_duplicates("company_id").set_index("company_id").reindex(company_ids)
+    segment_codes, segments = pd.factorize(attributes["segment"].replace("", np.nan))
+    type_codes, type_ids = pd.factorize(attributes["shooting_type_id"])
+    type_names = attributes.drop_duplicates("shooting_type_id").set_index("shooting_type_id")["shooting_type"]
+
+    # Все ряды в одной матрице + их описание
+    series = np.vstack([
+        companies,
+        _group_series(segment_codes, companies, len(segments)),
+        _group_series(type_codes, companies, len(type_ids)),
+    ])
+    meta = pd.DataFrame({
+        "scope": ["company"] * len(company_ids) + ["segment"] * len(segments) + ["shooting_type"] * len(type_ids),
+        "series_key": [str(key) for key in company_ids]
+        + [str(key) for key in segments]
+        + [str(int(key)) for key in type_ids],
+        "label": attributes["title"].fillna("").astype(object).tolist()
+        + [str(key) for key in segments]
+        + [type_names.get(key) for key in type_ids],
+    })
+    is_company = (meta["scope"] == "company").to_numpy()
+
+    # Скользящая база за ROLLING_WINDOW месяцев до каждого из последних LOOKBACK_MONTHS
+    checked = series[:, -LOOKBACK_MONTHS:]
+    windows = sliding_window_view(series[:, :-1], ROLLING_WINDOW, axis=1)[:, -LOOKBACK_MONTHS:]
+    baseline = windows.mean(axis=2)
+    spread = windows.std(axis=2, ddof=1)
+    active_share = (windows > 0).mean(axis=2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscore = np.where(spread > 0, (checked - baseline) / spread, 0.0)
+
+    drop = (
+        (zscore <= -Z_THRESHOLD)
+        & (checked <= baseline * (1 - MIN_DROP_SHARE))
+        # Компании с редкими заказами дают «падения» на каждом пустом месяце
+        & (~is_company[:, None] | (active_share >= MIN_ACTIVE_SHARE))
+    )
+    rows, cols = np.nonzero(drop)
+    drops = meta.iloc[rows].reset_index(drop=True).assign(
+        alert_type="revenue_drop",
+        month=months[-LOOKBACK_MONTHS:].strftime("%Y-%m")[cols],
+        revenue=checked[rows, cols],
+        baseline=baseline[rows, cols],
+        zscore=zscore[rows, cols],
+        severity=np.where(zscore[rows, cols] <= -HIGH_Z, "high", "medium"),
+    )
+
+    # Молчание клиентов A: последние SILENCE_MONTHS пусты, база до них — регулярная
+    before_silence = companies[:, -(SILENCE_MONTHS + ROLLING_WINDOW):-SILENCE_MONTHS]
+    silent = (
+        (attributes["segment"].to_numpy() == "A")
+        & (companies[:, -SILENCE_MONTHS:].sum(axis=1) == 0)
+        & ((before_silence > 0).mean(axis=1) >= MIN_ACTIVE_SHARE)
+    )
+    silent_rows = np.flatnonzero(silent)
+    silences = meta.iloc[silent_rows].reset_index(drop=True).assign(
+        alert_type="a_client_silence",
+        month=months[-1].strftime("%Y-%m"),
+        revenue=0.0,
+        baseline=before_silence[silent_rows].mean(axis=1),
+        zscore=np.nan,
+        severity="high",
+    )
+
+    return pd.concat([drops, silences], ignore_index=True)[columns]
+
+
+def refresh_revenue_alerts(force: bool = False) -> Dict[str, Any]:
+    """
+    Пересчитывает таблицу revenue_alerts, если изменился источник.
+
+    Args:
+        force: Пересчитать, даже если отпечаток источника не изменился
+
+    Returns:
+        Dict: refreshed, alerts, checked_at
+    """
+    today = date.today()
+    won = won_stage_sql()
+
+    def check(conn):
+        ensure_alert_tables(conn)
+        fingerprint = _source_fingerprint(conn, today, won)
+        if not force and get_state(conn, SOURCE_KEY) == fingerprint:
+            return fingerprint, {
+                "refreshed": False,
+                "alerts": conn.execute(text("SELECT COUNT(*) FROM revenue_alerts")).scalar(),
+                "checked_at": get_state(conn, LAST_RUN_KEY),
+            }
+        return fingerprint, None
+
+    fingerprint, current = get_write_queue().run(check)
+    if current is not None:
+        return current
+
+    months = _month_axis(today)
+    alerts = compute_revenue_alerts(load_monthly_series(months), months)
+    checked_at = datetime.now().isoformat(timespec="seconds")
+
+    def write(conn):
+        conn.execute(text("DELETE FROM revenue_alerts"))
+        if not alerts.empty:
+            records = alerts.assign(created_at=checked_at).astype(object)
+            records = records.where(records.notna(), None).to_dict("records")
+            conn.execute(text("""
+                INSERT INTO revenue_alerts
+                (alert_type, scope, series_key, label, month, revenue, baseline, zscore, severity, created_at)
+                VALUES
+                (:alert_type, :scope, :series_key, :label, :month, :revenue, :baseline, :zscore, :severity, :created_at)
+            """), records)
+        set_state(conn, SOURCE_KEY, fingerprint)
+        set_state(conn, LAST_RUN_KEY, checked_at)
+
+    get_write_queue().run(write)
+    return {"refreshed": True, "alerts": len(alerts), "checked_at": checked_at}
+
+
+@versioned_cache(maxsize=8)
+def load_revenue_alerts(limit: int = 100) -> pd.DataFrame:
+    """
+    Загружает сохранённые алерты: сначала свежие и важные.
+
+    Только читает: до первого пересчёта таблицы нет, и возвращается
+    пустой результат.
+
+    Args:
+        limit: Максимальное количество записей
+
+    Returns:
+        DataFrame из таблицы revenue_alerts
+    """
+    query = """
+        SELECT
+            alert_type,
+            scope,
+            series_key,
+            label,
+            month,
+            revenue,
+            baseline,
+            zscore,
+            severity,
+            created_at
+        FROM revenue_alerts
+        ORDER BY
+            month DESC,
+            CASE severity WHEN 'high' THEN 0 ELSE 1 END,
+            baseline - revenue DESC
+        LIMIT :limit
+    """
+
+    with read_connection() as conn:
+        if not tables_exist(conn, "revenue_alerts"):
+            return pd.DataFrame(columns=ALERT_COLUMNS)
+        return pd.read_sql_query(text(query), conn, params={"limit": limit})
+
+
+@versioned_cache(maxsize=1)
+def load_alerts_checked_at() -> Optional[str]:
+    """Время последнего пересчёта алертов (None — ещё не пересчитывались)."""
+    with read_connection() as conn:
+        if not tables_exist(conn, "analytics_state"):
+            return None
+        return get_state(conn, LAST_RUN_KEY)
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = refresh_revenue_alerts(force="--force" in sys.argv)
+    if result["refreshed"]:
+        print(f"✅ Алерты пересчитаны: {result['alerts']} шт. ({result['checked_at']})")
+    else:
+        print(f"ℹ️ Данные не менялись с {result['checked_at']}: {result['alerts']} алертов")
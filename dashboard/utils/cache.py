@@ -0,0 +1,150 @@
+"""
+Версия данных и общий кэш загрузчиков
+
+Версия данных вычисляется по метаданным файла базы (и WAL-журнала):
+проверка не обращается к самой базе. Кэш хранит результаты в памяти
+процесса и сбрасывается, как только версия данных меняется.
+
+Внутри снимка чтения (writer.read_snapshot) версия закрепляется за
+потоком: загрузчики кэшируют результаты под версией снимка, даже если
+во время перезапуска страницы в базу успели записать.
+"""
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, List
+
+_pinned = threading.local()
+
+# Кэши всех загрузчиков процесса: (записи, блокировка) — для учёта памяти
+_caches: List[tuple] = []
+
+
+def _db_files():
+    """Файлы, изменение которых означает новую версию данных."""
+    # Импорт внутри функции: data_loader сам использует этот модуль
+    from .data_loader import DB_PATH
+    return (DB_PATH, DB_PATH.with_name(DB_PATH.name + "-wal"))
+
+
+def get_data_version() -> str:
+    """
+    Возвращает текущую версию данных (закреплённую за потоком, если есть).
+
+    Returns:
+        Строка, меняющаяся при каждой записи в базу
+    """
+    pinned = getattr(_pinned, "version", None)
+    if pinned is not None:
+        return pinned
+    return _file_version()
+
+
+def _file_version() -> str:
+    """Версия по метаданным файлов базы."""
+    parts = []
+    for path in _db_files():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        parts.append(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    return ".".join(parts)
+
+
+@contextmanager
+def pin_data_version():
+    """Закрепляет текущую версию данных за потоком на время блока."""
+    previous = getattr(_pinned, "version", None)
+    _pinned.version = _file_version()
+    try:
+        yield _pinned.version
+    finally:
+        _pinned.version = previous
+
+
+def refresh_pinned_data_version() -> None:
+    """Переносит закреплённую версию на текущую (после записи в этом же потоке)."""
+    if getattr(_pinned, "version", None) is not None:
+        _pinned.version = _file_version()
+
+
+def get_last_modified() -> datetime:
+    """
+    Возвращает время последнего изменения данных (UTC).
+
+    Returns:
+        datetime последней записи в базу
+    """
+    mtimes = []
+    for path in _db_files():
+        try:
+            mtimes.append(path.stat().st_mtime)
+        except FileNotFoundError:
+            continue
+    return datetime.fromtimestamp(max(mtimes, default=0), tz=timezone.utc)
+
+
+def versioned_cache(maxsize: int = 128) -> Callable:
+    """
+    Декоратор: кэширует результат по (версия данных, аргументы).
+
+    Кэш общий для всех потоков и сессий процесса. Возвращаемые объекты
+    не копируются, поэтому вызывающий код не должен их изменять.
+
+    Args:
+        maxsize: Максимальное количество записей (LRU)
+    """
+    def decorator(func: Callable) -> Callable:
+        entries: OrderedDict = OrderedDict()
+        lock = threading.Lock()
+        state = {"version": None}
+        _caches.append((entries, lock))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            version = get_data_version()
+            key = (args, tuple(sorted(kwargs.items())))
+
+            with lock:
+                if state["version"] != version:
+                    entries.clear()
+                    state["version"] = version
+                elif key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+
+            value = func(*args, **kwargs)
+
+            with lock:
+                if state["version"] == version:
+                    entries[key] = value
+                    while len(entries) > maxsize:
+                        entries.popitem(last=False)
+
+            return value
+
+        def cache_clear() -> None:
+            with lock:
+                entries.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
+
+
+def cached_values() -> list:
+    """
+    Все объекты, лежащие сейчас в кэшах загрузчиков (общие для сессий).
+
+    Returns:
+        Список результатов загрузчиков
+    """
+    values = []
+    for entries, lock in _caches:
+        with lock:
+            values.extend(entries.values())
+    return values
@@ -0,0 +1,99 @@
+"""
+Детализация по одному клиенту
+
+Сделки компании читаются одним диапазонным сканом по индексу
+bitrix_deals(company_id, close_date) — время не зависит от общего объёма
+сделок. Сделки загружаются сразу в Arrow-колонки. Результаты кэшируются
+по компании и версии данных.
+"""
+import pandas as pd
+from sqlalchemy import text
+from typing import Dict, Any, Optional
+from urllib.parse import quote
+
+from .arrow_io import read_sql_arrow
+from .cache import versioned_cache
+from .date_range import date_range_sql
+from .schema import ensure_analytics_indexes
+from .shooting_types import ensure_shooting_types
+from .writer import read_connection
+
+
+@versioned_cache(maxsize=256)
+def load_company_profile(bitrix_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Загружает карточку компании.
+
+    Args:
+        bitrix_id: Bitrix ID компании
+
+    Returns:
+        Dict с полями компании или None, если компания не найдена
+    """
+    query = """
+        SELECT
+            bitrix_id,
+            title,
+            ltv,
+            segment,
+            orders_count,
+            orders_count_median,
+            orders_count_mean,
+            t.name as primary_shooting_type
+        FROM bitrix_companies c
+        LEFT JOIN shooting_types t ON t.id = c.shooting_type_id
+        WHERE bitrix_id = :bitrix_id
+    """
+
+    ensure_shooting_types()
+
+    with read_connection() as conn:
+        row = conn.execute(text(query), {"bitrix_id": bitrix_id}).mappings().fetchone()
+
+    return dict(row) if row else None
+
+
+@versioned_cache(maxsize=256)
+def load_company_deals(bitrix_id: str, date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Загружает сделки компании в хронологическом порядке.
+
+    Args:
+        bitrix_id: Bitrix ID компании
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+
+    Returns:
+        DataFrame со сделками (close_date как datetime)
+    """
+    ensure_analytics_indexes()
+    period_filter, params = date_range_sql(date_from, date_to)
+    params["company_id"] = bitrix_id
+
+    query = f"""
+        SELECT
+            bitrix_id,
+            title,
+            opportunity,
+            close_date,
+            stage
+        FROM bitrix_deals
+        WHERE company_id = :company_id
+          AND {period_filter}
+        ORDER BY close_date
+    """
+
+    return read_sql_arrow(query, params, parse_dates=["close_date"])
+
+
+def company_page_link(bitrix_id: str) -> str:
+    """
+    Относительная ссылка на страницу "Карточка клиента".
+
+    Args:
+        bitrix_id: Bitrix ID компании
+
+    Returns:
+        URL для st.column_config.LinkColumn
+    """
+    return f"Карточка_клиента?company={quote(str(bitrix_id))}"
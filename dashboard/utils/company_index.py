@@ -0,0 +1,216 @@
+"""
+Снимок клиентов в памяти для интерактивной фильтрации
+
+Таблица bitrix_companies (клиенты с заказами) загружается один раз на
+версию данных в компактный отсортированный по ltv снимок:
+сегмент и тип съёмки — категории, числа — float32/int32, строки —
+Arrow-строки (pyarrow ставится вместе со streamlit). Фильтры
+страницы "Клиенты" применяются без обращения к базе: диапазоны LTV
+(и сегменты, которые тоже являются диапазонами LTV) — через searchsorted,
+сегмент из сохранённой колонки и тип съёмки — булевыми масками по кодам
+категорий.
+
+Снимок общий для всех сессий процесса. Его размер ограничен
+COMPANY_INDEX_MAX_BYTES (переменная окружения COMPANY_INDEX_MAX_MB):
+если база не помещается, load_company_index() возвращает None и
+страница работает через SQL.
+
+LTV хранится в float32 — 7 значащих цифр, для сумм до миллионов рублей
+погрешность меньше рубля.
+"""
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from typing import Optional
+
+from .arrow_io import read_sql_arrow
+from .cache import versioned_cache
+from .activity import ensure_company_activity
+from .segmentation import segment_bounds, segment_labels
+from .shooting_types import ensure_shooting_types
+from .writer import read_connection
+
+COMPANY_INDEX_MAX_BYTES = int(float(os.environ.get("COMPANY_INDEX_MAX_MB", 256)) * 1024 * 1024)
+
+# Оценка размера строки снимка без учёта текста: числа, коды категорий,
+# смещения двух Arrow-строк (bitrix_id, title) и активность (дата последней
+# сделки, давность, флаг оттока)
+BYTES_PER_ROW = 56
+
+COLUMNS = [
+    "bitrix_id",
+    "title",
+    "ltv",
+    "segment",
+    "orders_count",
+    "orders_count_median",
+    "orders_count_mean",
+    "primary_shooting_type",
+    "last_deal",
+    "days_since_last",
+    "churn_risk",
+]
+
+
+class CompanyIndex:
+    """Неизменяемый снимок клиентов, отсортированный по возрастанию ltv."""
+
+    def __init__(self, frame: pd.DataFrame):
+        frame = frame.sort_values("ltv", kind="stable").reset_index(drop=True)
+        self.frame = pd.DataFrame({
+            "bitrix_id": frame["bitrix_id"].astype("string[pyarrow]"),
+            "title": frame["title"].astype("string[pyarrow]"),
+            "ltv": frame["ltv"].fillna(0).astype(np.float32),
+            "segment": frame["segment"].astype("category"),
+            "orders_count": frame["orders_count"].fillna(0).astype(np.int32),
+            "orders_count_median": frame["orders_count_median"].astype(np.float32),
+            "orders_count_mean": frame["orders_count_mean"].astype(np.float32),
+            "primary_shooting_type": frame["primary_shooting_type"].astype("category"),
+            "last_deal": frame["last_deal"].astype("string[pyarrow]"),
+            "days_since_last": frame["days_since_last"].astype("Int32"),
+            "churn_risk": frame["churn_risk"].astype("boolean"),
+        })
+        self.ltv = self.frame["ltv"].to_numpy()
+        self.segment_codes = self.frame["segment"].cat.codes.to_numpy()
+        self.shooting_type_codes = self.frame["primary_shooting_type"].cat.codes.to_numpy()
+        self.memory_bytes = int(self.frame.memory_usage(deep=True).sum())
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def _ltv_range(self, low: float = None, high: float = None, high_inclusive: bool = True):
+        """Позиции [start, stop) клиентов с low ≤ ltv ≤ high (или < high)."""
+        start = 0 if low is None else int(np.searchsorted(self.ltv, np.float32(low), side="left"))
+        if high is None:
+            stop = len(self.ltv)
+        else:
+            side = "right" if high_inclusive else "left"
+            stop = int(np.searchsorted(self.ltv, np.float32(high), side=side))
+        return start, max(start, stop)
+
+    def filter(
+        self,
+        segment: str = None,
+        shooting_type: str = None,
+        min_ltv: float = None,
+        max_ltv: float = None,
+        limit: int = None,
+        offset: int = None,
+        thresholds: tuple = None
+    ) -> pd.DataFrame:
+        """
+        Фильтрует снимок; параметры и результат как у load_companies_dataframe.
+
+        Args:
+            segment: Фильтр по сегменту (A, B, C, U)
+            shooting_type: Фильтр по типу съёмки
+            min_ltv: Минимальный LTV
+            max_ltv: Максимальный LTV
+            limit: Максимальное количество записей
+            offset: Сколько записей пропустить
+            thresholds: Пороги сегментов; None — сохранённая колонка segment
+
+        Returns:
+            DataFrame, отсортированный по убыванию LTV
+        """
+        start, stop = self._ltv_range(min_ltv, max_ltv)
+
+        # При заданных порогах сегмент — это ещё один диапазон LTV
+        if segment and thresholds:
+            lower, upper = segment_bounds(segment, thresholds)
+            seg_start, seg_stop = self._ltv_range(lower, upper, high_inclusive=False)
+            start = max(start, seg_start)
+            stop = max(start, min(stop, seg_stop))
+
+        mask = None
+        if segment and not thresholds:
+            mask = self._code_mask(self.frame["segment"], self.segment_codes, segment, start, stop)
+        if shooting_type:
+            type_mask = self._code_mask(
+                self.frame["primary_shooting_type"], self.shooting_type_codes, shooting_type, start, stop
+            )
+            mask = type_mask if mask is None else mask & type_mask
+
+        # Позиции по убыванию ltv
+        if mask is None:
+            positions = np.arange(stop - 1, start - 1, -1)
+        else:
+            positions = np.flatnonzero(mask)[::-1] + start
+
+        first = int(offset or 0)
+        positions = positions[first:first + int(limit)] if limit else positions[first:]
+
+        result = self.frame.take(positions).reset_index(drop=True)
+        if thresholds:
+            result["segment"] = _assign_segments(result["ltv"].to_numpy(), thresholds)
+        return result[COLUMNS]
+
+    @staticmethod
+    def _code_mask(column: pd.Series, codes: np.ndarray, value: str, start: int, stop: int) -> np.ndarray:
+        """Маска строк [start, stop), где категория равна value."""
+        categories = column.cat.categories
+        if value not in categories:
+            return np.zeros(stop - start, dtype=bool)
+        return codes[start:stop] == categories.get_loc(value)
+
+
+def _assign_segments(ltv: np.ndarray, thresholds: tuple) -> pd.Categorical:
+    """Сегменты для массива LTV по порогам (векторно, без Python-цикла по строкам)."""
+    labels = segment_labels(thresholds)
+    minimums = np.array([minimum for _, minimum in thresholds][::-1], dtype=np.float32)
+    # Сколько порогов не превышает ltv: 0 -> младший сегмент, len -> старший
+    passed = np.searchsorted(minimums, ltv, side="right")
+    return pd.Categorical.from_codes(len(thresholds) - passed, categories=labels)
+
+
+def estimate_index_bytes() -> int:
+    """Оценка размера снимка по количеству клиентов и длине строк (один запрос)."""
+    with read_connection() as conn:
+        rows, chars = conn.execute(text("""
+            SELECT COUNT(*), COALESCE(SUM(LENGTH(bitrix_id) + LENGTH(title)), 0)
+            FROM bitrix_companies
+            WHERE orders_count > 0
+        """)).fetchone()
+    # Кириллица в UTF-8 занимает 2 байта на символ
+    return int(rows * BYTES_PER_ROW + chars * 2)
+
+
+@versioned_cache(maxsize=1)
+def load_company_index() -> Optional[CompanyIndex]:
+    """
+    Загружает снимок клиентов (один раз на версию данных).
+
+    Returns:
+        CompanyIndex или None, если снимок не укладывается в COMPANY_INDEX_MAX_BYTES
+    """
+    if estimate_index_bytes() > COMPANY_INDEX_MAX_BYTES:
+        return None
+
+    ensure_shooting_types()
+    ensure_company_activity()
+
+    query = """
+        SELECT
+            bitrix_id,
+            title,
+            ltv,
+            segment,
+            orders_count,
+            orders_count_median,
+            orders_count_mean,
+            t.name as primary_shooting_type,
+            a.last_deal,
+            a.days_since_last,
+            a.churn_risk
+        FROM bitrix_companies c
+        LEFT JOIN shooting_types t ON t.id = c.shooting_type_id
+        LEFT JOIN company_activity a ON a.company_id = c.bitrix_id
+        WHERE orders_count > 0
+        ORDER BY ltv
+    """
+
+    index = CompanyIndex(read_sql_arrow(query))
+    if index.memory_bytes > COMPANY_INDEX_MAX_BYTES:
+        return None
+    return index
@@ -0,0 +1,111 @@
+"""
+Концентрация выручки (Парето / кривая Лоренца)
+
+Накопленная доля LTV считается в базе через SUM() OVER по клиентам,
+упорядоченным по ltv DESC (индекс bitrix_companies(ltv)). Кривая
+прореживается до нескольких сотен точек прямо в SQL, коэффициент Джини
+и доли топ-N% клиентов считаются агрегатом по тому же окну.
+"""
+import pandas as pd
+from sqlalchemy import text
+from typing import Dict
+
+from .cache import versioned_cache
+from .distribution import dimension_expression, dimension_label
+from .schema import ensure_analytics_indexes
+from .writer import read_connection
+
+DEFAULT_CUT_POINTS = (0.01, 0.05, 0.2)
+
+RANKED_CTE = """
+    WITH ranked AS (
+        SELECT
+            {group} as grp,
+            ltv,
+            ROW_NUMBER() OVER w as rn,
+            SUM(ltv) OVER (w ROWS UNBOUNDED PRECEDING) as cum_ltv,
+            COUNT(*) OVER (PARTITION BY {group}) as n,
+            SUM(ltv) OVER (PARTITION BY {group}) as total
+        FROM bitrix_companies
+        WHERE orders_count > 0
+        WINDOW w AS (PARTITION BY {group} ORDER BY ltv DESC)
+    )
+"""
+
+
+def _cut_label(cut: float) -> str:
+    return f"top_{round(cut * 100, 2):g}".replace(".", "_")
+
+
+@versioned_cache(maxsize=16)
+def load_ltv_concentration(
+    by: str = None,
+    points: int = 200,
+    cut_points: tuple = DEFAULT_CUT_POINTS,
+    thresholds: tuple = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Загружает кривую концентрации выручки и сводные показатели.
+
+    Args:
+        by: Разбивка: None, 'segment' или 'shooting_type'
+        points: Примерное количество точек кривой на группу
+        cut_points: Доли клиентов для показателей «топ-N%»
+        thresholds: Пороги сегментов для by='segment'; None — сохранённая колонка segment
+
+    Returns:
+        Dict с ключами:
+            'curve' - group, rank, client_share, revenue_share (прореженная кривая)
+            'summary' - group, clients, total_ltv, gini, clients_for_80pct,
+                        top_<N>_share и top_<N>_threshold для каждой точки отсечения
+    """
+    ensure_analytics_indexes()
+    group = dimension_expression(by, thresholds)
+    cte = RANKED_CTE.format(group=group)
+
+    group_label = dimension_label(by, "grp")
+
+    curve_query = cte + f"""
+        SELECT
+            {group_label} as "group",
+            rn as rank,
+            CAST(rn AS REAL) / n as client_share,
+            CASE WHEN total > 0 THEN cum_ltv / total ELSE 0 END as revenue_share
+        FROM ranked
+        WHERE rn = 1
+           OR rn = n
+           OR rn % MAX(1, n / :points) = 0
+        ORDER BY grp, rn
+    """
+
+    cut_columns = []
+    for cut in cut_points:
+        # Первые ceil(cut * n) клиентов
+        top_n = f"MAX(1, CAST({cut!r} * n AS INTEGER) + ({cut!r} * n > CAST({cut!r} * n AS INTEGER)))"
+        label = _cut_label(cut)
+        cut_columns.append(
+            f"MAX(CASE WHEN rn = {top_n} THEN cum_ltv END) / NULLIF(MAX(total), 0) as {label}_share"
+        )
+        cut_columns.append(f"MAX(CASE WHEN rn = {top_n} THEN ltv END) as {label}_threshold")
+
+    # Джини по возрастающему рангу i = n - rn + 1:
+    # G = 2 * Σ i * x_i / (n * Σ x) - (n + 1) / n
+    summary_query = cte + f"""
+        SELECT
+            {group_label} as "group",
+            MAX(n) as clients,
+            MAX(total) as total_ltv,
+            2.0 * SUM((n - rn + 1) * ltv) / NULLIF(MAX(n) * MAX(total), 0)
+                - (MAX(n) + 1.0) / MAX(n) as gini,
+            MIN(CASE WHEN cum_ltv >= 0.8 * total THEN rn END) as clients_for_80pct,
+            {", ".join(cut_columns)}
+        FROM ranked
+        GROUP BY grp
+        ORDER BY total_ltv DESC
+    """
+
+    with read_connection() as conn:
+        curve = pd.read_sql_query(text(curve_query), conn, params={"points": max(1, int(points))})
+        summary = pd.read_sql_query(text(summary_query), conn)
+
+    return {"curve": curve, "summary": summary}
@@ -0,0 +1,349 @@
+"""
+Куб продаж: месяц × сегмент × тип съёмки
+
+Таблица `deal_cube` — предагрегированные выигранные сделки (см.
+funnel.won_stage_sql) с зерном
+(месяц закрытия, сегмент компании, тип съёмки компании):
+- revenue — сумма сделок;
+- deals — количество сделок;
+- companies — уникальных компаний;
+- orders — заказов, где заказ — все сделки компании за один день
+  (несколько сделок по одной съёмке считаются одним заказом).
+
+Любой срез и свёртка («выручка сегмента A по месяцам для Food-съёмки»,
+«типы съёмок по годам») — группировка нескольких тысяч строк куба вместо
+соединения сделок с компаниями.
+
+Уникальные компании не складываются между месяцами: одна компания может
+заказывать каждый месяц. Между сегментами и типами съёмок они
+складываются (у компании один сегмент и один тип), поэтому для свёрток
+без месяца используется таблица `deal_cube_companies` — пары
+(ячейка куба, компания), по которой считается COUNT(DISTINCT).
+
+Сегмент берётся из сохранённой колонки bitrix_companies.segment,
+интерактивные пороги сегментации куб не учитывает. Компании без
+сегмента или без карточки попадают в сегмент '—', без типа съёмки —
+в тип 0 ('—').
+
+Обновление инкрементальное по месяцам: месяцы, в которых появились
+сделки с id выше отметки, пересчитываются целиком диапазонным сканом по
+индексу bitrix_deals(close_date, ...). Смена сегмента или типа съёмки у
+компаний (отпечаток bitrix_companies) или настройки выигранных стадий
+ведёт к полной пересборке.
+Запуск вручную:
+    python -m dashboard.utils.cube [--full]
+"""
+from typing import Any, Dict, Iterable, Sequence, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from .cache import versioned_cache
+from .funnel import won_stage_sql
+from .schema import (
+    company_dimensions_fingerprint,
+    ensure_deal_indexes,
+    ensure_state_table,
+    get_state,
+    set_state,
+    tables_exist
+)
+from .shooting_types import ensure_shooting_types
+from .writer import get_write_queue, read_connection, writer_busy
+
+WATERMARK_KEY = "deal_cube_deals_watermark"
+SOURCE_KEY = "deal_cube_source"
+
+NO_VALUE = "—"
+NO_SHOOTING_TYPE = 0
+
+# Измерения куба: ключ -> (подпись, SQL-выражение по k = deal_cube, t = shooting_types)
+CUBE_DIMENSIONS: Dict[str, Tuple[str, str]] = {
+    "year": ("Год", "substr(k.month, 1, 4)"),
+    "month": ("Месяц", "k.month"),
+    "segment": ("Сегмент", "k.segment"),
+    "shooting_type": ("Тип съёмки", f"COALESCE(t.name, '{NO_VALUE}')"),
+}
+
+# Меры куба: ключ -> подпись
+CUBE_MEASURES: Dict[str, str] = {
+    "revenue": "Выручка (₽)",
+    "deals": "Сделок",
+    "orders": "Заказов",
+    "companies": "Компаний",
+}
+
+# Агрегат ячеек куба по сделкам; {won} — условие выигранной сделки,
+# {scope} — ограничение по close_date
+CUBE_QUERY = f"""
+    INSERT INTO deal_cube (month, segment, shooting_type_id, revenue, deals, orders, companies)
+    SELECT
+        strftime('%Y-%m', d.close_date) as month,
+        COALESCE(c.segment, '{NO_VALUE}'),
+        COALESCE(c.shooting_type_id, {NO_SHOOTING_TYPE}),
+        COALESCE(SUM(d.opportunity), 0),
+        COUNT(*),
+        COUNT(DISTINCT d.company_id || '|' || date(d.close_date)),
+        COUNT(DISTINCT d.company_id)
+    FROM bitrix_deals d
+    LEFT JOIN bitrix_companies c ON c.bitrix_id = d.company_id
+    WHERE d.close_date IS NOT NULL
+      AND {{won}}
+      {{scope}}
+    GROUP BY 1, 2, 3
+"""
+
+MEMBERS_QUERY = f"""
+    INSERT INTO deal_cube_companies (month, segment, shooting_type_id, company_id)
+    SELECT DISTINCT
+        strftime('%Y-%m', d.close_date),
+        COALESCE(c.segment, '{NO_VALUE}'),
+        COALESCE(c.shooting_type_id, {NO_SHOOTING_TYPE}),
+        d.company_id
+    FROM bitrix_deals d
+    LEFT JOIN bitrix_companies c ON c.bitrix_id = d.company_id
+    WHERE d.close_date IS NOT NULL
+      AND d.company_id IS NOT NULL
+      AND {{won}}
+      {{scope}}
+"""
+
+
+def ensure_cube_tables(conn) -> None:
+    """Создаёт таблицы куба, если их нет."""
+    ensure_state_table(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deal_cube (
+            month TEXT,
+            segment TEXT,
+            shooting_type_id INTEGER,
+            revenue REAL,
+            deals INTEGER,
+            orders INTEGER,
+            companies INTEGER,
+            PRIMARY KEY (month, segment, shooting_type_id)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deal_cube_companies (
+            month TEXT,
+            segment TEXT,
+            shooting_type_id INTEGER,
+            company_id TEXT,
+            PRIMARY KEY (month, segment, shooting_type_id, company_id)
+        )
+    """))
+
+
+def _next_month(month: str) -> str:
+    """Первый день следующего месяца для 'YYYY-MM'."""
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}-01"
+
+
+def _rebuild_months(conn, months: Iterable[str], won: str) -> int:
+    """Пересчитывает ячейки куба за указанные месяцы, возвращает число месяцев."""
+    count = 0
+    scope = "AND d.close_date >= :month_start AND d.close_date < :month_end"
+    for month in sorted(set(months)):
+        params = {"month": month, "month_start": f"{month}-01", "month_end": _next_month(month)}
+        conn.execute(text("DELETE FROM deal_cube WHERE month = :month"), params)
+        conn.execute(text("DELETE FROM deal_cube_companies WHERE month = :month"), params)
+        conn.execute(text(CUBE_QUERY.format(won=won, scope=scope)), params)
+        conn.execute(text(MEMBERS_QUERY.format(won=won, scope=scope)), params)
+        count += 1
+    return count
+
+
+def refresh_deal_cube(full: bool = False, months: Sequence[str] = None) -> Dict[str, Any]:
+    """
+    Обновляет куб продаж.
+
+    Без новых сделок и изменений в компаниях ничего не пишет.
+
+    Args:
+        full: Пересобрать куб целиком
+        months: Дополнительно пересчитать эти месяцы ('YYYY-MM'),
+            например после изменения или удаления сделок
+
+    Returns:
+        Dict: mode (full / incremental / up_to_date), months — пересчитано месяцев
+    """
+    ensure_shooting_types()
+    won = won_stage_sql("d.stage")
+
+    def write(conn):
+        nonlocal full
+        ensure_deal_indexes(conn)
+        ensure_cube_tables(conn)
+
+        watermark = int(get_state(conn, WATERMARK_KEY, 0))
+        max_deal_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+        source = f"{company_dimensions_fingerprint(conn)}|{won}"
+
+        if get_state(conn, SOURCE_KEY) != source:
+            full = True
+        elif not full and not months and watermark == max_deal_id:
+            return {"mode": "up_to_date", "months": 0}
+
+        if full:
+            conn.execute(text("DELETE FROM deal_cube"))
+            conn.execute(text("DELETE FROM deal_cube_companies"))
+            conn.execute(text(CUBE_QUERY.format(won=won, scope="")))
+            conn.execute(text(MEMBERS_QUERY.format(won=won, scope="")))
+            rebuilt = conn.execute(text("SELECT COUNT(DISTINCT month) FROM deal_cube")).scalar()
+        else:
+            # Месяцы, в которые попали новые сделки
+            touched = conn.execute(text("""
+                SELECT DISTINCT strftime('%Y-%m', close_date)
+                FROM bitrix_deals
+                WHERE id > :deals_after AND id <= :deals_upto
+                  AND close_date IS NOT NULL
+            """), {"deals_after": watermark, "deals_upto": max_deal_id}).scalars().all()
+            rebuilt = _rebuild_months(conn, list(touched) + list(months or []), won)
+
+        set_state(conn, WATERMARK_KEY, max_deal_id)
+        set_state(conn, SOURCE_KEY, source)
+        return {"mode": "full" if full else "incremental", "months": rebuilt}
+
+    return get_write_queue().run(write)
+
+
+def _cube_state() -> Tuple[bool, bool]:
+    """
+    Состояние куба (чтение без блокировки записи).
+
+    Returns:
+        (построен, актуален): актуален — учтены все сделки и тот же
+        отпечаток справочников и выигрышных стадий
+    """
+    won = won_stage_sql("d.stage")
+    with read_connection() as conn:
+        if not tables_exist(conn, "deal_cube", "deal_cube_companies", "analytics_state"):
+            return False, False
+        source = get_state(conn, SOURCE_KEY)
+        if source is None:
+            return False, False
+        watermark = int(get_state(conn, WATERMARK_KEY, 0))
+        max_deal_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+        current = source == f"{company_dimensions_fingerprint(conn)}|{won}" and watermark == max_deal_id
+    return True, current
+
+
+@versioned_cache(maxsize=1)
+def ensure_deal_cube() -> None:
+    """
+    Обновляет куб не чаще одного раза на версию данных.
+
+    Актуальность проверяется чтением; уже построенный куб при занятой
+    другой записью базе не дописывается — страница не ждёт писателя.
+    """
+    built, current = _cube_state()
+    if current or (built and writer_busy()):
+        return
+    refresh_deal_cube()
+
+
+def _in_condition(column: str, name: str, values: Sequence, params: Dict[str, Any]) -> str:
+    """Условие column IN (...) с именованными параметрами name_0, name_1, ..."""
+    keys = [f"{name}_{i}" for i in range(len(values))]
+    params.update(zip(keys, values))
+    return f"{column} IN ({', '.join(':' + key for key in keys)})"
+
+
+@versioned_cache(maxsize=64)
+def load_cube(
+    group_by: tuple = ("month",),
+    segments: tuple = None,
+    shooting_types: tuple = None,
+    date_from: str = None,
+    date_to: str = None
+) -> pd.DataFrame:
+    """
+    Срез и свёртка куба продаж.
+
+    Пример — выручка сегмента A по месяцам для Food-съёмки:
+        load_cube(("month",), segments=("A",), shooting_types=("Food-съёмка",))
+
+    Args:
+        group_by: Измерения результата из CUBE_DIMENSIONS; () — одна итоговая строка
+        segments: Оставить только эти сегменты (None — все)
+        shooting_types: Оставить только эти типы съёмок по названию, '—' — без типа
+        date_from: Начало периода ('YYYY-MM-DD'), округляется до месяца
+        date_to: Конец периода включительно ('YYYY-MM-DD'), округляется до месяца
+
+    Returns:
+        DataFrame: измерения group_by, revenue, deals, orders, companies
+    """
+    unknown = set(group_by) - set(CUBE_DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Неизвестные измерения куба: {', '.join(sorted(unknown))}")
+
+    ensure_deal_cube()
+
+    conditions = []
+    params: Dict[str, Any] = {}
+    if segments:
+        conditions.append(_in_condition("k.segment", "segment", segments, params))
+    if shooting_types:
+        conditions.append(_in_condition(CUBE_DIMENSIONS["shooting_type"][1], "shooting_type", shooting_types, params))
+    if date_from is not None:
+        conditions.append("k.month >= :month_from")
+        params["month_from"] = date_from[:7]
+    if date_to is not None:
+        conditions.append("k.month <= :month_to")
+        params["month_to"] = date_to[:7]
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    columns = [f"{CUBE_DIMENSIONS[dimension][1]} as {dimension}" for dimension in group_by]
+    group = f"GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else ""
+
+    # Компании складываются между ячейками одного месяца; без месяца в
+    # группировке они считаются по парам (ячейка, компания)
+    additive = "month" in group_by
+    companies = "SUM(k.companies) as companies," if additive else ""
+
+    query = f"""
+        SELECT
+            {''.join(column + ', ' for column in columns)}
+            SUM(k.revenue) as revenue,
+            SUM(k.deals) as deals,
+            {companies}
+            SUM(k.orders) as orders
+        FROM deal_cube k
+        LEFT JOIN shooting_types t ON t.id = k.shooting_type_id
+        {where}
+        {group}
+    """
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+        if not additive:
+            members = f"""
+                SELECT
+                    {''.join(column + ', ' for column in columns)}
+                    COUNT(DISTINCT k.company_id) as companies
+                FROM deal_cube_companies k
+                LEFT JOIN shooting_types t ON t.id = k.shooting_type_id
+                {where}
+                {group}
+            """
+            distinct = pd.read_sql_query(text(members), conn, params=params)
+            if group_by:
+                df = df.merge(distinct, on=list(group_by), how="left")
+            else:
+                df["companies"] = distinct["companies"].iloc[0] if not distinct.empty else 0
+            df["companies"] = df["companies"].fillna(0).astype("int64")
+
+    measures = ["revenue", "deals", "orders", "companies"]
+    df[["deals", "orders", "companies"]] = df[["deals", "orders", "companies"]].fillna(0).astype("int64")
+    df["revenue"] = df["revenue"].fillna(0.0)
+    return df[list(group_by) + measures]
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = refresh_deal_cube(full="--full" in sys.argv)
+    print(f"✅ Куб продаж ({result['mode']}): пересчитано {result['months']} месяцев")
@@ -3,29 +3,45 @@ Data loader для Streamlit dashboard
 
 Загружает данные из SQLite базы данных аналитики клиентов.
 """
+import os
 import pandas as pd
 from pathlib import Path
 from sqlalchemy import create_engine, text
 from typing import Dict, List, Any
 import json
 
-# Путь к базе данных
-DB_PATH = Path(__file__).parent.parent.parent / "platrum.db"
+from .activity import ACTIVITY_ORDERS, RECENCY_FILTERS, ensure_company_activity, recency_params
+from .arrow_io import read_sql_arrow
+from .cache import versioned_cache
+from .date_range import date_range_sql
+from .funnel import won_stage_sql
+from .schema import ensure_analytics_indexes
+from .segmentation import segment_case_sql, segment_range_sql, segment_order_sql
+from .shooting_types import ensure_shooting_types
+from .writer import configure_engine, file_write_lock, read_connection
+
+# Путь к базе данных (LTV_DB_PATH — другая база, например синтетическая для нагрузочного теста)
+DB_PATH = Path(os.environ.get("LTV_DB_PATH") or Path(__file__).parent.parent.parent / "platrum.db")
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
 # Проверка наличия базы данных
 if not DB_PATH.exists():
-    print("⚠️ База данных не найдена. Создаю демо-данные...")
-    try:
-        from .demo_data import create_demo_database
-        create_demo_database(str(DB_PATH))
-        print("✅ Демо-данные созданы успешно!")
-    except Exception as e:
-        print(f"❌ Ошибка при создании демо-данных: {e}")
-        raise
-
-# Создаём engine для SQLAlchemy
+    # Под блокировкой писателя: процессы, запущенные одновременно, не
+    # создают демо-базу поверх друг друга
+    with file_write_lock(DB_PATH):
+        if not DB_PATH.exists():
+            print("⚠️ База данных не найдена. Создаю демо-данные...")
+            try:
+                from .demo_data import create_demo_database
+                create_demo_database(str(DB_PATH))
+                print("✅ Демо-данные созданы успешно!")
+            except Exception as e:
+                print(f"❌ Ошибка при создании демо-данных: {e}")
+                raise
+
+# Создаём engine для SQLAlchemy: WAL, единственный писатель, чтение снимками
 engine = create_engine(DATABASE_URL)
+configure_engine(engine)
 
 
 def load_companies_summary() -> Dict[str, Any]:
@@ -35,7 +51,9 @@ def load_companies_summary() -> Dict[str, Any]:
     Returns:
         Dict с ключевыми метриками
     """
-    with engine.connect() as conn:
+    ensure_shooting_types()
+
+    with read_connection() as conn:
         # Общая статистика
         result = conn.execute(text("""
             SELECT
@@ -45,7 +63,7 @@ def load_companies_summary() -> Dict[str, Any]:
                 AVG(ltv) as avg_ltv,
                 SUM(orders_count) as total_orders,
                 AVG(orders_count) as avg_orders_per_company,
-                COUNT(CASE WHEN primary_shooting_type IS NOT NULL AND primary_shooting_type != '' THEN 1 END) as companies_with_shooting_type
+                COUNT(shooting_type_id) as companies_with_shooting_type
             FROM bitrix_companies
         """)).fetchone()
 
@@ -76,43 +94,64 @@ def load_companies_dataframe(
     shooting_type: str = None,
     min_ltv: float = None,
     max_ltv: float = None,
-    limit: int = None
+    limit: int = None,
+    offset: int = None,
+    thresholds: tuple = None,
+    recency: str = None,
+    order_by: str = "ltv"
 ) -> pd.DataFrame:
     """
     Загружает список компаний с фильтрами.
 
     Args:
         segment: Фильтр по сегменту (A, B, C, U)
-        shooting_type: Фильтр по типу съёмки
+        shooting_type: Фильтр по типу съёмки (название из справочника)
         min_ltv: Минимальный LTV
         max_ltv: Максимальный LTV
         limit: Максимальное количество записей
+        offset: Сколько записей пропустить (для постраничной выдачи)
+        thresholds: Пороги сегментов (см. segmentation); None — сохранённая колонка segment
+        recency: Фильтр давности заказов (ключ activity.RECENCY_FILTERS)
+        order_by: Сортировка (ключ activity.ACTIVITY_ORDERS)
 
     Returns:
         DataFrame с данными компаний
     """
-    query = """
+    segment_column = f"{segment_case_sql(thresholds)} as segment" if thresholds else "segment"
+
+    query = f"""
         SELECT
             bitrix_id,
             title,
             ltv,
-            segment,
+            {segment_column},
             orders_count,
             orders_count_median,
             orders_count_mean,
-            primary_shooting_type
-        FROM bitrix_companies
+            t.name as primary_shooting_type,
+            a.last_deal,
+            a.days_since_last,
+            a.churn_risk
+        FROM bitrix_companies c
+        LEFT JOIN shooting_types t ON t.id = c.shooting_type_id
+        LEFT JOIN company_activity a ON a.company_id = c.bitrix_id
         WHERE orders_count > 0
     """
 
     params = {}
 
-    if segment:
+    if recency:
+        query += f" AND {RECENCY_FILTERS[recency][1]}"
+        params.update(recency_params())
+
+    if segment and thresholds:
+        query += f" AND {segment_range_sql(segment, thresholds)}"
+    elif segment:
         query += " AND segment = :segment"
         params["segment"] = segment
 
     if shooting_type:
-        query += " AND primary_shooting_type = :shooting_type"
+        query += " AND c.shooting_type_id = (SELECT id FROM shooting_types WHERE name = :shooting_type)"
         params["shooting_type"] = shooting_type
 
     if min_ltv is not None:
@@ -123,27 +162,35 @@ def load_companies_dataframe(
         query += " AND ltv <= :max_ltv"
         params["max_ltv"] = max_ltv
 
-    query += " ORDER BY ltv DESC"
+    query += f" ORDER BY {ACTIVITY_ORDERS[order_by][1]}"
 
     if limit:
-        query += f" LIMIT {limit}"
+        query += f" LIMIT {int(limit)}"
+        if offset:
+            query += f" OFFSET {int(offset)}"
 
-    with engine.connect() as conn:
-        df = pd.read_sql_query(text(query), conn, params=params)
+    ensure_shooting_types()
+    ensure_company_activity()
 
-    return df
+    return read_sql_arrow(query, params)
 
 
-def load_segment_stats() -> pd.DataFrame:
+@versioned_cache(maxsize=32)
+def load_segment_stats(thresholds: tuple = None) -> pd.DataFrame:
     """
     Загружает статистику по сегментам A/B/C/U.
 
+    Args:
+        thresholds: Пороги сегментов (см. segmentation); None — сохранённая колонка segment
+
     Returns:
         DataFrame с агрегированной статистикой
     """
-    query = """
+    segment = segment_case_sql(thresholds) if thresholds else "segment"
+
+    query = f"""
         SELECT
-            segment,
+            {segment} as segment,
             COUNT(*) as count,
             SUM(ltv) as total_ltv,
             AVG(ltv) as avg_ltv,
@@ -152,58 +199,94 @@ def load_segment_stats() -> pd.DataFrame:
             AVG(orders_count_mean) as avg_mean
         FROM bitrix_companies
         WHERE orders_count > 0
-        GROUP BY segment
-        ORDER BY
-            CASE segment
-                WHEN 'A' THEN 1
-                WHEN 'B' THEN 2
-                WHEN 'C' THEN 3
-                WHEN 'U' THEN 4
-            END
+        GROUP BY 1
+        ORDER BY {segment_order_sql("segment")}
     """
 
-    with engine.connect() as conn:
+    with read_connection() as conn:
         df = pd.read_sql_query(text(query), conn)
 
     return df
 
 
+@versioned_cache(maxsize=1)
 def load_shooting_type_stats() -> pd.DataFrame:
     """
     Загружает статистику по типам съёмок.
 
+    Группировка идёт по shooting_type_id, справочник присоединяется
+    к готовым агрегатам только ради названия.
+
     Returns:
         DataFrame с агрегированной статистикой
     """
+    ensure_shooting_types()
+
     query = """
         SELECT
-            primary_shooting_type as shooting_type,
-            COUNT(*) as count,
-            SUM(ltv) as total_ltv,
-            AVG(ltv) as avg_ltv,
-            SUM(orders_count) as total_orders
-        FROM bitrix_companies
-        WHERE orders_count > 0
-          AND primary_shooting_type IS NOT NULL
-          AND primary_shooting_type != ''
-        GROUP BY primary_shooting_type
-        ORDER BY count DESC
+            t.name as shooting_type,
+            s.count,
+            s.total_ltv,
+            s.avg_ltv,
+            s.total_orders
+        FROM (
+            SELECT
+                shooting_type_id,
+                COUNT(*) as count,
+                SUM(ltv) as total_ltv,
+                AVG(ltv) as avg_ltv,
+                SUM(orders_count) as total_orders
+            FROM bitrix_companies
+            WHERE orders_count > 0
+              AND shooting_type_id IS NOT NULL
+            GROUP BY shooting_type_id
+        ) s
+        JOIN shooting_types t ON t.id = s.shooting_type_id
+        ORDER BY s.count DESC
     """
 
-    with engine.connect() as conn:
+    with read_connection() as conn:
         df = pd.read_sql_query(text(query), conn)
 
     return df
 
 
-def load_ltv_trend() -> pd.DataFrame:
+@versioned_cache(maxsize=32)
+def load_deal_date_bounds() -> tuple:
     """
-    Загружает тренд LTV по годам (на основе дат закрытия сделок).
+    Загружает первую и последнюю дату закрытия сделок.
+
+    Returns:
+        Кортеж ('YYYY-MM-DD', 'YYYY-MM-DD') или (None, None), если сделок нет
+    """
+    ensure_analytics_indexes()
+
+    with read_connection() as conn:
+        row = conn.execute(text("""
+            SELECT date(MIN(close_date)), date(MAX(close_date))
+            FROM bitrix_deals
+            WHERE close_date IS NOT NULL
+        """)).fetchone()
+
+    return tuple(row)
+
+
+@versioned_cache(maxsize=32)
+def load_ltv_trend(date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Загружает тренд LTV по годам (на основе дат закрытия выигранных сделок).
+
+    Args:
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
 
     Returns:
         DataFrame с LTV по годам
     """
-    query = """
+    ensure_analytics_indexes()
+    period_filter, params = date_range_sql(date_from, date_to)
+
+    query = f"""
         SELECT
             strftime('%Y', close_date) as year,
             COUNT(DISTINCT company_id) as companies,
@@ -211,12 +294,54 @@ def load_ltv_trend() -> pd.DataFrame:
             COUNT(*) as deals_count
         FROM bitrix_deals
         WHERE close_date IS NOT NULL
+          AND {period_filter}
+          AND {won_stage_sql()}
         GROUP BY year
         ORDER BY year
     """
 
-    with engine.connect() as conn:
-        df = pd.read_sql_query(text(query), conn)
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+    return df
+
+
+@versioned_cache(maxsize=32)
+def load_monthly_trend(months: int = 24, date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Загружает помесячную выручку выигранных сделок за период.
+
+    Args:
+        months: Глубина истории в месяцах, если начало периода не задано
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+
+    Returns:
+        DataFrame с выручкой, сделками и клиентами по месяцам
+    """
+    ensure_analytics_indexes()
+    period_filter, params = date_range_sql(date_from, date_to)
+
+    if date_from is None:
+        period_filter += " AND close_date >= date('now', :offset)"
+        params["offset"] = f"-{int(months)} months"
+
+    query = f"""
+        SELECT
+            strftime('%Y-%m', close_date) as month,
+            COUNT(DISTINCT company_id) as companies,
+            SUM(opportunity) as revenue,
+            COUNT(*) as deals_count
+        FROM bitrix_deals
+        WHERE close_date IS NOT NULL
+          AND {period_filter}
+          AND {won_stage_sql()}
+        GROUP BY month
+        ORDER BY month
+    """
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
 
     return df
 
@@ -235,26 +360,36 @@ def load_top_companies(limit: int = 20) -> List[Dict[str, Any]]:
     return df.to_dict('records')
 
 
-def search_companies(query: str, limit: int = 50) -> pd.DataFrame:
+def search_companies(query: str, limit: int = 50, thresholds: tuple = None) -> pd.DataFrame:
     """
     Поиск компаний по названию.
 
     Args:
         query: Поисковый запрос
         limit: Максимальное количество результатов
+        thresholds: Пороги сегментов (см. segmentation); None — сохранённая колонка segment
 
     Returns:
         DataFrame с результатами поиска
     """
-    sql_query = """
+    segment_column = f"{segment_case_sql(thresholds)} as segment" if thresholds else "segment"
+
+    sql_query = f"""
         SELECT
             bitrix_id,
             title,
             ltv,
-            segment,
+            {segment_column},
             orders_count,
-            primary_shooting_type
-        FROM bitrix_companies
+            orders_count_median,
+            orders_count_mean,
+            t.name as primary_shooting_type,
+            a.last_deal,
+            a.days_since_last,
+            a.churn_risk
+        FROM bitrix_companies c
+        LEFT JOIN shooting_types t ON t.id = c.shooting_type_id
+        LEFT JOIN company_activity a ON a.company_id = c.bitrix_id
         WHERE orders_count > 0
           AND (title_normalized LIKE :query OR title LIKE :query)
         ORDER BY ltv DESC
@@ -266,7 +401,93 @@ def search_companies(query: str, limit: int = 50) -> pd.DataFrame:
         "limit": limit
     }
 
-    with engine.connect() as conn:
-        df = pd.read_sql_query(text(sql_query), conn, params=params)
+    ensure_shooting_types()
+    ensure_company_activity()
+
+    return read_sql_arrow(sql_query, params)
+
+
+@versioned_cache(maxsize=64)
+def load_segment_shooting_types(segment: str, thresholds: tuple = None, limit: int = 5) -> pd.DataFrame:
+    """
+    Загружает топ типов съёмок внутри сегмента.
+
+    Args:
+        segment: Сегмент (A, B, C, U)
+        thresholds: Пороги сегментов (см. segmentation); None — сохранённая колонка segment
+        limit: Количество типов съёмок
+
+    Returns:
+        DataFrame с количеством клиентов, средним LTV и заказами по типам съёмок
+    """
+    params = {"limit": limit}
+
+    if thresholds:
+        segment_filter = segment_range_sql(segment, thresholds)
+    else:
+        segment_filter = "segment = :segment"
+        params["segment"] = segment
+
+    query = f"""
+        SELECT
+            t.name as shooting_type,
+            s.count,
+            s.avg_ltv,
+            s.total_orders
+        FROM (
+            SELECT
+                shooting_type_id,
+                COUNT(*) as count,
+                AVG(ltv) as avg_ltv,
+                SUM(orders_count) as total_orders
+            FROM bitrix_companies
+            WHERE {segment_filter}
+              AND shooting_type_id IS NOT NULL
+            GROUP BY shooting_type_id
+            ORDER BY count DESC
+            LIMIT :limit
+        ) s
+        JOIN shooting_types t ON t.id = s.shooting_type_id
+        ORDER BY s.count DESC
+    """
+
+    ensure_shooting_types()
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+    return df
+
+
+@versioned_cache(maxsize=64)
+def load_shooting_type_segments(shooting_type: str, thresholds: tuple = None) -> pd.DataFrame:
+    """
+    Загружает распределение клиентов типа съёмки по сегментам.
+
+    Args:
+        shooting_type: Тип съёмки (название из справочника)
+        thresholds: Пороги сегментов (см. segmentation); None — сохранённая колонка segment
+
+    Returns:
+        DataFrame с количеством клиентов, средним LTV и заказами по сегментам
+    """
+    segment = segment_case_sql(thresholds) if thresholds else "segment"
+
+    query = f"""
+        SELECT
+            {segment} as segment,
+            COUNT(*) as count,
+            AVG(ltv) as avg_ltv,
+            SUM(orders_count) as total_orders
+        FROM bitrix_companies
+        WHERE shooting_type_id = (SELECT id FROM shooting_types WHERE name = :shooting_type)
+        GROUP BY 1
+        ORDER BY {segment_order_sql("segment")}
+    """
+
+    ensure_shooting_types()
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params={"shooting_type": shooting_type})
 
     return df
@@ -0,0 +1,126 @@
+"""
+Глобальный период анализа
+
+Период (дата начала и дата окончания включительно) хранится в сессии
+дашборда и действует на всех страницах со сделками. Загрузчики по
+сделкам получают границы параметрами и фильтруют close_date диапазонным
+условием по индексу bitrix_deals(close_date, ...), поэтому узкий период
+читает пропорционально меньше строк. Кэш загрузчиков ключуется
+границами периода.
+
+Границы — строки ISO 'YYYY-MM-DD' или None (без ограничения).
+"""
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+SESSION_KEY = "date_range"
+ALL_TIME: Tuple[Optional[str], Optional[str]] = (None, None)
+
+
+def get_date_range() -> Tuple[Optional[str], Optional[str]]:
+    """
+    Возвращает период, выбранный в текущей сессии.
+
+    Returns:
+        Кортеж (date_from, date_to); ALL_TIME вне сессии Streamlit
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        import streamlit as st
+        return st.session_state.get(SESSION_KEY, ALL_TIME)
+    return ALL_TIME
+
+
+def set_date_range(date_from: Optional[str], date_to: Optional[str]) -> None:
+    """Сохраняет период в сессии дашборда (None, None — весь период)."""
+    import streamlit as st
+
+    if date_from is None and date_to is None:
+        st.session_state.pop(SESSION_KEY, None)
+    else:
+        st.session_state[SESSION_KEY] = (date_from, date_to)
+
+
+def date_range_sql(date_from: str = None, date_to: str = None, column: str = "close_date") -> Tuple[str, Dict[str, str]]:
+    """
+    Диапазонное условие по колонке даты и его параметры.
+
+    Верхняя граница включительная: сравнение идёт со следующим днём,
+    поэтому даты со временем тоже попадают в период.
+
+    Args:
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+        column: Колонка даты
+
+    Returns:
+        (SQL-условие, параметры :date_from / :date_until)
+    """
+    conditions = []
+    params = {}
+
+    if date_from is not None:
+        conditions.append(f"{column} >= :date_from")
+        params["date_from"] = date_from
+    if date_to is not None:
+        conditions.append(f"{column} < :date_until")
+        params["date_until"] = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+
+    return " AND ".join(conditions) or "1 = 1", params
+
+
+def describe_date_range(date_from: str = None, date_to: str = None) -> str:
+    """Текстовое описание периода, например '01.01.2024 — 31.12.2024'."""
+    if date_from is None and date_to is None:
+        return "весь период"
+
+    def fmt(value):
+        return date.fromisoformat(value).strftime("%d.%m.%Y") if value else "…"
+
+    return f"{fmt(date_from)} — {fmt(date_to)}"
+
+
+def render_date_range_filter() -> Tuple[Optional[str], Optional[str]]:
+    """
+    Выводит в боковой панели выбор периода и сохраняет его в сессии.
+
+    Returns:
+        Действующий период (date_from, date_to)
+    """
+    import streamlit as st
+    from .data_loader import load_deal_date_bounds
+
+    first, last = load_deal_date_bounds()
+    if first is None:
+        return ALL_TIME
+
+    first, last = date.fromisoformat(first), date.fromisoformat(last)
+    date_from, date_to = get_date_range()
+
+    st.sidebar.markdown("### 📅 Период анализа")
+    selected = st.sidebar.date_input(
+        "Дата закрытия сделок",
+        value=(
+            date.fromisoformat(date_from) if date_from else first,
+            date.fromisoformat(date_to) if date_to else last
+        ),
+        min_value=first,
+        max_value=last,
+        format="DD.MM.YYYY",
+        help="Период действует на всех страницах со сделками в этой сессии"
+    )
+
+    # Пока выбрана только одна дата, оставляем прежний период
+    if isinstance(selected, (tuple, list)) and len(selected) == 2:
+        start, end = selected
+        set_date_range(
+            None if start <= first else start.isoformat(),
+            None if end >= last else end.isoformat()
+        )
+
+    if get_date_range() != ALL_TIME and st.sidebar.button("↩️ Весь период"):
+        set_date_range(None, None)
+        st.rerun()
+
+    return get_date_range()
@@ -8,13 +8,25 @@ import random
 from datetime import datetime, timedelta
 from pathlib import Path
 
+try:
+    from .segmentation import DEFAULT_SEGMENT_THRESHOLDS, assign_segment
+except ImportError:
+    # Запуск файла напрямую: python dashboard/utils/demo_data.py
+    from segmentation import DEFAULT_SEGMENT_THRESHOLDS, assign_segment
 
-def create_demo_database(db_path: str = None):
+
+# Открытые стадии воронки Bitrix по порядку
+DEMO_OPEN_STAGES = ["NEW", "PREPARATION", "PREPAYMENT_INVOICE", "EXECUTING", "FINAL_INVOICE"]
+
+
+def create_demo_database(db_path: str = None, companies: int = 200, deals: int = 800):
     """
     Создаёт демо-базу данных с синтетическими данными.
 
     Args:
         db_path: Путь к файлу базы данных (по умолчанию platrum.db в корне)
+        companies: Количество компаний
+        deals: Количество сделок
     """
     if db_path is None:
         db_path = Path(__file__).parent.parent.parent / "platrum.db"
@@ -22,6 +34,8 @@ def create_demo_database(db_path: str = None):
     print(f"Creating demo database at: {db_path}")
 
     conn = sqlite3.connect(db_path)
+    # Режим журнала хранится в файле базы: дашборд сразу работает с WAL
+    conn.execute("PRAGMA journal_mode = WAL")
     cursor = conn.cursor()
 
     # Создаём таблицы
@@ -52,9 +66,19 @@ def create_demo_database(db_path: str = None):
         )
     """)
 
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bitrix_deal_stage_history (
+            id INTEGER PRIMARY KEY,
+            deal_id TEXT NOT NULL,
+            stage TEXT,
+            created_time TEXT
+        )
+    """)
+
     # Генерируем демо-данные
-    companies_data = generate_demo_companies(200)
-    deals_data = generate_demo_deals(companies_data, 800)
+    companies_data = generate_demo_companies(companies)
+    deals_data = generate_demo_deals(companies_data, deals)
+    history_data = generate_demo_stage_history(deals_data)
 
     # Вставляем компании
     cursor.executemany("""
@@ -71,16 +95,23 @@ def create_demo_database(db_path: str = None):
         VALUES (?, ?, ?, ?, ?, ?)
     """, deals_data)
 
+    # Вставляем историю стадий
+    cursor.executemany("""
+        INSERT INTO bitrix_deal_stage_history (deal_id, stage, created_time)
+        VALUES (?, ?, ?)
+    """, history_data)
+
     conn.commit()
     conn.close()
 
     print(f"✅ Demo database created successfully!")
     print(f"   - {len(companies_data)} companies")
     print(f"   - {len(deals_data)} deals")
+    print(f"   - {len(history_data)} stage changes")
 
 
-def generate_demo_companies(count: int = 200):
-    """Генерирует список демо-компаний"""
+def generate_demo_companies(count: int = 200, thresholds=DEFAULT_SEGMENT_THRESHOLDS):
+    """Генерирует список демо-компаний (сегменты по порогам из segmentation)"""
 
     # Реалистичные названия компаний
     company_names = [
@@ -96,28 +127,32 @@ def generate_demo_companies(count: int = 200):
         "Рекламная", "Fashion", "Food-съёмка", "Ювелирная", "Техническая"
     ]
 
+    # Другие написания тех же типов, как в данных из CRM
+    shooting_type_variants = {
+        "Предметная": ["предметная", "Предметка"],
+        "Food-съёмка": ["Food съемка", "Фуд-съёмка"],
+        "Fashion": ["fashion", "Фэшн"],
+    }
+
+    # Диапазоны LTV для генерации: от 1 000 ₽ до 5× старшего порога
+    a_min, b_min, c_min = [minimum for _, minimum in thresholds]
+    ltv_ranges = [
+        (1000, c_min - 1),      # Сегмент U
+        (c_min, b_min - 1),     # Сегмент C
+        (b_min, a_min - 1),     # Сегмент B
+        (a_min, a_min * 5)      # Сегмент A
+    ]
+
     companies = []
 
     for i in range(count):
         # Генерируем LTV с распределением по сегментам
-        ltv_base = random.choice([
-            random.uniform(1000, 9999),     # Сегмент U (40%)
-            random.uniform(10000, 19999),    # Сегмент C (30%)
-            random.uniform(20000, 99999),    # Сегмент B (25%)
-            random.uniform(100000, 500000)   # Сегмент A (5%)
-        ])
+        ltv_base = random.uniform(*random.choice(ltv_ranges))
 
         ltv = round(ltv_base, 2)
 
         # Определяем сегмент
-        if ltv >= 100000:
-            segment = 'A'
-        elif ltv >= 20000:
-            segment = 'B'
-        elif ltv >= 10000:
-            segment = 'C'
-        else:
-            segment = 'U'
+        segment = assign_segment(ltv, thresholds)
 
         # Количество заказов коррелирует с LTV
         if segment == 'A':
@@ -135,6 +170,10 @@ def generate_demo_companies(count: int = 200):
         else:
             title = f"{random.choice(company_names)} {i + 1}"
 
+        shooting_type = random.choice(shooting_types)
+        if shooting_type in shooting_type_variants and random.random() < 0.2:
+            shooting_type = random.choice(shooting_type_variants[shooting_type])
+
         companies.append((
             f"DEMO_{i+1}",                          # bitrix_id
             title,                                   # title
@@ -143,7 +182,7 @@ def generate_demo_companies(count: int = 200):
             orders_count,                           # orders_count
             round(orders_count / 2.5, 1),           # orders_count_median
             round(orders_count / 2.0, 1),           # orders_count_mean
-            random.choice(shooting_types),          # primary_shooting_type
+            shooting_type,                          # primary_shooting_type
             title.lower()                           # title_normalized
         ))
 
@@ -168,18 +207,63 @@ def generate_demo_deals(companies_data, total_deals: int = 800):
         days_ago = random.randint(0, 1095)  # 3 года
         close_date = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d')
 
+        # Недавние сделки часто ещё в работе, остальные выиграны или проиграны
+        if days_ago < 45 and random.random() < 0.4:
+            stage = random.choice(DEMO_OPEN_STAGES)
+        else:
+            stage = random.choices(["WON", "LOSE", "APOLOGY"], weights=[85, 12, 3])[0]
+
         deals.append((
             f"DEAL_{i+1}",          # bitrix_id
             company_bitrix_id,      # company_id
             f"Заказ #{i+1}",        # title
             round(opportunity, 2),  # opportunity
             close_date,             # close_date
-            "WON"                   # stage
+            stage                   # stage
         ))
 
     return deals
 
 
+def generate_demo_stage_history(deals_data):
+    """Генерирует историю переходов по стадиям для демо-сделок"""
+
+    history = []
+
+    for bitrix_id, _, _, _, close_date, stage in deals_data:
+        # Путь по воронке: до текущей стадии или до стадии, на которой сделка проиграна
+        if stage in DEMO_OPEN_STAGES:
+            path = DEMO_OPEN_STAGES[:DEMO_OPEN_STAGES.index(stage) + 1]
+        elif stage == "WON":
+            path = DEMO_OPEN_STAGES + ["WON"]
+        else:
+            path = DEMO_OPEN_STAGES[:random.randint(1, len(DEMO_OPEN_STAGES))] + [stage]
+
+        # Переходы идут назад от даты закрытия с паузами 1–10 дней
+        moment = datetime.strptime(close_date, '%Y-%m-%d') + timedelta(hours=random.randint(9, 18))
+        times = []
+        for _ in path:
+            times.append(moment)
+            moment -= timedelta(days=random.uniform(1, 10))
+
+        for step, created in zip(path, reversed(times)):
+            history.append((bitrix_id, step, created.strftime('%Y-%m-%d %H:%M:%S')))
+
+    return history
+
+
 if __name__ == "__main__":
-    # Тест: создаём демо-базу
-    create_demo_database()
+    # Запуск напрямую (без импорта пакета dashboard.utils, который сам
+    # открывает базу): python dashboard/utils/demo_data.py [путь] --companies N
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Синтетическая база для дашборда")
+    parser.add_argument("db_path", nargs="?", help="Путь к файлу базы (по умолчанию platrum.db в корне)")
+    parser.add_argument("--companies", type=int, default=200, help="Количество компаний")
+    parser.add_argument("--deals", type=int, default=800, help="Количество сделок")
+    parser.add_argument("--seed", type=int, help="Зерно генератора")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    create_demo_database(args.db_path, companies=args.companies, deals=args.deals)
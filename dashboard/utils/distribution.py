@@ -0,0 +1,193 @@
+"""
+Распределение LTV, вычисляемое в базе
+
+Гистограмма с логарифмическими корзинами и квантили p50/p90/p99
+считаются SQL-запросами (GROUP BY по корзинам, ROW_NUMBER() OVER для
+квантилей). Наружу передаются только корзины и квантили — объём ответа
+не зависит от количества клиентов.
+
+Учитываются клиенты с заказами и положительным LTV. Разбивка по типу
+съёмки группирует по целочисленному shooting_type_id, название из
+справочника подставляется уже в агрегированный результат. Разбивка по
+сегменту с порогами (thresholds) вычисляет сегмент из ltv через
+segment_case_sql, без порогов — берёт сохранённую колонку segment.
+"""
+import math
+import pandas as pd
+from sqlalchemy import text
+from typing import Dict, List
+
+from .cache import versioned_cache
+from .schema import ensure_analytics_indexes
+from .segmentation import segment_case_sql
+from .shooting_types import ensure_shooting_types
+from .writer import read_connection
+
+# Измерения для разбивки -> выражение SQL ключа группы
+DISTRIBUTION_DIMENSIONS: Dict[str, str] = {
+    "segment": "COALESCE(NULLIF(segment, ''), '—')",
+    "shooting_type": "shooting_type_id",
+}
+
+# Измерения, ключ которых нужно перевести в название: шаблон с {key}
+DIMENSION_LABELS: Dict[str, str] = {
+    "shooting_type": "COALESCE((SELECT name FROM shooting_types WHERE id = {key}), '—')",
+}
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def dimension_expression(by: str = None, thresholds: tuple = None) -> str:
+    """
+    SQL-выражение ключа группы для разбивки (None — одна группа «Все»).
+
+    Args:
+        by: Разбивка: None, 'segment' или 'shooting_type'
+        thresholds: Пороги сегментов для by='segment'; None — сохранённая колонка segment
+    """
+    if by is None:
+        return "'Все'"
+    if by not in DISTRIBUTION_DIMENSIONS:
+        raise ValueError(f"Неизвестное измерение: {by}")
+    if by == "segment" and thresholds:
+        return segment_case_sql(thresholds)
+    if by == "shooting_type":
+        ensure_shooting_types()
+    return DISTRIBUTION_DIMENSIONS[by]
+
+
+def dimension_label(by: str, key: str) -> str:
+    """SQL-выражение отображаемого названия группы по колонке ключа key."""
+    return DIMENSION_LABELS.get(by, "{key}").format(key=key)
+
+
+def log_bin_edges(min_value: float, max_value: float, bins_per_decade: int = 4) -> List[float]:
+    """
+    Границы логарифмических корзин, покрывающие [min_value, max_value].
+
+    Границы лежат на сетке 10^(k / bins_per_decade), поэтому совпадают
+    для любых разбивок и периодов.
+
+    Args:
+        min_value: Минимальное значение (> 0)
+        max_value: Максимальное значение
+        bins_per_decade: Количество корзин на порядок величины
+
+    Returns:
+        Отсортированный список границ
+    """
+    low = math.floor(math.log10(min_value) * bins_per_decade)
+    high = math.floor(math.log10(max_value) * bins_per_decade) + 1
+    return [10 ** (k / bins_per_decade) for k in range(low, high + 1)]
+
+
+@versioned_cache(maxsize=32)
+def load_ltv_histogram(by: str = None, bins_per_decade: int = 4, thresholds: tuple = None) -> pd.DataFrame:
+    """
+    Загружает гистограмму LTV с логарифмическими корзинами.
+
+    Args:
+        by: Разбивка: None, 'segment' или 'shooting_type'
+        bins_per_decade: Количество корзин на порядок величины
+        thresholds: Пороги сегментов для by='segment'; None — сохранённая колонка segment
+
+    Returns:
+        DataFrame: group, bin, bin_low, bin_high, count, total_ltv
+    """
+    ensure_analytics_indexes()
+    group = dimension_expression(by, thresholds)
+
+    with read_connection() as conn:
+        bounds = conn.execute(text("""
+            SELECT MIN(ltv), MAX(ltv)
+            FROM bitrix_companies
+            WHERE orders_count > 0 AND ltv > 0
+        """)).fetchone()
+
+        if bounds[0] is None:
+            return pd.DataFrame(columns=["group", "bin", "bin_low", "bin_high", "count", "total_ltv"])
+
+        edges = log_bin_edges(bounds[0], bounds[1], bins_per_decade)
+        values = ", ".join(f"({i}, {lo!r}, {hi!r})" for i, (lo, hi) in enumerate(zip(edges, edges[1:])))
+
+        query = f"""
+            WITH bins(bin, bin_low, bin_high) AS (VALUES {values}),
+            counts AS (
+                SELECT
+                    {group} as grp,
+                    b.bin,
+                    b.bin_low,
+                    b.bin_high,
+                    COUNT(*) as count,
+                    SUM(c.ltv) as total_ltv
+                FROM bitrix_companies c
+                JOIN bins b ON c.ltv >= b.bin_low AND c.ltv < b.bin_high
+                WHERE c.orders_count > 0 AND c.ltv > 0
+                GROUP BY grp, b.bin
+            )
+            SELECT
+                {dimension_label(by, "grp")} as "group",
+                bin,
+                bin_low,
+                bin_high,
+                count,
+                total_ltv
+            FROM counts
+            ORDER BY "group", bin
+        """
+        df = pd.read_sql_query(text(query), conn)
+
+    return df
+
+
+@versioned_cache(maxsize=32)
+def load_ltv_quantiles(
+    by: str = None,
+    quantiles: tuple = DEFAULT_QUANTILES,
+    thresholds: tuple = None
+) -> pd.DataFrame:
+    """
+    Загружает квантили LTV (метод ближайшего ранга) через оконные функции.
+
+    Args:
+        by: Разбивка: None, 'segment' или 'shooting_type'
+        quantiles: Уровни квантилей, например (0.5, 0.9, 0.99)
+        thresholds: Пороги сегментов для by='segment'; None — сохранённая колонка segment
+
+    Returns:
+        DataFrame: group, count, mean_ltv, min_ltv, max_ltv и колонка p<N> на каждый квантиль
+    """
+    group = dimension_expression(by, thresholds)
+
+    columns = []
+    for q in quantiles:
+        # Ближайший ранг: ceil(q * n), не меньше 1
+        rank = f"MAX(1, CAST({q!r} * n AS INTEGER) + ({q!r} * n > CAST({q!r} * n AS INTEGER)))"
+        columns.append(f"MAX(CASE WHEN rn = {rank} THEN ltv END) as \"p{round(q * 100, 1):g}\"")
+
+    query = f"""
+        WITH ranked AS (
+            SELECT
+                {group} as grp,
+                ltv,
+                ROW_NUMBER() OVER (PARTITION BY {group} ORDER BY ltv) as rn,
+                COUNT(*) OVER (PARTITION BY {group}) as n
+            FROM bitrix_companies
+            WHERE orders_count > 0 AND ltv > 0
+        )
+        SELECT
+            {dimension_label(by, "grp")} as "group",
+            COUNT(*) as count,
+            AVG(ltv) as mean_ltv,
+            MIN(ltv) as min_ltv,
+            MAX(ltv) as max_ltv,
+            {", ".join(columns)}
+        FROM ranked
+        GROUP BY grp
+        ORDER BY count DESC
+    """
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn)
+
+    return df
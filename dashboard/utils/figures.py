@@ -0,0 +1,76 @@
+"""
+Общий кэш фигур Plotly
+
+Построение фигуры (px.*, go.Figure с несколькими осями) занимает
+десятки миллисекунд и повторяется на каждом перезапуске страницы, даже
+если данные и параметры графика не менялись. cached_figure() хранит
+готовые фигуры в памяти процесса по ключу (версия данных, имя графика,
+параметры) и отдаёт их всем сессиям; построитель вызывается только при
+промахе.
+
+st.plotly_chart сериализует переданную фигуру сам (копией через
+to_dict), поэтому общий объект не изменяется; вызывающий код тоже не
+должен изменять полученную фигуру.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+import plotly.graph_objects as go
+
+from .cache import get_data_version
+
+# Фигур в кэше (LRU); фигура трендов занимает десятки килобайт
+FIGURE_CACHE_SIZE = 256
+
+_figures: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+_state = {"version": None, "hits": 0, "misses": 0}
+
+
+def cached_figure(name: str, params: Hashable, builder: Callable[[], go.Figure]) -> go.Figure:
+    """
+    Возвращает фигуру из общего кэша или строит её.
+
+    Args:
+        name: Имя графика, уникальное в пределах дашборда (например, 'overview.segments')
+        params: Всё, от чего зависит фигура, кроме версии данных (пороги, период, режим)
+        builder: Функция без аргументов, строящая фигуру
+
+    Returns:
+        Фигура Plotly (общая для всех сессий — не изменять)
+    """
+    version = get_data_version()
+    key = (name, params)
+
+    with _lock:
+        if _state["version"] != version:
+            _figures.clear()
+            _state["version"] = version
+        elif key in _figures:
+            _figures.move_to_end(key)
+            _state["hits"] += 1
+            return _figures[key]
+        _state["misses"] += 1
+
+    figure = builder()
+
+    with _lock:
+        if _state["version"] == version:
+            _figures[key] = figure
+            while len(_figures) > FIGURE_CACHE_SIZE:
+                _figures.popitem(last=False)
+
+    return figure
+
+
+def figure_cache_info() -> Dict[str, int]:
+    """Статистика кэша фигур: hits, misses, size."""
+    with _lock:
+        return {"hits": _state["hits"], "misses": _state["misses"], "size": len(_figures)}
+
+
+def clear_figure_cache() -> None:
+    """Очищает кэш фигур."""
+    with _lock:
+        _figures.clear()
@@ -0,0 +1,463 @@
+"""
+Воронка сделок по стадиям
+
+`bitrix_deals.stage` — текущая стадия сделки Bitrix (NEW … WON / LOSE;
+в дополнительных направлениях — с префиксом вида 'C1:WON'). Здесь:
+
+- выигранные стадии: загрузчики выручки учитывают только сделки в них
+  (won_stage_sql). Стадии задаются переменной окружения LTV_WON_STAGES
+  через запятую без префикса направления, по умолчанию WON; '*' — все
+  сделки, как до появления воронки. Сделки без стадии считаются
+  выигранными, чтобы импорт без колонки stage не обнулял выручку;
+- предагрегированные таблицы воронки:
+  - deal_stage_stats (месяц закрытия, сегмент, стадия) — сделки и сумма;
+  - deal_stage_durations (месяц входа в стадию, сегмент, стадия) —
+    завершённые пребывания в стадии и их суммарная длительность в днях
+    по истории переходов bitrix_deal_stage_history.
+
+Конверсия строится по текущим стадиям: сделка на стадии k прошла все
+предыдущие стадии FUNNEL_STAGES; проигранные сделки входят в общее
+число и в долю выигранных. Время в стадии считается только по истории
+переходов (crm.stagehistory.list в Bitrix); без неё таблица
+длительностей пуста.
+
+Таблицы пересобираются целиком, когда меняется распределение сделок по
+стадиям, история переходов или сегменты компаний — не чаще одного раза
+на версию данных. Запуск вручную:
+    python -m dashboard.utils.funnel [--force]
+"""
+import hashlib
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from .cache import versioned_cache
+from .schema import (
+    company_dimensions_fingerprint,
+    ensure_analytics_indexes,
+    ensure_deal_indexes,
+    ensure_state_table,
+    get_state,
+    set_state,
+    tables_exist
+)
+from .writer import get_write_queue, read_connection, writer_busy
+
+WON_STAGES_ENV = "LTV_WON_STAGES"
+DEFAULT_WON_STAGES: Tuple[str, ...] = ("WON",)
+ALL_STAGES = "*"
+
+# Стадии воронки Bitrix по порядку прохождения
+FUNNEL_STAGES: Tuple[str, ...] = (
+    "NEW", "PREPARATION", "PREPAYMENT_INVOICE", "EXECUTING", "FINAL_INVOICE", "WON"
+)
+LOST_STAGES: Tuple[str, ...] = ("LOSE", "APOLOGY")
+NO_STAGE = "—"
+
+STAGE_NAMES: Dict[str, str] = {
+    "NEW": "🆕 Новая",
+    "PREPARATION": "📝 Подготовка документов",
+    "PREPAYMENT_INVOICE": "🧾 Счёт на предоплату",
+    "EXECUTING": "⚙️ В работе",
+    "FINAL_INVOICE": "💳 Финальный счёт",
+    "WON": "✅ Успешна",
+    "LOSE": "❌ Провалена",
+    "APOLOGY": "🔍 Анализ причины провала",
+    NO_STAGE: "Без стадии",
+}
+
+SOURCE_KEY = "deal_funnel_source"
+LAST_RUN_KEY = "deal_funnel_last_run"
+
+
+def stage_key(stage: Optional[str]) -> str:
+    """Стадия без префикса направления: 'C1:WON' -> 'WON'."""
+    if stage is None:
+        return NO_STAGE
+    return stage.split(":", 1)[-1]
+
+
+def stage_key_sql(column: str = "stage") -> str:
+    """SQL-выражение stage_key для колонки стадии."""
+    return (
+        f"CASE WHEN {column} IS NULL THEN '{NO_STAGE}' "
+        f"WHEN instr({column}, ':') > 0 THEN substr({column}, instr({column}, ':') + 1) "
+        f"ELSE {column} END"
+    )
+
+
+def configured_won_stages() -> Optional[Tuple[str, ...]]:
+    """
+    Выигранные стадии из LTV_WON_STAGES.
+
+    Returns:
+        Кортеж стадий без префикса направления или None — учитывать все сделки
+    """
+    raw = os.environ.get(WON_STAGES_ENV, "").strip()
+    if raw == ALL_STAGES:
+        return None
+    stages = tuple(stage.strip().upper() for stage in raw.split(",") if stage.strip())
+    return stages or DEFAULT_WON_STAGES
+
+
+@versioned_cache(maxsize=8)
+def _won_stage_values(stages: tuple) -> tuple:
+    """Значения bitrix_deals.stage (с префиксами направлений), соответствующие стадиям."""
+    ensure_analytics_indexes()
+    with read_connection() as conn:
+        values = conn.execute(text(
+            "SELECT DISTINCT stage FROM bitrix_deals WHERE stage IS NOT NULL"
+        )).scalars().all()
+    return tuple(sorted(value for value in values if stage_key(value) in stages))
+
+
+def won_stage_sql(column: str = "stage") -> str:
+    """
+    SQL-условие «сделка выиграна» для загрузчиков выручки.
+
+    Стадии подставляются литералами: список уже проверен по значениям в
+    базе, а одинаковый текст условия служит ключом настройки для
+    материализованных таблиц.
+
+    Args:
+        column: Колонка стадии (например, 'd.stage')
+
+    Returns:
+        Условие для WHERE ('1 = 1', если учитываются все сделки)
+    """
+    stages = configured_won_stages()
+    if stages is None:
+        return "1 = 1"
+
+    values = _won_stage_values(stages)
+    if not values:
+        return f"{column} IS NULL"
+    quoted = ", ".join("'" + value.replace("'", "''") + "'" for value in values)
+    return f"({column} IS NULL OR {column} IN ({quoted}))"
+
+
+def ensure_funnel_tables(conn) -> None:
+    """Создаёт таблицы воронки и истории стадий, если их нет."""
+    ensure_state_table(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS bitrix_deal_stage_history (
+            id INTEGER PRIMARY KEY,
+            deal_id TEXT NOT NULL,
+            stage TEXT,
+            created_time TEXT
+        )
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_deal_stage_history_deal
+        ON bitrix_deal_stage_history (deal_id, created_time)
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deal_stage_stats (
+            month TEXT,
+            segment TEXT,
+            stage TEXT,
+            deals INTEGER,
+            revenue REAL
+        )
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_deal_stage_stats_month
+        ON deal_stage_stats (month, segment)
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deal_stage_durations (
+            month TEXT,
+            segment TEXT,
+            stage TEXT,
+            stays INTEGER,
+            total_days REAL
+        )
+    """))
+
+
+def _source_fingerprint(conn) -> str:
+    """Отпечаток источника: распределение по стадиям, история переходов, сегменты."""
+    stages = conn.execute(text("""
+        SELECT stage, COUNT(*), MAX(id)
+        FROM bitrix_deals
+        GROUP BY stage
+    """)).fetchall()
+    history = conn.execute(text("SELECT COUNT(*), MAX(id) FROM bitrix_deal_stage_history")).fetchone()
+    source = repr((stages, tuple(history), company_dimensions_fingerprint(conn)))
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+def refresh_deal_funnel(force: bool = False) -> Dict[str, Any]:
+    """
+    Пересобирает таблицы воронки, если источник изменился.
+
+    Args:
+        force: Пересобрать без проверки отпечатка
+
+    Returns:
+        Dict: refreshed, stages — строк deal_stage_stats, refreshed_at
+    """
+    from .shooting_types import ensure_shooting_types
+
+    ensure_shooting_types()
+
+    def write(conn):
+        ensure_deal_indexes(conn)
+        ensure_funnel_tables(conn)
+
+        fingerprint = _source_fingerprint(conn)
+        if not force and get_state(conn, SOURCE_KEY) == fingerprint:
+            return {
+                "refreshed": False,
+                "stages": conn.execute(text("SELECT COUNT(*) FROM deal_stage_stats")).scalar(),
+                "refreshed_at": get_state(conn, LAST_RUN_KEY),
+            }
+
+        conn.execute(text("DELETE FROM deal_stage_stats"))
+        conn.execute(text(f"""
+            INSERT INTO deal_stage_stats (month, segment, stage, deals, revenue)
+            SELECT
+                strftime('%Y-%m', d.close_date),
+                COALESCE(c.segment, '—'),
+                {stage_key_sql("d.stage")},
+                COUNT(*),
+                COALESCE(SUM(d.opportunity), 0)
+            FROM bitrix_deals d
+            LEFT JOIN bitrix_companies c ON c.bitrix_id = d.company_id
+            GROUP BY 1, 2, 3
+        """))
+        stats_rows = conn.execute(text("SELECT changes()")).scalar()
+
+        # Пребывание в стадии — от входа в неё до следующего перехода сделки
+        conn.execute(text("DELETE FROM deal_stage_durations"))
+        conn.execute(text(f"""
+            INSERT INTO deal_stage_durations (month, segment, stage, stays, total_days)
+            WITH stays AS (
+                SELECT
+                    deal_id,
+                    stage,
+                    created_time,
+                    LEAD(created_time) OVER (
+                        PARTITION BY deal_id ORDER BY created_time, id
+                    ) as left_time
+                FROM bitrix_deal_stage_history
+            )
+            SELECT
+                strftime('%Y-%m', s.created_time),
+                COALESCE(c.segment, '—'),
+                {stage_key_sql("s.stage")},
+                COUNT(*),
+                SUM(julianday(s.left_time) - julianday(s.created_time))
+            FROM stays s
+            LEFT JOIN bitrix_deals d ON d.bitrix_id = s.deal_id
+            LEFT JOIN bitrix_companies c ON c.bitrix_id = d.company_id
+            WHERE s.left_time IS NOT NULL
+            GROUP BY 1, 2, 3
+        """))
+
+        refreshed_at = datetime.now().isoformat(timespec="seconds")
+        set_state(conn, SOURCE_KEY, fingerprint)
+        set_state(conn, LAST_RUN_KEY, refreshed_at)
+        return {"refreshed": True, "stages": stats_rows, "refreshed_at": refreshed_at}
+
+    return get_write_queue().run(write)
+
+
+def _funnel_state() -> Tuple[bool, bool]:
+    """
+    Состояние таблиц воронки (чтение без блокировки записи).
+
+    Returns:
+        (построены, совпадают с источником)
+    """
+    with read_connection() as conn:
+        if not tables_exist(conn, "bitrix_deal_stage_history", "deal_stage_stats",
+                            "deal_stage_durations", "analytics_state"):
+            return False, False
+        stored = get_state(conn, SOURCE_KEY)
+        return stored is not None, stored == _source_fingerprint(conn)
+
+
+@versioned_cache(maxsize=1)
+def ensure_deal_funnel() -> None:
+    """
+    Обновляет таблицы воронки не чаще одного раза на версию данных.
+
+    Отпечаток источника сверяется чтением; уже построенные таблицы при
+    занятой другой записью базе не пересобираются — страница не ждёт
+    писателя.
+    """
+    built, current = _funnel_state()
+    if current or (built and writer_busy()):
+        return
+    refresh_deal_funnel()
+
+
+def _filters(date_from: str, date_to: str, segments: tuple, column: str = "month") -> Tuple[str, Dict[str, Any]]:
+    """Условия по месяцу и сегментам для таблиц воронки."""
+    conditions = []
+    params: Dict[str, Any] = {}
+    if date_from is not None:
+        conditions.append(f"{column} >= :month_from")
+        params["month_from"] = date_from[:7]
+    if date_to is not None:
+        conditions.append(f"{column} <= :month_to")
+        params["month_to"] = date_to[:7]
+    if segments:
+        keys = [f"segment_{i}" for i in range(len(segments))]
+        params.update(zip(keys, segments))
+        conditions.append(f"segment IN ({', '.join(':' + key for key in keys)})")
+    return " AND ".join(conditions) or "1 = 1", params
+
+
+@versioned_cache(maxsize=32)
+def load_stage_stats(
+    by: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    segments: tuple = None
+) -> pd.DataFrame:
+    """
+    Загружает сделки по стадиям из предагрегированной таблицы.
+
+    Месяц — месяц закрытия сделки (для открытых — плановая дата); границы
+    периода округляются до месяца, сделки без даты входят только в
+    выборку без ограничения периода.
+
+    Args:
+        by: None, 'month' или 'segment' — дополнительная группировка
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+        segments: Оставить только эти сегменты (None — все)
+
+    Returns:
+        DataFrame: [by], stage, deals, revenue
+    """
+    if by not in (None, "month", "segment"):
+        raise ValueError(f"Неизвестная группировка: {by}")
+
+    ensure_deal_funnel()
+    where, params = _filters(date_from, date_to, segments)
+    group = f"{by}, stage" if by else "stage"
+
+    query = f"""
+        SELECT
+            {group},
+            SUM(deals) as deals,
+            SUM(revenue) as revenue
+        FROM deal_stage_stats
+        WHERE {where}
+          {"AND month IS NOT NULL" if by == "month" else ""}
+        GROUP BY {group}
+        ORDER BY {group}
+    """
+
+    with read_connection() as conn:
+        return pd.read_sql_query(text(query), conn, params=params)
+
+
+def build_funnel(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Воронка по текущим стадиям.
+
+    Сделка на стадии k прошла все предыдущие стадии, поэтому «дошли до
+    стадии» — сумма сделок на ней и на всех следующих стадиях воронки.
+
+    Args:
+        stats: stage, deals, revenue (результат load_stage_stats без группировки)
+
+    Returns:
+        DataFrame: stage, stage_name, deals, revenue, reached, conversion,
+        step_conversion — по FUNNEL_STAGES, затем проигранные и прочие стадии
+        (для них reached и конверсии пустые)
+    """
+    by_stage = stats.set_index("stage")[["deals", "revenue"]]
+    funnel = by_stage.reindex(list(FUNNEL_STAGES), fill_value=0)
+
+    reached = funnel["deals"].to_numpy()[::-1].cumsum()[::-1].astype(float)
+    funnel["reached"] = reached
+    with np.errstate(divide="ignore", invalid="ignore"):
+        funnel["conversion"] = np.where(reached[0] > 0, reached / reached[0], np.nan)
+        funnel["step_conversion"] = np.concatenate(([1.0], reached[1:] / reached[:-1]))
+
+    others = by_stage.drop(index=list(FUNNEL_STAGES), errors="ignore")
+    ordered = [stage for stage in LOST_STAGES if stage in others.index]
+    ordered += sorted(stage for stage in others.index if stage not in LOST_STAGES)
+
+    result = pd.concat([funnel, others.loc[ordered]]).rename_axis("stage").reset_index()
+    result.insert(1, "stage_name", result["stage"].map(lambda stage: STAGE_NAMES.get(stage, stage)))
+    return result
+
+
+def win_rate(stats: pd.DataFrame, by: str = None) -> pd.DataFrame:
+    """
+    Доля выигранных среди закрытых сделок (WON / (WON + проигранные)).
+
+    Args:
+        stats: Результат load_stage_stats
+        by: Колонка группировки stats или None
+
+    Returns:
+        DataFrame: [by], won, lost, win_rate
+    """
+    flags = stats.assign(
+        won=np.where(stats["stage"] == "WON", stats["deals"], 0),
+        lost=np.where(stats["stage"].isin(LOST_STAGES), stats["deals"], 0)
+    )
+    totals = flags.groupby(by)[["won", "lost"]].sum().reset_index() if by else flags[["won", "lost"]].sum().to_frame().T
+    closed = totals["won"] + totals["lost"]
+    totals["win_rate"] = np.where(closed > 0, totals["won"] / closed.where(closed > 0, 1), np.nan)
+    return totals
+
+
+@versioned_cache(maxsize=32)
+def load_stage_durations(
+    date_from: str = None,
+    date_to: str = None,
+    segments: tuple = None
+) -> pd.DataFrame:
+    """
+    Загружает среднее время в стадиях по истории переходов.
+
+    Args:
+        date_from: Начало периода входа в стадию ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+        segments: Оставить только эти сегменты (None — все)
+
+    Returns:
+        DataFrame: stage, stage_name, stays, avg_days (пустой без истории)
+    """
+    ensure_deal_funnel()
+    where, params = _filters(date_from, date_to, segments)
+
+    query = f"""
+        SELECT
+            stage,
+            SUM(stays) as stays,
+            SUM(total_days) / SUM(stays) as avg_days
+        FROM deal_stage_durations
+        WHERE {where}
+        GROUP BY stage
+    """
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+    order = {stage: i for i, stage in enumerate(FUNNEL_STAGES + LOST_STAGES)}
+    df = df.sort_values("stage", key=lambda s: s.map(order).fillna(len(order)), ignore_index=True)
+    df.insert(1, "stage_name", df["stage"].map(lambda stage: STAGE_NAMES.get(stage, stage)))
+    return df
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = refresh_deal_funnel(force="--force" in sys.argv)
+    if result["refreshed"]:
+        print(f"✅ Воронка пересобрана: {result['stages']} строк ({result['refreshed_at']})")
+    else:
+        print(f"ℹ️ Данные не менялись с {result['refreshed_at']}: {result['stages']} строк")
@@ -0,0 +1,407 @@
+"""
+Приём изменений из Bitrix в реальном времени
+
+События исходящих вебхуков Bitrix (ONCRMDEALADD / UPDATE / DELETE,
+ONCRMCOMPANYADD / UPDATE / DELETE) применяются к bitrix_deals и
+bitrix_companies без ночной выгрузки:
+
+- события копятся в EventBuffer и записываются пачкой: все события,
+  пришедшие за INGEST_LINGER_SECONDS (до INGEST_MAX_EVENTS), — одним
+  заданием общей очереди записи (writer.get_write_queue); несколько
+  событий одной сделки или компании в пачке сливаются в одно;
+- запись — upsert тем же INSERT OR REPLACE, что и у ночного импорта:
+  изменённая строка получает новый id, поэтому инкрементальные задачи
+  (активность, куб, сверка) видят её как новую. Поля, которых нет в
+  событии, берутся из сохранённой строки;
+- смена стадии сделки дописывается в bitrix_deal_stage_history;
+- LTV, количество заказов и сегмент затронутых компаний пересчитываются
+  по их выигранным сделкам (funnel.won_stage_sql);
+- то, чего инкрементальные задачи по отметке id не видят (прежний месяц
+  перенесённой сделки, компании удалённых сделок, уже учтённые в скетчах
+  сделки), обновляется точечно в той же транзакции, а счётчик изменений
+  (schema.bump_source_version) сбрасывает задачи с полным пересчётом.
+
+Запись меняет версию данных (cache.get_data_version): кэши загрузчиков
+и фигур сбрасываются, и страницы дашборда при следующем перезапуске
+показывают новые данные. Приёмник — dashboard/webhook.py.
+"""
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .activity import refresh_company_activity
+from .alerts import refresh_revenue_alerts
+from .cube import refresh_deal_cube
+from .funnel import ensure_funnel_tables, won_stage_sql
+from .schema import bump_source_version, ensure_deal_indexes
+from .segmentation import get_segment_thresholds, segment_case_sql
+from .shooting_types import sync_shooting_types
+from .sketches import invalidate_deal_sketches, refresh_deal_sketches
+from .writer import get_write_queue
+
+# Сколько ждать следующих событий, прежде чем записать пачку (секунд)
+INGEST_LINGER_SECONDS = 0.2
+# Событий в одной пачке
+INGEST_MAX_EVENTS = 1000
+
+# Поля событий Bitrix -> колонки таблиц
+DEAL_FIELDS: Dict[str, str] = {
+    "TITLE": "title",
+    "COMPANY_ID": "company_id",
+    "OPPORTUNITY": "opportunity",
+    "CLOSEDATE": "close_date",
+    "STAGE_ID": "stage",
+}
+COMPANY_FIELDS: Dict[str, str] = {
+    "TITLE": "title",
+    "UF_SHOOTING_TYPE": "primary_shooting_type",
+}
+
+# Событие -> (сущность, действие)
+EVENTS: Dict[str, Tuple[str, str]] = {
+    "ONCRMDEALADD": ("deal", "upsert"),
+    "ONCRMDEALUPDATE": ("deal", "upsert"),
+    "ONCRMDEALDELETE": ("deal", "delete"),
+    "ONCRMCOMPANYADD": ("company", "upsert"),
+    "ONCRMCOMPANYUPDATE": ("company", "upsert"),
+    "ONCRMCOMPANYDELETE": ("company", "delete"),
+}
+
+class EventError(ValueError):
+    """Событие, которое нельзя применить (неизвестный тип, нет ID, неверное поле)."""
+
+
+def _number(value) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    # Bitrix передаёт суммы строкой, иногда с валютой: "15000|RUB"
+    return float(str(value).split("|")[0].replace(",", "."))
+
+
+def _date(value) -> Optional[str]:
+    if value in (None, ""):
+        return None
+    # "2024-05-31T03:00:00+03:00" -> "2024-05-31"
+    return datetime.fromisoformat(str(value)[:10]).date().isoformat()
+
+
+def _company_id(value) -> Optional[str]:
+    # Сделка без компании приходит с COMPANY_ID = 0
+    return None if value in (None, "", "0", 0) else str(value)
+
+
+CONVERTERS = {
+    "opportunity": _number,
+    "close_date": _date,
+    "company_id": _company_id,
+}
+
+
+def parse_event(payload: Dict[str, Any]) -> Tuple[str, str, str, Dict[str, Any]]:
+    """
+    Разбирает событие вебхука Bitrix.
+
+    Args:
+        payload: {"event": "ONCRMDEALUPDATE", "data": {"FIELDS": {"ID": ..., ...}}}
+
+    Returns:
+        (сущность, действие, bitrix_id, {колонка: значение})
+    """
+    name = str(payload.get("event", "")).upper()
+    if name not in EVENTS:
+        raise EventError(f"Неизвестное событие: {name or '—'}")
+    entity, action = EVENTS[name]
+
+    fields = (payload.get("data") or {}).get("FIELDS") or {}
+    bitrix_id = fields.get("ID")
+    if bitrix_id in (None, ""):
+        raise EventError(f"{name}: нет data[FIELDS][ID]")
+
+    mapping = DEAL_FIELDS if entity == "deal" else COMPANY_FIELDS
+    values = {}
+    for field, column in mapping.items():
+        if field not in fields:
+            continue
+        value = fields[field]
+        try:
+            values[column] = CONVERTERS.get(column, lambda v: None if v == "" else str(v))(value)
+        except ValueError:
+            raise EventError(f"{name} {bitrix_id}: неверное значение {field}={value!r}")
+
+    return entity, action, str(bitrix_id), values
+
+
+def _coalesce(events: Iterable[Tuple[str, str, str, Dict[str, Any]]]) -> Dict[Tuple[str, str], Optional[Dict[str, Any]]]:
+    """
+    Сливает события пачки: одна запись на сущность.
+
+    Returns:
+        {(сущность, bitrix_id): поля для upsert или None для удаления}
+    """
+    changes: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+    for entity, action, bitrix_id, values in events:
+        key = (entity, bitrix_id)
+        if action == "delete":
+            changes[key] = None
+        else:
+            # Удаление, а затем добавление — новая строка без старых полей
+            merged = dict(changes.get(key) or {})
+            merged.update(values)
+            changes[key] = merged
+    return changes
+
+
+def _load_rows(conn, table: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Сохранённые строки по bitrix_id (все колонки)."""
+    rows = {}
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        keys = {f"id_{i}": value for i, value in enumerate(chunk)}
+        result = conn.execute(
+            text(f"SELECT * FROM {table} WHERE bitrix_id IN ({', '.join(':' + key for key in keys)})"),
+            keys
+        )
+        rows.update((row["bitrix_id"], dict(row)) for row in result.mappings())
+    return rows
+
+
+def _upsert(conn, table: str, changes: Dict[str, Dict[str, Any]], stored: Dict[str, Dict[str, Any]]) -> None:
+    """INSERT OR REPLACE строк с полями из событий поверх сохранённых."""
+    rows = []
+    for bitrix_id, values in changes.items():
+        row = dict(stored.get(bitrix_id) or {})
+        row.pop("id", None)
+        row.update(values)
+        row["bitrix_id"] = bitrix_id
+        rows.append(row)
+
+    # Строки выравниваются по общему набору колонок: у новых строк нет
+    # колонок, которые знают только сохранённые
+    columns = sorted({column for row in rows for column in row})
+    conn.execute(
+        text(f"""
+            INSERT OR REPLACE INTO {table} ({', '.join(columns)})
+            VALUES ({', '.join(':' + column for column in columns)})
+        """),
+        [{column: row.get(column) for column in columns} for row in rows]
+    )
+
+
+def _delete(conn, table: str, ids: List[str]) -> None:
+    if ids:
+        conn.execute(text(f"DELETE FROM {table} WHERE bitrix_id = :bitrix_id"), [{"bitrix_id": value} for value in ids])
+
+
+def update_company_aggregates(conn, company_ids: Iterable[str]) -> int:
+    """
+    Пересчитывает LTV, количество заказов и сегмент компаний по выигранным сделкам.
+
+    Args:
+        conn: Соединение в транзакции записи
+        company_ids: bitrix_id компаний
+
+    Returns:
+        Количество обновлённых компаний
+    """
+    ids = sorted({value for value in company_ids if value})
+    if not ids:
+        return 0
+
+    keys = {f"company_{i}": value for i, value in enumerate(ids)}
+    in_list = ", ".join(":" + key for key in keys)
+    segment = segment_case_sql(get_segment_thresholds(), column="t.ltv")
+
+    return conn.execute(text(f"""
+        UPDATE bitrix_companies
+        SET ltv = t.ltv, orders_count = t.orders_count, segment = {segment}
+        FROM (
+            SELECT
+                c.bitrix_id,
+                TOTAL(d.opportunity) as ltv,
+                COUNT(d.id) as orders_count
+            FROM bitrix_companies c
+            LEFT JOIN bitrix_deals d
+              ON d.company_id = c.bitrix_id
+             AND {won_stage_sql("d.stage")}
+            WHERE c.bitrix_id IN ({in_list})
+            GROUP BY c.bitrix_id
+        ) t
+        WHERE bitrix_companies.bitrix_id = t.bitrix_id
+    """), keys).rowcount
+
+
+def apply_events(events: Iterable[Tuple[str, str, str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Применяет пачку разобранных событий одной транзакцией.
+
+    Args:
+        events: Результаты parse_event в порядке поступления
+
+    Returns:
+        Dict: deals, companies, deleted, stage_changes, companies_updated,
+        months, source_version
+    """
+    changes = _coalesce(events)
+    deal_changes = {key[1]: values for key, values in changes.items() if key[0] == "deal"}
+    company_changes = {key[1]: values for key, values in changes.items() if key[0] == "company"}
+    won = won_stage_sql()
+    now = datetime.now().isoformat(timespec="seconds")
+
+    def write(conn):
+        ensure_deal_indexes(conn)
+        ensure_funnel_tables(conn)
+
+        stored_companies = _load_rows(conn, "bitrix_companies", list(company_changes))
+        upserts = {key: values for key, values in company_changes.items() if values is not None}
+        for bitrix_id, values in upserts.items():
+            if "title" in values:
+                values["title_normalized"] = (values["title"] or "").lower()
+            elif bitrix_id not in stored_companies:
+                values["title"] = values["title_normalized"] = ""
+        if upserts:
+            _upsert(conn, "bitrix_companies", upserts, stored_companies)
+        _delete(conn, "bitrix_companies", [key for key, values in company_changes.items() if values is None])
+
+        stored_deals = _load_rows(conn, "bitrix_deals", list(deal_changes))
+        won_before = set()
+        if stored_deals:
+            keys = {f"id_{i}": value for i, value in enumerate(stored_deals)}
+            won_before = set(conn.execute(
+                text(f"""
+                    SELECT bitrix_id FROM bitrix_deals
+                    WHERE bitrix_id IN ({', '.join(':' + key for key in keys)})
+                      AND close_date IS NOT NULL
+                      AND {won}
+                """),
+                keys
+            ).scalars())
+
+        upserts = {key: values for key, values in deal_changes.items() if values is not None}
+        deleted = [key for key, values in deal_changes.items() if values is None and key in stored_deals]
+        if upserts:
+            _upsert(conn, "bitrix_deals", upserts, stored_deals)
+        _delete(conn, "bitrix_deals", deleted)
+
+        # Новая стадия — запись в историю, как у crm.stagehistory.list
+        history = [
+            {"deal_id": bitrix_id, "stage": values["stage"], "created_time": now}
+            for bitrix_id, values in upserts.items()
+            if "stage" in values and values["stage"] != (stored_deals.get(bitrix_id) or {}).get("stage")
+        ]
+        if history:
+            conn.execute(
+                text("""
+                    INSERT INTO bitrix_deal_stage_history (deal_id, stage, created_time)
+                    VALUES (:deal_id, :stage, :created_time)
+                """),
+                history
+            )
+
+        # Компании и месяцы, которые сделки покинули: по отметке id их не найти
+        previous = [stored_deals[key] for key in deal_changes if key in stored_deals]
+        old_companies = {row["company_id"] for row in previous}
+        old_months = sorted({row["close_date"][:7] for row in previous if row["close_date"]})
+        new_companies = {values.get("company_id") or (stored_deals.get(key) or {}).get("company_id")
+                         for key, values in upserts.items()}
+
+        updated = update_company_aggregates(conn, old_companies | new_companies | set(company_changes))
+
+        if company_changes:
+            sync_shooting_types()
+        refresh_deal_cube(months=old_months)
+        refresh_company_activity(companies=sorted(value for value in old_companies if value))
+        if won_before:
+            invalidate_deal_sketches(conn)
+        else:
+            refresh_deal_sketches()
+
+        source_version = bump_source_version(conn)
+
+        return {
+            "deals": len(upserts),
+            "companies": sum(values is not None for values in company_changes.values()),
+            "deleted": len(deleted) + sum(values is None for values in company_changes.values()),
+            "stage_changes": len(history),
+            "companies_updated": updated,
+            "months": len(old_months),
+            "source_version": source_version,
+        }
+
+    return get_write_queue().run(write)
+
+
+class EventBuffer:
+    """
+    Буфер событий с пакетной записью.
+
+    add() возвращает Future, который завершается после фиксации пачки
+    с этими событиями (результат apply_events или её исключение).
+    Поток записи ждёт первое событие, затем ещё linger секунд собирает
+    следующие и записывает всё одной транзакцией. Когда новых событий
+    нет, после записи пересчитываются алерты по выручке: на странице
+    «Обзор» их никто не пересчитывает.
+    """
+
+    def __init__(self, linger: float = INGEST_LINGER_SECONDS, max_events: int = INGEST_MAX_EVENTS):
+        self.linger = linger
+        self.max_events = max_events
+        self.stats = {"batches": 0, "events": 0, "failed_batches": 0, "failed_alerts": 0, "last_batch": None}
+        self._pending: List[Tuple[List, Future]] = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, events: List[Tuple[str, str, str, Dict[str, Any]]]) -> Future:
+        """Ставит разобранные события в очередь записи."""
+        future = Future()
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="ltv-ingest", daemon=True)
+                self._thread.start()
+            self._pending.append((events, future))
+            self._condition.notify()
+        return future
+
+    def _take(self) -> List[Tuple[List, Future]]:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.linger
+            while sum(len(events) for events, _ in self._pending) < self.max_events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch, self._pending = self._pending, []
+        return batch
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._take()
+            events = [event for chunk, _ in batch for event in chunk]
+            try:
+                result = apply_events(events)
+            except Exception as error:
+                self.stats["failed_batches"] += 1
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["events"] += len(events)
+            self.stats["last_batch"] = dict(result, events=len(events), at=datetime.now().isoformat(timespec="seconds"))
+            for _, future in batch:
+                future.set_result(result)
+
+            # Следующая пачка снова сдвинет источник алертов — пересчёт,
+            # только когда поток событий затих
+            with self._condition:
+                idle = not self._pending
+            if idle:
+                try:
+                    refresh_revenue_alerts()
+                except Exception:
+                    self.stats["failed_alerts"] += 1
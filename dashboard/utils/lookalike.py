@@ -0,0 +1,187 @@
+"""
+Поиск похожих клиентов (lookalike)
+
+Каждый клиент с заказами описывается вектором признаков:
+- из bitrix_companies: LTV, количество заказов, медиана и среднее
+  заказов в год, средний чек (LTV / заказы);
+- из company_activity (по выигранным сделкам): сделок за 365 дней,
+  средний интервал между заказами, дней с последней сделки;
+- основной тип съёмки — one-hot с весом SHOOTING_TYPE_WEIGHT.
+
+Денежные и счётные признаки берутся в log1p (разница между 10 и 20
+тысячами важнее, чем между 1 010 и 1 020 тысячами), затем каждый
+признак стандартизуется по всей базе и умножается на свой вес
+(FEATURE_WEIGHTS). Похожесть — евклидово расстояние между векторами.
+
+Индекс — BallTree из scikit-learn: строится один раз на версию данных
+(versioned_cache) и общий для всех сессий; запрос k ближайших соседей
+по всей базе занимает миллисекунды. scikit-learn импортируется при
+построении индекса, а не при импорте модуля.
+"""
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .activity import SINGLE_DEAL_INTERVAL_DAYS, ensure_company_activity
+from .arrow_io import read_sql_arrow
+from .cache import versioned_cache
+from .shooting_types import ensure_shooting_types
+
+# Вес признака в расстоянии (после стандартизации)
+FEATURE_WEIGHTS: Dict[str, float] = {
+    "ltv": 2.0,
+    "orders_count": 1.5,
+    "orders_count_median": 1.0,
+    "orders_count_mean": 1.0,
+    "avg_check": 1.0,
+    "deals_365d": 1.0,
+    "avg_interval_days": 0.75,
+    "days_since_last": 0.75,
+}
+# Вес совпадения основного типа съёмки (расстояние между разными типами — вес × √2)
+SHOOTING_TYPE_WEIGHT = 1.5
+# Признаки в log1p
+LOG_FEATURES = ("ltv", "orders_count", "avg_check", "deals_365d", "avg_interval_days", "days_since_last")
+
+DEFAULT_NEIGHBOURS = 10
+
+RESULT_COLUMNS = [
+    "bitrix_id",
+    "title",
+    "ltv",
+    "segment",
+    "orders_count",
+    "primary_shooting_type",
+    "days_since_last",
+    "distance",
+    "similarity",
+]
+
+
+def build_features(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Строит взвешенные стандартизованные признаки клиентов.
+
+    Args:
+        frame: ltv, orders_count, orders_count_median, orders_count_mean,
+            shooting_type_id, deals_365d, avg_interval_days, days_since_last
+
+    Returns:
+        DataFrame признаков (по строке на клиента, индекс как у frame)
+    """
+    orders = frame["orders_count"].fillna(0).astype(float)
+    ltv = frame["ltv"].fillna(0).astype(float)
+    raw = pd.DataFrame({
+        "ltv": ltv,
+        "orders_count": orders,
+        "orders_count_median": frame["orders_count_median"].fillna(0).astype(float),
+        "orders_count_mean": frame["orders_count_mean"].fillna(0).astype(float),
+        "avg_check": ltv / orders.where(orders > 0),
+        "deals_365d": frame["deals_365d"].astype(float),
+        # Нет второй сделки — интервал как в оценке риска оттока
+        "avg_interval_days": frame["avg_interval_days"].astype(float).fillna(SINGLE_DEAL_INTERVAL_DAYS),
+        "days_since_last": frame["days_since_last"].astype(float).clip(lower=0),
+    }, index=frame.index)
+    # Пропуски (нет выигранных сделок) — медиана базы, чтобы не сдвигать клиента к нулю
+    raw = raw.fillna(raw.median()).fillna(0)
+    raw[list(LOG_FEATURES)] = np.log1p(raw[list(LOG_FEATURES)].clip(lower=0))
+
+    std = raw.std(ddof=0).replace(0, 1)
+    features = (raw - raw.mean()) / std * pd.Series(FEATURE_WEIGHTS)
+
+    types = pd.get_dummies(frame["shooting_type_id"].astype("Int64"), prefix="type", dtype=float)
+    return pd.concat([features, types * SHOOTING_TYPE_WEIGHT], axis=1)
+
+
+class LookalikeIndex:
+    """Признаки клиентов и дерево ближайших соседей над ними."""
+
+    def __init__(self, frame: pd.DataFrame):
+        from sklearn.neighbors import BallTree
+
+        frame = frame.reset_index(drop=True)
+        features = build_features(frame)
+        self.feature_names: List[str] = list(features.columns)
+        self.frame = frame[["bitrix_id", "title", "ltv", "segment", "orders_count",
+                            "primary_shooting_type", "days_since_last"]]
+        self.positions = pd.Index(frame["bitrix_id"])
+        self.tree = BallTree(features.to_numpy(dtype=np.float64))
+        self.memory_bytes = int(self.frame.memory_usage(deep=True).sum()) + features.shape[0] * features.shape[1] * 8
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def query(self, bitrix_id: str, k: int = DEFAULT_NEIGHBOURS) -> pd.DataFrame:
+        """
+        k ближайших к клиенту (без него самого).
+
+        Args:
+            bitrix_id: Bitrix ID клиента
+            k: Сколько похожих вернуть
+
+        Returns:
+            DataFrame RESULT_COLUMNS по возрастанию расстояния; пустой, если клиента нет в индексе
+        """
+        if bitrix_id not in self.positions or len(self) < 2:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+
+        position = self.positions.get_loc(bitrix_id)
+        point = self.tree.data[position:position + 1]
+        distances, positions = self.tree.query(point, k=min(k + 1, len(self)))
+        distances, positions = distances[0], positions[0]
+
+        keep = positions != position
+        result = self.frame.take(positions[keep][:k]).reset_index(drop=True)
+        result["distance"] = distances[keep][:k]
+        result["similarity"] = 1 / (1 + result["distance"])
+        return result[RESULT_COLUMNS]
+
+
+@versioned_cache(maxsize=1)
+def load_lookalike_index() -> LookalikeIndex:
+    """
+    Строит индекс похожих клиентов (один раз на версию данных).
+
+    Returns:
+        LookalikeIndex по всем клиентам с заказами
+    """
+    ensure_shooting_types()
+    ensure_company_activity()
+
+    query = """
+        SELECT
+            c.bitrix_id,
+            c.title,
+            c.ltv,
+            c.segment,
+            c.orders_count,
+            c.orders_count_median,
+            c.orders_count_mean,
+            c.shooting_type_id,
+            t.name as primary_shooting_type,
+            a.deals_365d,
+            a.avg_interval_days,
+            a.days_since_last
+        FROM bitrix_companies c
+        LEFT JOIN shooting_types t ON t.id = c.shooting_type_id
+        LEFT JOIN company_activity a ON a.company_id = c.bitrix_id
+        WHERE c.orders_count > 0
+    """
+    return LookalikeIndex(read_sql_arrow(query))
+
+
+@versioned_cache(maxsize=256)
+def find_similar(bitrix_id: str, k: int = DEFAULT_NEIGHBOURS) -> pd.DataFrame:
+    """
+    Находит клиентов, похожих на данного.
+
+    Args:
+        bitrix_id: Bitrix ID клиента
+        k: Сколько похожих вернуть
+
+    Returns:
+        DataFrame: bitrix_id, title, ltv, segment, orders_count,
+        primary_shooting_type, days_since_last, distance, similarity (0..1]
+    """
+    return load_lookalike_index().query(str(bitrix_id), k)
@@ -0,0 +1,192 @@
+"""
+Профилирование перезапусков страниц
+
+Включается переменной окружения LTV_PROFILE=1 (все перезапуски всех
+сессий) или параметром адреса ?profile=1 (только эта сессия, до
+?profile=0; число вместо 1 — сколько строк показать). Каждый перезапуск страницы
+выполняется под cProfile:
+
+- профиль сохраняется в LTV_PROFILE_DIR (по умолчанию ltv-profiles во
+  временном каталоге системы, вне репозитория) файлом
+  <время>_<страница>.prof — его можно открыть `python -m pstats` или
+  snakeviz;
+- внизу страницы — свёрнутый блок с разбивкой собственного времени по
+  слоям (SQL, pandas, Plotly, Streamlit, код дашборда) и топом функций.
+
+cProfile следит только за потоком, в котором включён, а Streamlit
+выполняет каждую сессию в своём потоке, поэтому профили одновременных
+сессий не смешиваются.
+"""
+import cProfile
+import os
+import pstats
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+import streamlit as st
+
+PROFILE_ENV = "LTV_PROFILE"
+PROFILE_DIR_ENV = "LTV_PROFILE_DIR"
+PROFILE_PARAM = "profile"
+SESSION_KEY = "profile_rerun"
+DEFAULT_PROFILE_DIR = Path(tempfile.gettempdir()) / "ltv-profiles"
+DEFAULT_TOP_N = 25
+
+# Слой по пути файла функции: первый совпавший шаблон
+LAYERS: Dict[str, str] = {
+    "SQL": r"sqlite3|sqlalchemy|arrow_io",
+    "pandas / numpy": r"pandas|numpy|pyarrow",
+    "Plotly": r"plotly|_plotly_utils",
+    "Streamlit": r"streamlit",
+    "Код дашборда": r"dashboard",
+}
+
+
+def _top_n_requested() -> Optional[int]:
+    """Сколько строк показать, если профилирование включено (иначе None)."""
+    # Параметр адреса при переходе между страницами пропадает: запоминаем его в сессии
+    if PROFILE_PARAM in st.query_params:
+        st.session_state[SESSION_KEY] = st.query_params[PROFILE_PARAM]
+    value = st.session_state.get(SESSION_KEY) or os.environ.get(PROFILE_ENV)
+    if not value or value.lower() in ("0", "false", "no"):
+        return None
+    return int(value) if value.isdigit() and int(value) > 1 else DEFAULT_TOP_N
+
+
+def _layer(filename: str) -> str:
+    for layer, pattern in LAYERS.items():
+        if re.search(pattern, filename):
+            return layer
+    return "Прочее"
+
+
+def _resolve_layers(stats: pstats.Stats) -> Dict[tuple, str]:
+    """
+    Слой каждой функции профиля.
+
+    Стандартная библиотека и встроенные функции без своего слоя относятся
+    к слою вызывающего, от которого пришла большая часть их времени:
+    os.path внутри Streamlit — это время Streamlit.
+    """
+    layers: Dict[tuple, str] = {}
+
+    def resolve(key: tuple, seen: frozenset) -> str:
+        if key in layers:
+            return layers[key]
+        filename, _, name = key
+        layer = _layer(name if filename == "~" else filename)
+        if layer == "Прочее":
+            callers = stats.stats[key][4]
+            candidates = [caller for caller in callers if caller not in seen and caller in stats.stats]
+            if candidates:
+                main_caller = max(candidates, key=lambda caller: callers[caller][3])
+                layer = resolve(main_caller, seen | {key})
+        layers[key] = layer
+        return layer
+
+    for key in stats.stats:
+        resolve(key, frozenset())
+    return layers
+
+
+def hotspots(stats: pstats.Stats) -> pd.DataFrame:
+    """
+    Функции профиля с собственным и накопленным временем.
+
+    Args:
+        stats: Статистика cProfile
+
+    Returns:
+        DataFrame: function, location, layer, calls, self_time, cumulative_time
+    """
+    layers = _resolve_layers(stats)
+    rows = []
+    for key, (_, calls, self_time, cumulative, _) in stats.stats.items():
+        filename, line, name = key
+        location = filename if filename == "~" else f"{Path(filename).name}:{line}"
+        rows.append((name, location, layers[key], calls, self_time, cumulative))
+    return pd.DataFrame(
+        rows,
+        columns=["function", "location", "layer", "calls", "self_time", "cumulative_time"]
+    ).sort_values("self_time", ascending=False, ignore_index=True)
+
+
+def _profile_path(page: str) -> Path:
+    directory = Path(os.environ.get(PROFILE_DIR_ENV) or DEFAULT_PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^\w-]+", "_", page).strip("_") or "home"
+    return directory / f"{datetime.now():%Y%m%d-%H%M%S-%f}_{slug}.prof"
+
+
+def _render_summary(table: pd.DataFrame, wall_time: float, path: Path, top_n: int) -> None:
+    with st.expander(f"⏱️ Профиль перезапуска: {wall_time * 1000:.0f} мс", expanded=False):
+        st.caption(f"Файл профиля: `{path}` (python -m pstats / snakeviz)")
+
+        layers = (
+            table.groupby("layer", as_index=False)["self_time"].sum()
+            .sort_values("self_time", ascending=False)
+        )
+        layers["share"] = layers["self_time"] / max(layers["self_time"].sum(), 1e-9)
+        st.dataframe(
+            layers,
+            hide_index=True,
+            width="stretch",
+            column_config={
+                "layer": "Слой",
+                "self_time": st.column_config.NumberColumn("Собственное время, с", format="%.3f"),
+                "share": st.column_config.ProgressColumn("Доля", format="percent", min_value=0, max_value=1),
+            }
+        )
+
+        st.dataframe(
+            table.head(top_n),
+            hide_index=True,
+            width="stretch",
+            column_config={
+                "function": "Функция",
+                "location": "Где",
+                "layer": "Слой",
+                "calls": st.column_config.NumberColumn("Вызовов", format="%d"),
+                "self_time": st.column_config.NumberColumn("Собственное, с", format="%.4f"),
+                "cumulative_time": st.column_config.NumberColumn("С вложенными, с", format="%.4f"),
+            }
+        )
+
+
+@contextmanager
+def profile_rerun(page: str):
+    """
+    Профилирует блок (перезапуск страницы), если профилирование включено.
+
+    Args:
+        page: Имя страницы для файла профиля
+    """
+    top_n = _top_n_requested()
+    if top_n is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+: в процессе может работать только один профилировщик
+        st.warning("⚠️ Профилировщик уже запущен другим перезапуском — этот выполняется без профиля")
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall_time = time.perf_counter() - started
+        path = _profile_path(page)
+        profiler.dump_stats(path)
+        _render_summary(hotspots(pstats.Stats(profiler)), wall_time, path, top_n)
@@ -0,0 +1,301 @@
+"""
+Сверка LTV компаний со сделками
+
+Сравнивает сохранённые `bitrix_companies.ltv` / `orders_count` с суммой
+`opportunity` и количеством сделок в `bitrix_deals` одним set-based
+запросом (агрегат по company_id + JOIN). Результат пишется в таблицу
+`ltv_reconciliation`.
+
+Суммы сделок считаются только по выигранным стадиям
+(funnel.won_stage_sql), как LTV и количество заказов в остальном
+дашборде; смена настройки стадий делает следующий прогон полным.
+
+Инкрементальный режим проверяет только компании, затронутые после
+прошлого запуска: с новыми сделками или новыми/перезаписанными строками
+в bitrix_companies (по водяным отметкам id). Изменения на месте (UPDATE)
+он не видит — для них нужен полный прогон.
+
+Сверка — запись (run_ltv_reconciliation), загрузчики отчёта только
+читают через read_connection() и не ждут писателя; до первого прогона
+отчёт пуст.
+"""
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import text
+from typing import Dict, Any
+
+from .funnel import won_stage_sql
+from .schema import ensure_state_table, ensure_deal_indexes, get_state, set_state, tables_exist
+from .writer import get_write_queue, read_connection
+
+DEALS_WATERMARK_KEY = "reconciliation_deals_watermark"
+COMPANIES_WATERMARK_KEY = "reconciliation_companies_watermark"
+LAST_RUN_KEY = "reconciliation_last_run"
+WON_STAGES_KEY = "reconciliation_won_stages"
+
+# Допустимое расхождение LTV (₽)
+DEFAULT_TOLERANCE = 0.01
+
+ISSUE_LABELS = {
+    "ltv_mismatch": "Расхождение LTV",
+    "orders_mismatch": "Расхождение кол-ва заказов",
+    "ltv_orders_mismatch": "Расхождение LTV и заказов",
+    "no_deals": "Нет сделок",
+    "orphan_deals": "Сделки без компании",
+}
+
+RECONCILIATION_QUERY = """
+    WITH deal_totals AS (
+        SELECT
+            company_id,
+            SUM(opportunity) as deals_ltv,
+            COUNT(*) as deals_count
+        FROM bitrix_deals
+        WHERE company_id IS NOT NULL
+          AND company_id != ''
+          AND {won}
+          {deals_scope}
+        GROUP BY company_id
+    ),
+    joined AS (
+        SELECT
+            c.bitrix_id as company_id,
+            c.title,
+            COALESCE(c.ltv, 0) as stored_ltv,
+            COALESCE(d.deals_ltv, 0) as deals_ltv,
+            COALESCE(c.orders_count, 0) as stored_orders,
+            COALESCE(d.deals_count, 0) as deals_count,
+            d.company_id IS NOT NULL as has_deals,
+            1 as has_company
+        FROM bitrix_companies c
+        LEFT JOIN deal_totals d ON d.company_id = c.bitrix_id
+        {companies_scope}
+
+        UNION ALL
+
+        SELECT
+            d.company_id,
+            NULL,
+            0,
+            d.deals_ltv,
+            0,
+            d.deals_count,
+            1,
+            0
+        FROM deal_totals d
+        WHERE NOT EXISTS (
+            SELECT 1 FROM bitrix_companies c WHERE c.bitrix_id = d.company_id
+        )
+    ),
+    classified AS (
+        SELECT
+            *,
+            CASE
+                WHEN has_company = 0 THEN 'orphan_deals'
+                WHEN has_deals = 0 THEN
+                    CASE WHEN stored_ltv != 0 OR stored_orders != 0 THEN 'no_deals' END
+                WHEN ABS(stored_ltv - deals_ltv) > :tolerance AND stored_orders != deals_count
+                    THEN 'ltv_orders_mismatch'
+                WHEN ABS(stored_ltv - deals_ltv) > :tolerance THEN 'ltv_mismatch'
+                WHEN stored_orders != deals_count THEN 'orders_mismatch'
+            END as issue
+        FROM joined
+    )
+    INSERT INTO ltv_reconciliation
+    (company_id, title, stored_ltv, deals_ltv, ltv_diff,
+     stored_orders, deals_count, orders_diff, issue, checked_at)
+    SELECT
+        company_id,
+        title,
+        stored_ltv,
+        deals_ltv,
+        stored_ltv - deals_ltv,
+        stored_orders,
+        deals_count,
+        stored_orders - deals_count,
+        issue,
+        :checked_at
+    FROM classified
+    WHERE issue IS NOT NULL
+"""
+
+
+def ensure_reconciliation_tables(conn) -> None:
+    """Создаёт таблицу отчёта сверки, если её нет."""
+    ensure_state_table(conn)
+    ensure_deal_indexes(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ltv_reconciliation (
+            company_id TEXT PRIMARY KEY,
+            title TEXT,
+            stored_ltv REAL,
+            deals_ltv REAL,
+            ltv_diff REAL,
+            stored_orders INTEGER,
+            deals_count INTEGER,
+            orders_diff INTEGER,
+            issue TEXT NOT NULL,
+            checked_at TEXT
+        )
+    """))
+
+
+def run_ltv_reconciliation(incremental: bool = False, tolerance: float = DEFAULT_TOLERANCE) -> Dict[str, Any]:
+    """
+    Выполняет сверку и обновляет таблицу ltv_reconciliation.
+
+    Args:
+        incremental: Проверить только компании, затронутые после прошлого запуска
+        tolerance: Допустимое расхождение LTV (₽)
+
+    Returns:
+        Dict с количеством проверенных компаний и найденных расхождений
+    """
+    checked_at = datetime.now().isoformat(timespec="seconds")
+    won = won_stage_sql()
+
+    def write(conn):
+        nonlocal incremental
+        ensure_reconciliation_tables(conn)
+
+        deals_watermark = int(get_state(conn, DEALS_WATERMARK_KEY, 0))
+        companies_watermark = int(get_state(conn, COMPANIES_WATERMARK_KEY, 0))
+        max_deal_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+        max_company_id = conn.execute(text("SELECT MAX(id) FROM bitrix_companies")).scalar() or 0
+
+        # Инкрементальный режим без базовой отметки или при другой настройке
+        # выигранных стадий равен полному прогону
+        incremental = (
+            incremental
+            and get_state(conn, LAST_RUN_KEY) is not None
+            and get_state(conn, WON_STAGES_KEY) == won
+        )
+
+        if incremental:
+            conn.execute(text("DROP TABLE IF EXISTS temp.reconciliation_scope"))
+            conn.execute(text("""
+                CREATE TEMP TABLE reconciliation_scope AS
+                SELECT company_id FROM bitrix_deals
+                WHERE id > :deals_after AND id <= :deals_upto
+                  AND company_id IS NOT NULL
+                UNION
+                SELECT bitrix_id FROM bitrix_companies
+                WHERE id > :companies_after AND id <= :companies_upto
+            """), {
+                "deals_after": deals_watermark,
+                "deals_upto": max_deal_id,
+                "companies_after": companies_watermark,
+                "companies_upto": max_company_id
+            })
+            checked = conn.execute(text("SELECT COUNT(*) FROM temp.reconciliation_scope")).scalar()
+
+            conn.execute(text("""
+                DELETE FROM ltv_reconciliation
+                WHERE company_id IN (SELECT company_id FROM temp.reconciliation_scope)
+            """))
+            query = RECONCILIATION_QUERY.format(
+                won=won,
+                deals_scope="AND company_id IN (SELECT company_id FROM temp.reconciliation_scope)",
+                companies_scope="WHERE c.bitrix_id IN (SELECT company_id FROM temp.reconciliation_scope)"
+            )
+        else:
+            checked = conn.execute(text("SELECT COUNT(*) FROM bitrix_companies")).scalar()
+            conn.execute(text("DELETE FROM ltv_reconciliation"))
+            query = RECONCILIATION_QUERY.format(won=won, deals_scope="", companies_scope="")
+
+        conn.execute(text(query), {"tolerance": tolerance, "checked_at": checked_at})
+        found = conn.execute(text("SELECT changes()")).scalar()
+
+        if incremental:
+            conn.execute(text("DROP TABLE temp.reconciliation_scope"))
+
+        set_state(conn, DEALS_WATERMARK_KEY, max_deal_id)
+        set_state(conn, COMPANIES_WATERMARK_KEY, max_company_id)
+        set_state(conn, LAST_RUN_KEY, checked_at)
+        set_state(conn, WON_STAGES_KEY, won)
+
+        return {
+            "mode": "incremental" if incremental else "full",
+            "checked": checked,
+            "issues_found": found,
+            "checked_at": checked_at
+        }
+
+    return get_write_queue().run(write)
+
+
+def load_reconciliation_summary() -> Dict[str, Any]:
+    """
+    Загружает сводку по последнему отчёту сверки.
+
+    Returns:
+        Dict с временем последнего запуска и количеством проблем по типам
+    """
+    with read_connection() as conn:
+        if tables_exist(conn, "ltv_reconciliation", "analytics_state"):
+            last_run = get_state(conn, LAST_RUN_KEY)
+            rows = conn.execute(text("""
+                SELECT issue, COUNT(*), SUM(ABS(ltv_diff))
+                FROM ltv_reconciliation
+                GROUP BY issue
+            """)).fetchall()
+        else:
+            last_run, rows = None, []
+
+    return {
+        "last_run": last_run,
+        "issues": {row[0]: row[1] for row in rows},
+        "total_issues": sum(row[1] for row in rows),
+        "total_abs_ltv_diff": sum(row[2] or 0 for row in rows)
+    }
+
+
+def load_reconciliation_report(issue: str = None, limit: int = 1000) -> pd.DataFrame:
+    """
+    Загружает строки отчёта сверки.
+
+    Args:
+        issue: Фильтр по типу проблемы (ключ ISSUE_LABELS)
+        limit: Максимальное количество записей
+
+    Returns:
+        DataFrame с расхождениями, по убыванию модуля разницы LTV
+    """
+    query = """
+        SELECT
+            company_id,
+            title,
+            issue,
+            stored_ltv,
+            deals_ltv,
+            ltv_diff,
+            stored_orders,
+            deals_count,
+            orders_diff,
+            checked_at
+        FROM ltv_reconciliation
+    """
+    params = {"limit": limit}
+
+    if issue:
+        query += " WHERE issue = :issue"
+        params["issue"] = issue
+
+    query += " ORDER BY ABS(ltv_diff) DESC LIMIT :limit"
+
+    with read_connection() as conn:
+        if not tables_exist(conn, "ltv_reconciliation"):
+            return pd.DataFrame(columns=[
+                "company_id", "title", "issue", "stored_ltv", "deals_ltv", "ltv_diff",
+                "stored_orders", "deals_count", "orders_diff", "checked_at"
+            ])
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+    return df
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = run_ltv_reconciliation(incremental="--incremental" in sys.argv)
+    print(f"✅ Сверка ({result['mode']}): проверено {result['checked']}, расхождений {result['issues_found']}")
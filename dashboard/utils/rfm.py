@@ -0,0 +1,309 @@
+"""
+RFM-скоринг клиентов
+
+Для каждой компании по выигранным сделкам bitrix_deals одним
+сгруппированным запросом считаются:
+- R (recency) — дней с последней сделки;
+- F (frequency) — количество сделок;
+- M (monetary) — сумма сделок.
+
+Баллы 1–5 — квинтили по всей базе клиентов, вычисленные векторно
+(доли рангов → pd.cut на равные интервалы): 5 — лучшие 20% (самые
+недавние, частые, крупные). Равные значения получают одинаковый балл,
+поэтому квинтили могут быть неравными по размеру. Ячейка RFM — строка вида "545", rfm_score — сумма баллов
+(3–15), rfm_segment — маркетинговая группа по R и F.
+
+Результат хранится в таблице company_rfm с индексами по rfm_score и
+(rfm_segment, rfm_score). Квинтили относительны, поэтому любая новая
+сделка меняет баллы всей базы: таблица пересчитывается целиком, но не
+чаще одного раза на версию данных и день. Запуск вручную:
+    python -m dashboard.utils.rfm [--force]
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from .cache import versioned_cache
+from .funnel import won_stage_sql
+from .schema import (
+    ensure_analytics_indexes,
+    ensure_state_table,
+    get_source_version,
+    get_state,
+    set_state,
+    tables_exist
+)
+from .segmentation import segment_case_sql, segment_order_sql
+from .writer import get_write_queue, read_connection, writer_busy
+
+SCORE_BINS = 5
+
+SOURCE_KEY = "company_rfm_source"
+LAST_RUN_KEY = "company_rfm_last_run"
+
+# Группы по баллам R и F: (название, условие); первое совпавшее условие
+RFM_SEGMENTS = (
+    ("🏆 Чемпионы", lambda r, f: (r >= 4) & (f >= 4)),
+    ("💎 Лояльные", lambda r, f: (r >= 3) & (f >= 3)),
+    ("🌱 Новые", lambda r, f: (r >= 4) & (f <= 2)),
+    ("⚠️ Под угрозой", lambda r, f: (r <= 2) & (f >= 3)),
+    ("😴 Спящие", lambda r, f: (r <= 2) & (f <= 2)),
+)
+RFM_FALLBACK_SEGMENT = "👀 Требуют внимания"
+RFM_SEGMENT_ORDER = [name for name, _ in RFM_SEGMENTS] + [RFM_FALLBACK_SEGMENT]
+
+
+def ensure_rfm_table(conn) -> None:
+    """Создаёт таблицу RFM-баллов и её индексы, если их нет."""
+    ensure_state_table(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS company_rfm (
+            company_id TEXT PRIMARY KEY,
+            recency_days INTEGER,
+            frequency INTEGER,
+            monetary REAL,
+            r_score INTEGER,
+            f_score INTEGER,
+            m_score INTEGER,
+            rfm_cell TEXT,
+            rfm_score INTEGER,
+            rfm_segment TEXT
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_company_rfm_score ON company_rfm (rfm_score)"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_company_rfm_segment
+        ON company_rfm (rfm_segment, rfm_score)
+    """))
+
+
+def quintile_scores(values: pd.Series, higher_is_better: bool = True) -> np.ndarray:
+    """
+    Баллы 1..SCORE_BINS по квантилям значения во всей выборке.
+
+    Ранг с усреднением равных значений делится на SCORE_BINS равных
+    интервалов, поэтому одинаковые значения всегда получают один балл.
+
+    Args:
+        values: Значения показателя
+        higher_is_better: Большее значение — больший балл
+
+    Returns:
+        Массив баллов (int8)
+    """
+    ranks = values.rank(method="average", pct=True, ascending=higher_is_better)
+    return pd.cut(ranks, bins=np.linspace(0, 1, SCORE_BINS + 1), labels=False, include_lowest=True).to_numpy(np.int8) + 1
+
+
+def rfm_segment_names(r: np.ndarray, f: np.ndarray) -> np.ndarray:
+    """Маркетинговые группы по баллам R и F (векторно)."""
+    return np.select(
+        [condition(r, f) for _, condition in RFM_SEGMENTS],
+        [name for name, _ in RFM_SEGMENTS],
+        default=RFM_FALLBACK_SEGMENT
+    )
+
+
+def compute_rfm_scores(deals: pd.DataFrame, today: date) -> pd.DataFrame:
+    """
+    Считает баллы RFM для всех компаний сразу.
+
+    Args:
+        deals: company_id, last_deal, frequency, monetary (по компании)
+        today: Дата, от которой считается давность
+
+    Returns:
+        DataFrame строк таблицы company_rfm
+    """
+    recency = (pd.Timestamp(today) - pd.to_datetime(deals["last_deal"])).dt.days.clip(lower=0)
+    frequency = deals["frequency"].astype(np.int64)
+    monetary = deals["monetary"].fillna(0).astype(float)
+
+    r = quintile_scores(recency, higher_is_better=False)
+    f = quintile_scores(frequency)
+    m = quintile_scores(monetary)
+
+    return pd.DataFrame({
+        "company_id": deals["company_id"],
+        "recency_days": recency.astype(np.int64),
+        "frequency": frequency,
+        "monetary": monetary,
+        "r_score": r,
+        "f_score": f,
+        "m_score": m,
+        "rfm_cell": pd.Series(r.astype(str)) + pd.Series(f.astype(str)) + pd.Series(m.astype(str)),
+        "rfm_score": r.astype(np.int64) + f + m,
+        "rfm_segment": rfm_segment_names(r, f),
+    })
+
+
+def _source_fingerprint(conn, today: str, won: str) -> str:
+    """Отпечаток источника баллов: последняя сделка, версия данных, день, стадии."""
+    max_deal_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar()
+    return f"{max_deal_id}:{get_source_version(conn)}:{today}:{won}"
+
+
+def _rfm_state(today: str) -> Tuple[bool, bool]:
+    """
+    Состояние RFM-баллов (чтение без блокировки записи).
+
+    Returns:
+        (посчитаны, актуальны на сегодня)
+    """
+    won = won_stage_sql()
+    with read_connection() as conn:
+        if not tables_exist(conn, "company_rfm", "analytics_state"):
+            return False, False
+        stored = get_state(conn, SOURCE_KEY)
+        return stored is not None, stored == _source_fingerprint(conn, today, won)
+
+
+def refresh_rfm_scores(force: bool = False) -> Dict[str, Any]:
+    """
+    Пересчитывает таблицу company_rfm, если появились сделки или сменился день.
+
+    Args:
+        force: Пересчитать без проверки отпечатка источника
+
+    Returns:
+        Dict: refreshed, companies, scored_at
+    """
+    today = date.today()
+    won = won_stage_sql()
+
+    def check(conn):
+        ensure_rfm_table(conn)
+        fingerprint = _source_fingerprint(conn, today.isoformat(), won)
+        if not force and get_state(conn, SOURCE_KEY) == fingerprint:
+            return fingerprint, {
+                "refreshed": False,
+                "companies": conn.execute(text("SELECT COUNT(*) FROM company_rfm")).scalar(),
+                "scored_at": get_state(conn, LAST_RUN_KEY),
+            }
+        return fingerprint, None
+
+    fingerprint, current = get_write_queue().run(check)
+    if current is not None:
+        return current
+
+    ensure_analytics_indexes()
+
+    # Один проход по сделкам: R, F и M для всех компаний
+    query = f"""
+        SELECT
+            company_id,
+            MAX(date(close_date)) as last_deal,
+            COUNT(*) as frequency,
+            SUM(opportunity) as monetary
+        FROM bitrix_deals
+        WHERE company_id IS NOT NULL
+          AND close_date IS NOT NULL
+          AND {won}
+        GROUP BY company_id
+    """
+    with read_connection() as conn:
+        deals = pd.read_sql_query(text(query), conn)
+
+    scores = compute_rfm_scores(deals, today)
+    scored_at = datetime.now().isoformat(timespec="seconds")
+
+    def write(conn):
+        conn.execute(text("DELETE FROM company_rfm"))
+        if not scores.empty:
+            conn.execute(text("""
+                INSERT INTO company_rfm
+                (company_id, recency_days, frequency, monetary, r_score, f_score, m_score,
+                 rfm_cell, rfm_score, rfm_segment)
+                VALUES
+                (:company_id, :recency_days, :frequency, :monetary, :r_score, :f_score, :m_score,
+                 :rfm_cell, :rfm_score, :rfm_segment)
+            """), scores.astype(object).to_dict("records"))
+        set_state(conn, SOURCE_KEY, fingerprint)
+        set_state(conn, LAST_RUN_KEY, scored_at)
+
+    get_write_queue().run(write)
+    return {"refreshed": True, "companies": len(scores), "scored_at": scored_at}
+
+
+@versioned_cache(maxsize=1)
+def _ensure_rfm_scores(today: str) -> None:
+    built, current = _rfm_state(today)
+    if current or (built and writer_busy()):
+        return
+    refresh_rfm_scores()
+
+
+def ensure_rfm_scores() -> None:
+    """Обновляет RFM-баллы не чаще одного раза на версию данных и день."""
+    _ensure_rfm_scores(date.today().isoformat())
+
+
+@versioned_cache(maxsize=4)
+def load_rfm_grid() -> pd.DataFrame:
+    """
+    Загружает сетку R × F: клиентов и средний M в каждой ячейке.
+
+    Returns:
+        DataFrame: r_score, f_score, count, avg_monetary
+    """
+    ensure_rfm_scores()
+
+    query = """
+        SELECT
+            r_score,
+            f_score,
+            COUNT(*) as count,
+            AVG(monetary) as avg_monetary
+        FROM company_rfm
+        GROUP BY r_score, f_score
+        ORDER BY r_score, f_score
+    """
+
+    with read_connection() as conn:
+        return pd.read_sql_query(text(query), conn)
+
+
+@versioned_cache(maxsize=32)
+def load_rfm_segment_matrix(thresholds: tuple = None) -> pd.DataFrame:
+    """
+    Загружает количество клиентов по сегментам A/B/C/U и группам RFM.
+
+    Args:
+        thresholds: Пороги сегментов (см. segmentation); None — сохранённая колонка segment
+
+    Returns:
+        DataFrame: segment, rfm_segment, count, total_ltv, avg_rfm_score
+    """
+    ensure_rfm_scores()
+
+    segment = segment_case_sql(thresholds) if thresholds else "c.segment"
+    segment_order = segment_order_sql("segment", thresholds) if thresholds else "segment"
+
+    query = f"""
+        SELECT
+            {segment} as segment,
+            r.rfm_segment,
+            COUNT(*) as count,
+            SUM(c.ltv) as total_ltv,
+            AVG(r.rfm_score) as avg_rfm_score
+        FROM company_rfm r
+        JOIN bitrix_companies c ON c.bitrix_id = r.company_id
+        GROUP BY 1, 2
+        ORDER BY {segment_order}, avg_rfm_score DESC
+    """
+
+    with read_connection() as conn:
+        return pd.read_sql_query(text(query), conn)
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = refresh_rfm_scores(force="--force" in sys.argv)
+    if result["refreshed"]:
+        print(f"✅ RFM-баллы пересчитаны: {result['companies']} компаний ({result['scored_at']})")
+    else:
+        print(f"ℹ️ Данные не менялись с {result['scored_at']}: {result['companies']} компаний")
@@ -0,0 +1,176 @@
+"""
+Служебные таблицы и индексы аналитики
+
+Таблица `analytics_state` хранит водяные отметки инкрементальных задач
+(ключ → значение). Индексы создаются идемпотентно: база наполняется
+внешним импортом, поэтому дашборд досоздаёт нужные ему индексы сам.
+"""
+from sqlalchemy import text
+
+from .writer import get_write_queue, read_connection, writer_busy
+
+# Счётчик изменений исходных таблиц на месте (приём событий Bitrix):
+# задачи, которые замечают только новые id, учитывают его в отпечатке
+SOURCE_VERSION_KEY = "bitrix_source_version"
+
+# Индексы ensure_deal_indexes и ensure_company_indexes
+ANALYTICS_INDEXES = frozenset({
+    "idx_bitrix_deals_company_close",
+    "idx_bitrix_deals_close",
+    "idx_bitrix_deals_close_day",
+    "idx_bitrix_deals_stage_close",
+    "idx_bitrix_companies_ltv",
+})
+
+_indexes_ready = False
+
+
+def ensure_state_table(conn) -> None:
+    """Создаёт таблицу состояния инкрементальных задач, если её нет."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS analytics_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """))
+
+
+def tables_exist(conn, *names: str) -> bool:
+    """Есть ли в базе все перечисленные таблицы (проверка без DDL, для чтения)."""
+    keys = {f"name_{i}": name for i, name in enumerate(names)}
+    found = conn.execute(
+        text(f"""
+            SELECT COUNT(*) FROM sqlite_master
+            WHERE type = 'table' AND name IN ({', '.join(':' + key for key in keys)})
+        """),
+        keys
+    ).scalar()
+    return found == len(set(names))
+
+
+def get_state(conn, key: str, default: str = None) -> str:
+    """
+    Читает значение из analytics_state.
+
+    Args:
+        conn: Соединение SQLAlchemy
+        key: Ключ
+        default: Значение по умолчанию
+
+    Returns:
+        Сохранённое значение или default
+    """
+    row = conn.execute(
+        text("SELECT value FROM analytics_state WHERE key = :key"),
+        {"key": key}
+    ).fetchone()
+    return row[0] if row else default
+
+
+def set_state(conn, key: str, value) -> None:
+    """Сохраняет значение в analytics_state."""
+    conn.execute(
+        text("INSERT OR REPLACE INTO analytics_state (key, value) VALUES (:key, :value)"),
+        {"key": key, "value": str(value)}
+    )
+
+
+def delete_state(conn, key: str) -> None:
+    """Удаляет значение из analytics_state."""
+    conn.execute(text("DELETE FROM analytics_state WHERE key = :key"), {"key": key})
+
+
+def get_source_version(conn) -> int:
+    """Текущее значение счётчика изменений исходных таблиц."""
+    return int(get_state(conn, SOURCE_VERSION_KEY, 0))
+
+
+def bump_source_version(conn) -> int:
+    """
+    Увеличивает счётчик изменений исходных таблиц.
+
+    Args:
+        conn: Соединение в транзакции записи
+
+    Returns:
+        Новое значение счётчика
+    """
+    ensure_state_table(conn)
+    version = get_source_version(conn) + 1
+    set_state(conn, SOURCE_VERSION_KEY, version)
+    return version
+
+
+def company_dimensions_fingerprint(conn) -> str:
+    """Отпечаток измерений компаний: меняется при смене сегмента или типа съёмки."""
+    row = conn.execute(text("""
+        SELECT
+            COUNT(*),
+            MAX(id),
+            TOTAL(id * COALESCE(shooting_type_id, 0)),
+            TOTAL(id * unicode(COALESCE(segment, '')))
+        FROM bitrix_companies
+    """)).fetchone()
+    return ":".join(str(value) for value in row)
+
+
+def ensure_deal_indexes(conn) -> None:
+    """Создаёт индексы bitrix_deals, используемые аналитикой."""
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bitrix_deals_company_close
+        ON bitrix_deals (company_id, close_date)
+    """))
+    # Покрывающий индекс для трендов за период: диапазон по close_date
+    # читается без обращения к таблице
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bitrix_deals_close
+        ON bitrix_deals (close_date, company_id, opportunity)
+    """))
+    # Индекс по дню закрытия для дневных и недельных рядов: close_date
+    # может содержать время, а группировка по date(close_date) идёт
+    # по этому индексу без сортировки
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bitrix_deals_close_day
+        ON bitrix_deals (date(close_date), company_id, opportunity)
+    """))
+    # Воронка и выручка только по выигранным стадиям: стадия, затем
+    # диапазон close_date, суммы читаются из индекса
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bitrix_deals_stage_close
+        ON bitrix_deals (stage, close_date, company_id, opportunity)
+    """))
+
+
+def ensure_company_indexes(conn) -> None:
+    """Создаёт индексы bitrix_companies, используемые аналитикой."""
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bitrix_companies_ltv
+        ON bitrix_companies (ltv)
+    """))
+
+
+def ensure_analytics_indexes() -> None:
+    """
+    Один раз за процесс досоздаёт все индексы, нужные аналитике.
+
+    Наличие индексов проверяется чтением. Недостающие создаются, только
+    если база не занята другой записью: индексы лишь ускоряют запросы,
+    и страница не ждёт писателя ради них — попытка повторится при
+    следующем вызове.
+    """
+    global _indexes_ready
+    if _indexes_ready:
+        return
+
+    with read_connection() as conn:
+        existing = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    if not ANALYTICS_INDEXES <= existing:
+        if writer_busy():
+            return
+
+        def write(conn):
+            ensure_deal_indexes(conn)
+            ensure_company_indexes(conn)
+
+        get_write_queue().run(write)
+    _indexes_ready = True
@@ -0,0 +1,195 @@
+"""
+Конфигурация сегментации A/B/C/U
+
+Пороги сегментов задаются здесь, а не зашиты в колонку `segment`:
+загрузчики вычисляют сегмент параметризованным CASE по индексированной
+колонке ltv, поэтому альтернативные пороги можно исследовать без
+перезаписи таблицы.
+
+Источники порогов (по приоритету):
+1. Пороги, выбранные в текущей сессии дашборда (страница "Сегменты")
+2. Переменная окружения LTV_SEGMENT_THRESHOLDS, например "100000,20000,10000"
+3. DEFAULT_SEGMENT_THRESHOLDS
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+# (сегмент, минимальный LTV) по убыванию порога; ниже последнего — FALLBACK_SEGMENT
+DEFAULT_SEGMENT_THRESHOLDS: Tuple[Tuple[str, float], ...] = (
+    ("A", 100000.0),
+    ("B", 20000.0),
+    ("C", 10000.0),
+)
+FALLBACK_SEGMENT = "U"
+
+SEGMENT_COLORS: Dict[str, str] = {
+    "A": "#FF6B6B",  # Красный
+    "B": "#4ECDC4",  # Бирюзовый
+    "C": "#FFE66D",  # Жёлтый
+    "U": "#95E1D3",  # Светло-зелёный
+}
+
+SEGMENT_NAMES: Dict[str, str] = {
+    "A": "Премиум",
+    "B": "Активные",
+    "C": "Средние",
+    "U": "Новички",
+}
+
+SEGMENT_EMOJI: Dict[str, str] = {
+    "A": "🔴",
+    "B": "🔵",
+    "C": "🟡",
+    "U": "🟢",
+}
+
+# Доля от порога, в пределах которой клиент считается «на грани перехода»
+TRANSITION_WINDOW = 0.1
+
+SESSION_KEY = "segment_thresholds"
+ENV_VAR = "LTV_SEGMENT_THRESHOLDS"
+
+
+def make_thresholds(values: List[float]) -> Tuple[Tuple[str, float], ...]:
+    """
+    Собирает и проверяет набор порогов для сегментов A, B, C.
+
+    Args:
+        values: Минимальный LTV для каждого сегмента по убыванию
+
+    Returns:
+        Кортеж (сегмент, порог), пригодный как ключ кэша
+    """
+    values = [float(v) for v in values]
+    labels = [label for label, _ in DEFAULT_SEGMENT_THRESHOLDS]
+
+    if len(values) != len(labels):
+        raise ValueError(f"Нужно {len(labels)} порога: {', '.join(labels)}")
+    if any(v <= 0 for v in values):
+        raise ValueError("Пороги должны быть положительными")
+    if any(a <= b for a, b in zip(values, values[1:])):
+        raise ValueError("Пороги должны строго убывать: A > B > C")
+
+    return tuple(zip(labels, values))
+
+
+def _configured_thresholds() -> Tuple[Tuple[str, float], ...]:
+    raw = os.environ.get(ENV_VAR)
+    if raw:
+        return make_thresholds(raw.split(","))
+    return DEFAULT_SEGMENT_THRESHOLDS
+
+
+def get_segment_thresholds() -> Tuple[Tuple[str, float], ...]:
+    """
+    Возвращает действующие пороги сегментов.
+
+    Returns:
+        Кортеж (сегмент, минимальный LTV) по убыванию порога
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        import streamlit as st
+        if SESSION_KEY in st.session_state:
+            return st.session_state[SESSION_KEY]
+    return _configured_thresholds()
+
+
+def set_segment_thresholds(thresholds: Optional[Tuple[Tuple[str, float], ...]]) -> None:
+    """Сохраняет пороги в сессии дашборда (None — вернуть настройки по умолчанию)."""
+    import streamlit as st
+
+    if thresholds is None:
+        st.session_state.pop(SESSION_KEY, None)
+    else:
+        st.session_state[SESSION_KEY] = thresholds
+
+
+def segment_labels(thresholds=DEFAULT_SEGMENT_THRESHOLDS) -> List[str]:
+    """Сегменты по убыванию LTV, включая FALLBACK_SEGMENT."""
+    return [label for label, _ in thresholds] + [FALLBACK_SEGMENT]
+
+
+def assign_segment(ltv: float, thresholds=DEFAULT_SEGMENT_THRESHOLDS) -> str:
+    """Определяет сегмент по значению LTV."""
+    for label, minimum in thresholds:
+        if ltv >= minimum:
+            return label
+    return FALLBACK_SEGMENT
+
+
+def segment_bounds(segment: str, thresholds=DEFAULT_SEGMENT_THRESHOLDS) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Диапазон LTV сегмента [нижняя граница, верхняя граница).
+
+    Returns:
+        (min_ltv или None, max_ltv или None)
+    """
+    upper = None
+    for label, minimum in thresholds:
+        if label == segment:
+            return minimum, upper
+        upper = minimum
+    if segment == FALLBACK_SEGMENT:
+        return None, upper
+    raise ValueError(f"Неизвестный сегмент: {segment}")
+
+
+def segment_case_sql(thresholds=DEFAULT_SEGMENT_THRESHOLDS, column: str = "ltv") -> str:
+    """SQL-выражение CASE, вычисляющее сегмент по колонке LTV."""
+    branches = " ".join(f"WHEN {column} >= {minimum!r} THEN '{label}'" for label, minimum in thresholds)
+    return f"CASE {branches} ELSE '{FALLBACK_SEGMENT}' END"
+
+
+def segment_range_sql(segment: str, thresholds=DEFAULT_SEGMENT_THRESHOLDS, column: str = "ltv") -> str:
+    """Условие принадлежности сегменту в виде диапазона по LTV (использует индекс)."""
+    lower, upper = segment_bounds(segment, thresholds)
+    conditions = []
+    if lower is not None:
+        conditions.append(f"{column} >= {lower!r}")
+    if upper is not None:
+        conditions.append(f"{column} < {upper!r}")
+    return " AND ".join(conditions) or "1 = 1"
+
+
+def segment_order_sql(column: str = "segment", thresholds=DEFAULT_SEGMENT_THRESHOLDS) -> str:
+    """SQL-выражение для сортировки сегментов от старшего к младшему."""
+    branches = " ".join(
+        f"WHEN '{label}' THEN {i}" for i, label in enumerate(segment_labels(thresholds), start=1)
+    )
+    return f"CASE {column} {branches} END"
+
+
+def describe_segments(thresholds=DEFAULT_SEGMENT_THRESHOLDS) -> List[Tuple[str, str]]:
+    """
+    Текстовое описание критериев сегментов.
+
+    Returns:
+        Список (сегмент, условие), например ('B', '20,000 ₽ ≤ LTV < 100,000 ₽')
+    """
+    result = []
+    for label in segment_labels(thresholds):
+        lower, upper = segment_bounds(label, thresholds)
+        if upper is None:
+            condition = f"LTV ≥ {lower:,.0f} ₽"
+        elif lower is None:
+            condition = f"LTV < {upper:,.0f} ₽"
+        else:
+            condition = f"{lower:,.0f} ₽ ≤ LTV < {upper:,.0f} ₽"
+        result.append((label, condition))
+    return result
+
+
+def transition_windows(thresholds=DEFAULT_SEGMENT_THRESHOLDS, window: float = TRANSITION_WINDOW) -> List[Tuple[str, str, float, float]]:
+    """
+    Окна «на грани перехода» под каждым порогом.
+
+    Returns:
+        Список (из сегмента, в сегмент, min_ltv, max_ltv) от старших к младшим
+    """
+    labels = segment_labels(thresholds)
+    result = []
+    for i, (label, minimum) in enumerate(thresholds):
+        result.append((labels[i + 1], label, minimum * (1 - window), minimum))
+    return result
@@ -0,0 +1,208 @@
+"""
+Учёт памяти сессий и бюджет на сессию
+
+Каждая сессия Streamlit держит свои объекты между перезапусками:
+session_state и то, что страница сохраняет для следующего перезапуска
+(отформатированная таблица, файл выгрузки). При росте числа
+пользователей память процесса растёт пропорционально, поэтому:
+
+- объекты, которые страница хранит между перезапусками, кладутся в
+  SessionMemory (session_memory()) с ключом выборки — при перезапуске с
+  той же выборкой они берутся готовыми;
+- у каждой сессии бюджет LTV_SESSION_MEMORY_MB (по умолчанию 64 МБ):
+  при превышении вытесняются самые большие объекты сессии;
+- результаты загрузчиков (versioned_cache) общие для всех сессий и в
+  бюджет сессии не входят — они учитываются один раз как общий кэш;
+- страницы не копируют общие таблицы (.copy()), а берут поверхностную
+  копию (.copy(deep=False)): с Copy-on-Write данные общие, пока
+  страница не изменит колонку, и изменение не затрагивает кэш
+  (в pandas 2 Copy-on-Write включает app.py при запуске).
+
+memory_totals() — суммы по всем живым сессиям процесса и общему кэшу.
+"""
+import io
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from .cache import cached_values
+
+SESSION_MEMORY_BUDGET_BYTES = int(float(os.environ.get("LTV_SESSION_MEMORY_MB", 64)) * 1024 * 1024)
+SESSION_KEY = "session_memory"
+
+# Живые сессии процесса: запись исчезает вместе с session_state сессии
+_sessions: "weakref.WeakSet[SessionMemory]" = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+def object_bytes(obj: Any) -> int:
+    """
+    Размер объекта в памяти с содержимым (строки таблиц, буферы, элементы).
+
+    Args:
+        obj: DataFrame, Series, массив, байты, BytesIO, коллекция или объект
+            с атрибутом memory_bytes (снимок клиентов)
+
+    Returns:
+        Размер в байтах
+    """
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, memoryview):
+        return obj.nbytes
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    if isinstance(getattr(obj, "memory_bytes", None), int):
+        return obj.memory_bytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(object_bytes(k) + object_bytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(object_bytes(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+class SessionMemory:
+    """
+    Объекты одной сессии, которые переживают перезапуски, с бюджетом памяти.
+
+    Объект хранится под именем вместе с ключом выборки: get() с другим
+    ключом считает объект устаревшим. Объекты общего кэша загрузчиков
+    хранятся ссылкой и в бюджет не входят.
+    """
+
+    def __init__(self, budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        # имя -> (ключ, объект, собственный размер)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.state_bytes = 0
+        self.evictions = 0
+
+    def get(self, name: str, key: Hashable = None) -> Optional[Any]:
+        """Объект под именем, если он сохранён с тем же ключом (иначе None)."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != key:
+                return None
+            self._entries.move_to_end(name)
+            return entry[1]
+
+    def put(self, name: str, obj: Any, key: Hashable = None) -> Any:
+        """
+        Сохраняет объект и укладывает сессию в бюджет.
+
+        Вытесняются самые большие из остальных объектов сессии; объект
+        больше всего бюджета не сохраняется.
+
+        Returns:
+            Тот же объект
+        """
+        size = 0 if _is_shared(obj) else object_bytes(obj)
+        with self._lock:
+            self._entries.pop(name, None)
+            if size > self.budget_bytes:
+                self.evictions += 1
+                return obj
+            self._entries[name] = (key, obj, size)
+            while self.owned_bytes > self.budget_bytes:
+                largest = max(
+                    (other for other in self._entries if other != name),
+                    key=lambda other: self._entries[other][2]
+                )
+                del self._entries[largest]
+                self.evictions += 1
+        return obj
+
+    def cached(self, name: str, key: Hashable, build: Callable[[], Any]) -> Any:
+        """get(), а если объекта нет — build() и put()."""
+        obj = self.get(name, key)
+        if obj is None:
+            obj = self.put(name, build(), key)
+        return obj
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def owned_bytes(self) -> int:
+        """Собственные объекты сессии (без общего кэша)."""
+        return sum(size for _, _, size in self._entries.values())
+
+    @property
+    def total_bytes(self) -> int:
+        """Собственные объекты и остальное содержимое session_state."""
+        return self.owned_bytes + self.state_bytes
+
+    def report(self) -> pd.DataFrame:
+        """
+        Объекты сессии.
+
+        Returns:
+            DataFrame: name, type, bytes, shared (объект общего кэша)
+        """
+        with self._lock:
+            rows = [
+                (name, type(obj).__name__, size if size else object_bytes(obj), not size and _is_shared(obj))
+                for name, (_, obj, size) in self._entries.items()
+            ]
+        return pd.DataFrame(rows, columns=["name", "type", "bytes", "shared"])
+
+
+def _is_shared(obj: Any) -> bool:
+    """Объект лежит в общем кэше загрузчиков (или это общий снимок)."""
+    return any(value is obj for value in cached_values())
+
+
+def session_memory() -> SessionMemory:
+    """
+    SessionMemory текущей сессии (создаётся при первом вызове).
+
+    Заодно пересчитывает размер остального session_state сессии.
+    """
+    memory = st.session_state.get(SESSION_KEY)
+    if memory is None:
+        memory = st.session_state[SESSION_KEY] = SessionMemory()
+        with _sessions_lock:
+            _sessions.add(memory)
+    memory.state_bytes = sum(
+        object_bytes(value) for key, value in st.session_state.items() if key != SESSION_KEY
+    )
+    return memory
+
+
+def memory_totals() -> Dict[str, float]:
+    """
+    Память сессий процесса и общего кэша.
+
+    Returns:
+        Dict: sessions, session_bytes (сумма по сессиям), largest_session_bytes,
+        shared_bytes (общий кэш загрузчиков), budget_bytes, evictions
+    """
+    with _sessions_lock:
+        sessions: List[SessionMemory] = list(_sessions)
+    totals = [memory.total_bytes for memory in sessions]
+
+    # Один объект может лежать в нескольких кэшах — считаем его один раз
+    shared = {id(value): value for value in cached_values()}
+    return {
+        "sessions": len(sessions),
+        "session_bytes": sum(totals),
+        "largest_session_bytes": max(totals, default=0),
+        "shared_bytes": sum(object_bytes(value) for value in shared.values()),
+        "budget_bytes": SESSION_MEMORY_BUDGET_BYTES,
+        "evictions": sum(memory.evictions for memory in sessions),
+    }
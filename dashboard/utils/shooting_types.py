@@ -0,0 +1,274 @@
+"""
+Справочник типов съёмок
+
+`bitrix_companies.primary_shooting_type` — свободный текст, и одни и те
+же типы встречаются в разных написаниях. Здесь он кодируется словарём:
+
+- `shooting_types` (id, name, name_key) — один тип съёмки, name — отображаемое
+  название, name_key — нормализованное написание;
+- `shooting_type_aliases` (alias → shooting_type_id) — все встреченные
+  исходные написания;
+- `bitrix_companies.shooting_type_id` — целочисленная ссылка с индексом
+  (shooting_type_id, ltv).
+
+Написания с одинаковым ключом (регистр, ё/е, дефисы, пробелы) и явные
+синонимы из SHOOTING_TYPE_ALIASES сливаются в один тип. Загрузчики
+группируют и фильтруют по shooting_type_id, а справочник присоединяют
+только ради названия.
+
+Колонку заполняет sync_shooting_types(); ensure_shooting_types() вызывает
+её не чаще одного раза на версию данных и только если справочник
+отстал (проверка чтением). Запуск вручную:
+    python -m dashboard.utils.shooting_types [--merge ИСТОЧНИК ЦЕЛЬ]
+"""
+import re
+from sqlalchemy import text
+from typing import Dict, Tuple
+
+from .cache import versioned_cache
+from .schema import tables_exist
+from .writer import get_write_queue, read_connection, writer_busy
+
+# Синонимы: написание -> каноническое название (сравнение по normalize_shooting_type)
+SHOOTING_TYPE_ALIASES: Dict[str, str] = {
+    "Предметка": "Предметная",
+    "Каталог": "Каталожная",
+    "Каталожка": "Каталожная",
+    "Интерьер": "Интерьерная",
+    "Портрет": "Портретная",
+    "Реклама": "Рекламная",
+    "Фэшн": "Fashion",
+    "Фешн": "Fashion",
+    "Food": "Food-съёмка",
+    "Фуд": "Food-съёмка",
+    "Фуд-съёмка": "Food-съёмка",
+    "Ювелирка": "Ювелирная",
+}
+
+
+def normalize_shooting_type(name: str) -> str:
+    """
+    Ключ написания типа съёмки: нижний регистр, ё → е, дефисы и
+    подчёркивания как пробелы, без лишних пробелов.
+
+    Args:
+        name: Исходное написание
+
+    Returns:
+        Нормализованный ключ
+    """
+    key = name.strip().lower().replace("ё", "е")
+    key = re.sub(r"[-_–—/]+", " ", key)
+    return re.sub(r"\s+", " ", key).strip()
+
+
+_ALIAS_KEYS = {normalize_shooting_type(alias): canonical for alias, canonical in SHOOTING_TYPE_ALIASES.items()}
+
+
+def _canonical(name: str) -> str:
+    """Каноническое название для написания (с учётом синонимов)."""
+    return _ALIAS_KEYS.get(normalize_shooting_type(name), name.strip())
+
+
+def ensure_shooting_type_tables(conn) -> None:
+    """Создаёт справочник, таблицу написаний и колонку shooting_type_id, если их нет."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS shooting_types (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            name_key TEXT UNIQUE NOT NULL
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS shooting_type_aliases (
+            alias TEXT PRIMARY KEY,
+            shooting_type_id INTEGER NOT NULL REFERENCES shooting_types (id)
+        )
+    """))
+
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(bitrix_companies)"))}
+    if "shooting_type_id" not in columns:
+        conn.execute(text("ALTER TABLE bitrix_companies ADD COLUMN shooting_type_id INTEGER"))
+
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bitrix_companies_shooting_type
+        ON bitrix_companies (shooting_type_id, ltv)
+    """))
+
+
+def sync_shooting_types() -> Dict[str, int]:
+    """
+    Дополняет справочник новыми написаниями и проставляет shooting_type_id.
+
+    Новые написания сопоставляются по нормализованному ключу; если ключ
+    не встречался, создаётся тип с каноническим названием. Затем одним
+    UPDATE переписываются только компании с устаревшим id, поэтому
+    повторный запуск без изменений в данных ничего не пишет.
+
+    Returns:
+        Dict: new_types, new_aliases, companies_updated
+    """
+    def write(conn):
+        ensure_shooting_type_tables(conn)
+
+        new_spellings = conn.execute(text("""
+            SELECT primary_shooting_type
+            FROM bitrix_companies
+            WHERE primary_shooting_type IS NOT NULL
+              AND primary_shooting_type != ''
+              AND primary_shooting_type NOT IN (SELECT alias FROM shooting_type_aliases)
+            GROUP BY primary_shooting_type
+            ORDER BY COUNT(*) DESC
+        """)).scalars().all()
+
+        # Ключи известных написаний учитываются тоже: после merge_shooting_types
+        # они указывают на поглотивший тип
+        type_ids = {
+            normalize_shooting_type(_canonical(alias)): type_id
+            for alias, type_id in conn.execute(text("SELECT alias, shooting_type_id FROM shooting_type_aliases"))
+        }
+        type_ids.update(conn.execute(text("SELECT name_key, id FROM shooting_types")).fetchall())
+        new_types = 0
+
+        for spelling in new_spellings:
+            name = _canonical(spelling)
+            key = normalize_shooting_type(name)
+            if not key:
+                continue
+
+            if key not in type_ids:
+                type_ids[key] = conn.execute(
+                    text("INSERT INTO shooting_types (name, name_key) VALUES (:name, :key)"),
+                    {"name": name, "key": key}
+                ).lastrowid
+                new_types += 1
+
+            conn.execute(
+                text("INSERT INTO shooting_type_aliases (alias, shooting_type_id) VALUES (:alias, :id)"),
+                {"alias": spelling, "id": type_ids[key]}
+            )
+
+        updated = conn.execute(text("""
+            UPDATE bitrix_companies
+            SET shooting_type_id = (
+                SELECT a.shooting_type_id
+                FROM shooting_type_aliases a
+                WHERE a.alias = bitrix_companies.primary_shooting_type
+            )
+            WHERE shooting_type_id IS NOT (
+                SELECT a.shooting_type_id
+                FROM shooting_type_aliases a
+                WHERE a.alias = bitrix_companies.primary_shooting_type
+            )
+        """)).rowcount
+
+        return {
+            "new_types": new_types,
+            "new_aliases": len(new_spellings),
+            "companies_updated": updated,
+        }
+
+    return get_write_queue().run(write)
+
+
+def _shooting_types_state() -> Tuple[bool, bool]:
+    """
+    Состояние справочника (чтение без блокировки записи).
+
+    Returns:
+        (построен, актуален): актуален — нет новых написаний и компаний
+        с устаревшим shooting_type_id
+    """
+    with read_connection() as conn:
+        if not tables_exist(conn, "shooting_types", "shooting_type_aliases"):
+            return False, False
+        stale = conn.execute(text("""
+            SELECT EXISTS (
+                SELECT 1 FROM bitrix_companies
+                WHERE primary_shooting_type IS NOT NULL
+                  AND primary_shooting_type != ''
+                  AND primary_shooting_type NOT IN (SELECT alias FROM shooting_type_aliases)
+            ) OR EXISTS (
+                SELECT 1 FROM bitrix_companies c
+                WHERE c.shooting_type_id IS NOT (
+                    SELECT a.shooting_type_id
+                    FROM shooting_type_aliases a
+                    WHERE a.alias = c.primary_shooting_type
+                )
+            )
+        """)).scalar()
+    return True, not stale
+
+
+@versioned_cache(maxsize=1)
+def ensure_shooting_types() -> None:
+    """
+    Синхронизирует справочник не чаще одного раза на версию данных.
+
+    Актуальность проверяется чтением. Отставший, но уже построенный
+    справочник при занятой другой записью базе остаётся как есть:
+    страница не ждёт писателя, а новые написания попадут в справочник
+    со следующей версией данных.
+    """
+    built, current = _shooting_types_state()
+    if current or (built and writer_busy()):
+        return
+    sync_shooting_types()
+
+
+def merge_shooting_types(source: str, target: str) -> int:
+    """
+    Сливает тип съёмки source в target (оба — названия из справочника).
+
+    Написания и компании source переходят к target, сам source удаляется;
+    новые написания с ключом source тоже будут отнесены к target.
+
+    Args:
+        source: Название поглощаемого типа
+        target: Название остающегося типа
+
+    Returns:
+        Количество перенесённых компаний
+    """
+    def write(conn):
+        ensure_shooting_type_tables(conn)
+
+        ids = dict(conn.execute(
+            text("SELECT name, id FROM shooting_types WHERE name IN (:source, :target)"),
+            {"source": source, "target": target}
+        ).fetchall())
+        for name in (source, target):
+            if name not in ids:
+                raise ValueError(f"Тип съёмки не найден: {name}")
+        if ids[source] == ids[target]:
+            return 0
+
+        params = {"source_id": ids[source], "target_id": ids[target]}
+        conn.execute(
+            text("UPDATE shooting_type_aliases SET shooting_type_id = :target_id WHERE shooting_type_id = :source_id"),
+            params
+        )
+        moved = conn.execute(
+            text("UPDATE bitrix_companies SET shooting_type_id = :target_id WHERE shooting_type_id = :source_id"),
+            params
+        ).rowcount
+        conn.execute(text("DELETE FROM shooting_types WHERE id = :source_id"), params)
+        return moved
+
+    return get_write_queue().run(write)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--merge" in sys.argv:
+        i = sys.argv.index("--merge")
+        source, target = sys.argv[i + 1], sys.argv[i + 2]
+        moved = merge_shooting_types(source, target)
+        print(f"✅ «{source}» → «{target}»: перенесено {moved} компаний")
+    else:
+        result = sync_shooting_types()
+        print(
+            f"✅ Справочник типов съёмок: новых типов {result['new_types']}, "
+            f"написаний {result['new_aliases']}, обновлено компаний {result['companies_updated']}"
+        )
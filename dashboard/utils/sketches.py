@@ -0,0 +1,510 @@
+"""
+Приближённая аналитика по сделкам
+
+HyperLogLog-скетчи уникальных клиентов по годам и месяцам вместо
+COUNT(DISTINCT company_id). Скетчи хранятся в таблице `deal_sketches`
+вместе с точными суммами выручки и количеством сделок и дополняются
+инкрементально: обрабатываются только сделки с id больше сохранённой
+отметки, новые регистры объединяются со старыми поэлементным максимумом.
+Учитываются только выигранные сделки (funnel.won_stage_sql); смена
+настройки выигранных стадий пересобирает скетчи.
+
+Также здесь выборочная оценка выручки с доверительным интервалом.
+
+Изменить или удалить уже учтённую сделку в скетче нельзя: в таком
+случае скетчи сбрасываются (invalidate_deal_sketches) и пересобираются
+при следующем обновлении.
+
+Скетчи хранятся по целым периодам. Если период анализа начинается или
+заканчивается посреди года (месяца), крайние неполные периоды считаются
+точным запросом по сделкам за нужные дни, а скетчи дают только целые
+периоды внутри — границы совпадают с точным режимом.
+
+Страницы не ждут писателя: загрузчики читают скетчи через
+read_connection(), а дополняют их не чаще раза на версию данных и только
+если база не занята другой записью (writer.writer_busy). Новые сделки
+из вебхуков Bitrix дополняют скетчи сразу при приёме (utils/ingest.py).
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from typing import Dict
+
+from .cache import versioned_cache
+from .date_range import date_range_sql
+from .funnel import won_stage_sql
+from .schema import ensure_state_table, get_state, set_state, delete_state, tables_exist
+from .writer import get_write_queue, read_connection, writer_busy
+
+# Точность HyperLogLog: 2^12 регистров, стандартная ошибка ~1.6%
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_RELATIVE_ERROR = 1.04 / np.sqrt(HLL_REGISTERS)
+
+# Гранулярность скетчей -> формат strftime для периода
+SKETCH_GRANULARITIES: Dict[str, str] = {
+    "year": "%Y",
+    "month": "%Y-%m",
+}
+# Гранулярность -> частота pandas.Period
+PERIOD_FREQUENCIES: Dict[str, str] = {
+    "year": "Y",
+    "month": "M",
+}
+
+WATERMARK_KEY = "deal_sketches_watermark"
+WON_STAGES_KEY = "deal_sketches_won_stages"
+CHUNK_SIZE = 200_000
+
+# z-квантиль для 95% доверительного интервала выборочной оценки
+CONFIDENCE_Z = 1.96
+
+
+def _hash_company_ids(company_ids: pd.Series) -> np.ndarray:
+    """64-битные детерминированные хеши company_id (векторно)."""
+    return pd.util.hash_pandas_object(company_ids.astype(str), index=False).to_numpy(np.uint64)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Точная длина в битах для массива uint64 (без округлений float)."""
+    values = values.copy()
+    length = np.zeros(values.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = values >= (np.uint64(1) << np.uint64(shift))
+        length[mask] += shift
+        values[mask] >>= np.uint64(shift)
+    length += (values > 0).astype(np.uint8)
+    return length
+
+
+def build_registers(bucket_codes: np.ndarray, hashes: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    Строит HLL-регистры для нескольких бакетов за один проход.
+
+    Args:
+        bucket_codes: Номер бакета (периода) для каждой сделки
+        hashes: 64-битные хеши company_id
+        n_buckets: Количество бакетов
+
+    Returns:
+        Матрица регистров (n_buckets, HLL_REGISTERS) типа uint8
+    """
+    rest_bits = 64 - HLL_PRECISION
+    index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << rest_bits) - 1)
+    rank = (rest_bits - _bit_length(rest).astype(np.int64) + 1).astype(np.uint8)
+
+    registers = np.zeros((n_buckets, HLL_REGISTERS), dtype=np.uint8)
+    np.maximum.at(registers, (bucket_codes, index), rank)
+    return registers
+
+
+def estimate_cardinality(registers: np.ndarray) -> np.ndarray:
+    """
+    Оценка количества уникальных значений по HLL-регистрам.
+
+    Args:
+        registers: Матрица регистров (n_buckets, HLL_REGISTERS)
+
+    Returns:
+        Массив оценок по каждому бакету
+    """
+    registers = np.atleast_2d(registers)
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=1)
+    zeros = np.count_nonzero(registers == 0, axis=1)
+
+    # Поправка для малых значений (linear counting)
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def ensure_sketch_tables(conn) -> None:
+    """Создаёт служебные таблицы скетчей, если их нет."""
+    ensure_state_table(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deal_sketches (
+            granularity TEXT NOT NULL,
+            period TEXT NOT NULL,
+            registers BLOB NOT NULL,
+            total_revenue REAL DEFAULT 0,
+            deals_count INTEGER DEFAULT 0,
+            PRIMARY KEY (granularity, period)
+        )
+    """))
+
+
+def _merge_chunk(conn, chunk: pd.DataFrame) -> None:
+    """Объединяет сделки из чанка с сохранёнными скетчами."""
+    hashes = _hash_company_ids(chunk["company_id"])
+
+    for granularity in SKETCH_GRANULARITIES:
+        codes, periods = pd.factorize(chunk[granularity])
+        registers = build_registers(codes, hashes, len(periods))
+        revenue = np.bincount(codes, weights=chunk["opportunity"].fillna(0).to_numpy(), minlength=len(periods))
+        deals = np.bincount(codes, minlength=len(periods))
+
+        for i, period in enumerate(periods):
+            stored = conn.execute(
+                text("""
+                    SELECT registers, total_revenue, deals_count
+                    FROM deal_sketches
+                    WHERE granularity = :granularity AND period = :period
+                """),
+                {"granularity": granularity, "period": period}
+            ).fetchone()
+
+            merged = registers[i]
+            total_revenue = float(revenue[i])
+            deals_count = int(deals[i])
+            if stored is not None:
+                merged = np.maximum(merged, np.frombuffer(stored[0], dtype=np.uint8))
+                total_revenue += stored[1] or 0
+                deals_count += stored[2] or 0
+
+            conn.execute(
+                text("""
+                    INSERT OR REPLACE INTO deal_sketches
+                    (granularity, period, registers, total_revenue, deals_count)
+                    VALUES (:granularity, :period, :registers, :total_revenue, :deals_count)
+                """),
+                {
+                    "granularity": granularity,
+                    "period": period,
+                    "registers": merged.tobytes(),
+                    "total_revenue": total_revenue,
+                    "deals_count": deals_count
+                }
+            )
+
+
+def invalidate_deal_sketches(conn) -> None:
+    """
+    Сбрасывает скетчи после изменения или удаления уже учтённых сделок.
+
+    Следующий refresh_deal_sketches() соберёт их заново.
+
+    Args:
+        conn: Соединение в транзакции записи
+    """
+    ensure_sketch_tables(conn)
+    conn.execute(text("DELETE FROM deal_sketches"))
+    delete_state(conn, WATERMARK_KEY)
+
+
+def refresh_deal_sketches(rebuild: bool = False) -> int:
+    """
+    Дополняет скетчи сделками, появившимися после прошлого обновления.
+
+    Скетчи только накапливают данные: изменение или удаление уже учтённых
+    сделок требует полной пересборки (rebuild=True).
+
+    Args:
+        rebuild: Пересобрать скетчи с нуля
+
+    Returns:
+        Количество обработанных сделок
+    """
+    won = won_stage_sql()
+
+    def prepare(conn):
+        ensure_sketch_tables(conn)
+        if rebuild or get_state(conn, WON_STAGES_KEY) != won:
+            conn.execute(text("DELETE FROM deal_sketches"))
+            delete_state(conn, WATERMARK_KEY)
+            set_state(conn, WON_STAGES_KEY, won)
+
+        watermark = int(get_state(conn, WATERMARK_KEY, 0))
+        max_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+        return watermark, max_id
+
+    watermark, max_id = get_write_queue().run(prepare)
+    processed = 0
+
+    while watermark < max_id:
+        def merge(conn, after=watermark):
+            chunk = pd.read_sql_query(
+                text(f"""
+                    SELECT
+                        id,
+                        company_id,
+                        opportunity,
+                        strftime('%Y', close_date) as year,
+                        strftime('%Y-%m', close_date) as month,
+                        {won} as won
+                    FROM bitrix_deals
+                    WHERE id > :after AND id <= :upto
+                    ORDER BY id
+                    LIMIT :limit
+                """),
+                conn,
+                params={"after": after, "upto": max_id, "limit": CHUNK_SIZE}
+            )
+            if chunk.empty:
+                return None
+
+            # Отметка сдвигается по всем сделкам, в скетчи идут только выигранные
+            dated = chunk[chunk["year"].notna() & (chunk["won"] == 1)]
+            if not dated.empty:
+                _merge_chunk(conn, dated)
+
+            last_id = int(chunk["id"].iloc[-1])
+            set_state(conn, WATERMARK_KEY, last_id)
+            return last_id, len(dated)
+
+        merged = get_write_queue().run(merge)
+        if merged is None:
+            break
+        watermark, count = merged
+        processed += count
+
+    return processed
+
+
+def _sketch_state() -> Dict[str, str]:
+    """Отметка и настройка стадий скетчей и последний id сделки (чтение без блокировки записи)."""
+    with read_connection() as conn:
+        max_id = conn.execute(text("SELECT MAX(id) FROM bitrix_deals")).scalar() or 0
+        if not tables_exist(conn, "deal_sketches", "analytics_state"):
+            return {"watermark": None, "won_stages": None, "max_id": max_id}
+        return {
+            "watermark": get_state(conn, WATERMARK_KEY),
+            "won_stages": get_state(conn, WON_STAGES_KEY),
+            "max_id": max_id,
+        }
+
+
+@versioned_cache(maxsize=1)
+def ensure_deal_sketches() -> None:
+    """
+    Дополняет скетчи перед чтением — не чаще раза на версию данных.
+
+    Актуальность проверяется чтением. Если скетчи отстали, но уже
+    построены, а база занята другой записью, страница показывает
+    построенное, не дожидаясь писателя; пустые (после сброса) или
+    построенные для другой настройки стадий скетчи собираются сразу.
+    """
+    state = _sketch_state()
+    current = state["won_stages"] == won_stage_sql() and state["watermark"] is not None
+    if current and int(state["watermark"]) >= state["max_id"]:
+        return
+    if current and writer_busy():
+        return
+    refresh_deal_sketches()
+
+
+def _split_range(granularity: str, date_from: str = None, date_to: str = None) -> tuple:
+    """
+    Делит период на целые периоды скетчей и неполные края.
+
+    Returns:
+        (первый целый период или None, последний целый период или None,
+         список неполных диапазонов дат (from, to) для точного подсчёта)
+    """
+    frequency = PERIOD_FREQUENCIES[granularity]
+    edges = []
+    since = until = None
+
+    if date_from is not None:
+        period = pd.Period(date_from, frequency)
+        if period.start_time.date().isoformat() != date_from:
+            edge_to = period.end_time.date().isoformat()
+            edges.append((date_from, min(edge_to, date_to) if date_to is not None else edge_to))
+            period += 1
+        since = str(period)
+
+    if date_to is not None:
+        period = pd.Period(date_to, frequency)
+        if period.end_time.date().isoformat() != date_to:
+            edge_from = period.start_time.date().isoformat()
+            # Начало и конец в одном периоде — он уже посчитан как начальный край
+            if date_from is None or date_from <= edge_from:
+                edges.append((edge_from, date_to))
+            period -= 1
+        until = str(period)
+
+    return since, until, edges
+
+
+def _load_exact_periods(granularity: str, date_from: str, date_to: str) -> pd.DataFrame:
+    """Точные выручка, сделки и клиенты по периодам за диапазон дат (для неполных краёв)."""
+    period_filter, params = date_range_sql(date_from, date_to)
+    query = f"""
+        SELECT
+            strftime('{SKETCH_GRANULARITIES[granularity]}', close_date) as period,
+            COUNT(DISTINCT company_id) as companies,
+            SUM(opportunity) as total_revenue,
+            COUNT(*) as deals_count
+        FROM bitrix_deals
+        WHERE close_date IS NOT NULL
+          AND {period_filter}
+          AND {won_stage_sql()}
+        GROUP BY period
+    """
+    with read_connection() as conn:
+        return pd.read_sql_query(text(query), conn, params=params)
+
+
+def _load_sketch_trend(granularity: str, date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Тренд за период [date_from, date_to]: целые периоды — по скетчам, неполные края — точно.
+
+    Returns:
+        DataFrame: period, companies (оценка HLL для целых периодов), total_revenue, deals_count
+    """
+    columns = ["period", "companies", "total_revenue", "deals_count"]
+    since, until, edges = _split_range(granularity, date_from, date_to)
+    parts = [_load_exact_periods(granularity, edge_from, edge_to) for edge_from, edge_to in edges]
+
+    if since is None or until is None or since <= until:
+        ensure_deal_sketches()
+
+        query = """
+            SELECT period, registers, total_revenue, deals_count
+            FROM deal_sketches
+            WHERE granularity = :granularity
+        """
+        params = {"granularity": granularity}
+
+        if since is not None:
+            query += " AND period >= :since"
+            params["since"] = since
+
+        if until is not None:
+            query += " AND period <= :until"
+            params["until"] = until
+
+        with read_connection() as conn:
+            rows = conn.execute(text(query), params).fetchall()
+
+        if rows:
+            registers = np.vstack([np.frombuffer(r[1], dtype=np.uint8) for r in rows])
+            parts.append(pd.DataFrame({
+                "period": [r[0] for r in rows],
+                "companies": np.rint(estimate_cardinality(registers)).astype(int),
+                "total_revenue": [r[2] for r in rows],
+                "deals_count": [r[3] for r in rows]
+            }))
+
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns].sort_values("period", ignore_index=True)
+
+
+@versioned_cache(maxsize=32)
+def load_ltv_trend_approx(date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Приближённый тренд по годам на основе скетчей.
+
+    Выручка и количество сделок точные, количество клиентов — оценка
+    HyperLogLog с относительной ошибкой ~HLL_RELATIVE_ERROR (в неполных
+    крайних годах периода — точное значение).
+
+    Args:
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+
+    Returns:
+        DataFrame с колонками как у load_ltv_trend
+    """
+    df = _load_sketch_trend("year", date_from, date_to)
+    df = df.rename(columns={"period": "year"})
+    return df[["year", "companies", "total_revenue", "deals_count"]]
+
+
+@versioned_cache(maxsize=32)
+def load_monthly_trend_approx(months: int = 24, date_from: str = None, date_to: str = None) -> pd.DataFrame:
+    """
+    Приближённая помесячная выручка за период.
+
+    Окно то же, что у точного load_monthly_trend: без начала периода —
+    ровно months месяцев назад от сегодняшнего дня.
+
+    Args:
+        months: Глубина истории в месяцах, если начало периода не задано
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+
+    Returns:
+        DataFrame с колонками как у load_monthly_trend
+    """
+    if date_from is None:
+        with read_connection() as conn:
+            date_from = conn.execute(
+                text("SELECT date('now', :offset)"),
+                {"offset": f"-{int(months)} months"}
+            ).scalar()
+
+    df = _load_sketch_trend("month", date_from, date_to)
+    df = df.rename(columns={"period": "month", "total_revenue": "revenue"})
+    return df[["month", "companies", "revenue", "deals_count"]]
+
+
+def load_ltv_trend_sampled(
+    sample_rate: float = 0.1,
+    granularity: str = "year",
+    date_from: str = None,
+    date_to: str = None
+) -> pd.DataFrame:
+    """
+    Выборочная оценка выручки с 95% доверительным интервалом.
+
+    Сделки отбираются детерминированно по хешу id (выборка Бернулли),
+    сумма масштабируется на 1/sample_rate. Дисперсия оценки:
+    (1 - q) / q² · Σ x² по сделкам выборки.
+
+    Args:
+        sample_rate: Доля сделок в выборке (0 < q ≤ 1)
+        granularity: 'year' или 'month'
+        date_from: Начало периода ('YYYY-MM-DD') или None
+        date_to: Конец периода включительно ('YYYY-MM-DD') или None
+
+    Returns:
+        DataFrame с оценкой выручки, границами интервала и размером выборки
+    """
+    if granularity not in SKETCH_GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+    if not 0 < sample_rate <= 1:
+        raise ValueError("sample_rate должен быть в диапазоне (0, 1]")
+
+    period_filter, params = date_range_sql(date_from, date_to)
+    params["threshold"] = int(sample_rate * 4294967296)
+
+    query = f"""
+        SELECT
+            strftime('{SKETCH_GRANULARITIES[granularity]}', close_date) as period,
+            SUM(opportunity) as sample_revenue,
+            SUM(opportunity * opportunity) as sample_revenue_sq,
+            COUNT(*) as sample_deals
+        FROM bitrix_deals
+        WHERE close_date IS NOT NULL
+          AND {period_filter}
+          AND {won_stage_sql()}
+          AND ((id * 2654435761) % 4294967296) < :threshold
+        GROUP BY period
+        ORDER BY period
+    """
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params)
+
+    q = sample_rate
+    df["total_revenue"] = df["sample_revenue"].fillna(0) / q
+    margin = CONFIDENCE_Z * np.sqrt((1 - q) / (q * q) * df["sample_revenue_sq"].fillna(0))
+    df["revenue_low"] = (df["total_revenue"] - margin).clip(lower=0)
+    df["revenue_high"] = df["total_revenue"] + margin
+    df["deals_count"] = np.rint(df["sample_deals"] / q).astype(int)
+
+    df = df.rename(columns={"period": granularity})
+    return df[[granularity, "total_revenue", "revenue_low", "revenue_high", "deals_count", "sample_deals"]]
+
+
+if __name__ == "__main__":
+    import sys
+
+    count = refresh_deal_sketches(rebuild="--rebuild" in sys.argv)
+    print(f"✅ Скетчи обновлены: обработано {count} сделок")
@@ -0,0 +1,198 @@
+"""
+Дневные и недельные ряды выручки
+
+Ряды строятся группировкой по дню (или началу недели) закрытия сделки
+по индексу bitrix_deals(date(close_date), ...): период читается
+диапазоном индекса, группировка идёт без сортировки. За всю историю это
+тысячи точек на ряд (и столько же на каждый сегмент), поэтому перед
+отправкой в браузер каждый ряд прореживается алгоритмом LTTB
+(Largest-Triangle-Three-Buckets) до ширины графика в точках: форма
+кривой, пики и провалы сохраняются, а объём данных не зависит от
+длины периода.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from .cache import versioned_cache
+from .funnel import won_stage_sql
+from .schema import ensure_analytics_indexes
+from .segmentation import segment_case_sql
+from .writer import read_connection
+
+# Гранулярность: ключ -> (подпись, SQL-выражение периода, частота pandas)
+GRANULARITIES: Dict[str, Tuple[str, str, str]] = {
+    "day": ("Дни", "date(d.close_date)", "D"),
+    "week": ("Недели", "date(d.close_date, '-6 days', 'weekday 1')", "W-MON"),
+}
+
+# Точек на ряд по умолчанию: примерно ширина графика в пикселях
+DEFAULT_MAX_POINTS = 1000
+
+
+def _period_start(day: pd.Timestamp, granularity: str) -> pd.Timestamp:
+    """Начало периода, в который попадает день (неделя начинается с понедельника)."""
+    if granularity == "week":
+        return day - pd.Timedelta(days=day.weekday())
+    return day
+
+
+@versioned_cache(maxsize=64)
+def load_revenue_timeseries(
+    granularity: str = "day",
+    date_from: str = None,
+    date_to: str = None,
+    by: str = None,
+    thresholds: tuple = None
+) -> pd.DataFrame:
+    """
+    Загружает выручку по дням или неделям.
+
+    Пропущенные периоды заполняются нулями, чтобы линия не соединяла
+    соседние продажи через пустые дни.
+
+    Args:
+        granularity: 'day' или 'week'
+        date_from: Начало видимого диапазона ('YYYY-MM-DD') или None
+        date_to: Конец видимого диапазона включительно ('YYYY-MM-DD') или None
+        by: None — общий ряд, 'segment' — ряд на каждый сегмент
+        thresholds: Пороги сегментов для by='segment'; None — сохранённая колонка segment
+
+    Returns:
+        DataFrame: period (datetime), [segment], revenue, deals_count
+    """
+    ensure_analytics_indexes()
+    period = GRANULARITIES[granularity][1]
+
+    # Условие по тому же выражению date(close_date), что и в индексе
+    conditions = ["d.close_date IS NOT NULL", won_stage_sql("d.stage")]
+    params = {}
+    if date_from is not None:
+        conditions.append("date(d.close_date) >= :date_from")
+        params["date_from"] = date_from
+    if date_to is not None:
+        conditions.append("date(d.close_date) <= :date_to")
+        params["date_to"] = date_to
+
+    if by == "segment":
+        segment = segment_case_sql(thresholds, column="c.ltv") if thresholds else "c.segment"
+        group_column = f"CASE WHEN c.bitrix_id IS NULL THEN '—' ELSE {segment} END as segment,"
+        join = "LEFT JOIN bitrix_companies c ON c.bitrix_id = d.company_id"
+        group_by = "period, segment"
+    else:
+        group_column = join = ""
+        group_by = "period"
+
+    query = f"""
+        SELECT
+            {period} as period,
+            {group_column}
+            SUM(d.opportunity) as revenue,
+            COUNT(*) as deals_count
+        FROM bitrix_deals d
+        {join}
+        WHERE {" AND ".join(conditions)}
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+    """
+
+    with read_connection() as conn:
+        df = pd.read_sql_query(text(query), conn, params=params, parse_dates=["period"])
+
+    if df.empty:
+        return df
+
+    # Непрерывная шкала периодов с нулями в пустых днях/неделях — по всему
+    # запрошенному диапазону, а не только между первой и последней продажей
+    start, end = df["period"].min(), df["period"].max()
+    if date_from is not None:
+        start = min(start, _period_start(pd.Timestamp(date_from), granularity))
+    if date_to is not None:
+        end = max(end, _period_start(pd.Timestamp(date_to), granularity))
+    periods = pd.date_range(start, end, freq=GRANULARITIES[granularity][2])
+    if by == "segment":
+        full = pd.MultiIndex.from_product([periods, df["segment"].unique()], names=["period", "segment"])
+        df = df.set_index(["period", "segment"]).reindex(full, fill_value=0).reset_index()
+        return df.sort_values(["segment", "period"], ignore_index=True)
+
+    return df.set_index("period").reindex(periods, fill_value=0).rename_axis("period").reset_index()
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Индексы точек, отобранных Largest-Triangle-Three-Buckets.
+
+    Первая и последняя точки сохраняются; остальные делятся на
+    threshold - 2 корзины, и из каждой берётся точка, образующая
+    наибольший треугольник с предыдущей выбранной точкой и средним
+    следующей корзины.
+
+    Args:
+        x: Координаты по оси X (возрастающие числа)
+        y: Значения
+        threshold: Сколько точек оставить
+
+    Returns:
+        Массив индексов выбранных точек по возрастанию
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    # Границы корзин: корзина i — точки [edges[i], edges[i + 1])
+    edges = (np.floor(np.arange(threshold - 1) * every) + 1).astype(np.int64)
+    edges[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample_timeseries(
+    df: pd.DataFrame,
+    max_points: int = DEFAULT_MAX_POINTS,
+    value: str = "revenue",
+    by: str = None
+) -> pd.DataFrame:
+    """
+    Прореживает каждый ряд до max_points точек (LTTB по колонке value).
+
+    Args:
+        df: Результат load_revenue_timeseries
+        max_points: Точек на ряд
+        value: Колонка, форму которой нужно сохранить
+        by: Колонка ряда ('segment') или None
+
+    Returns:
+        Строки df, выбранные для графика
+    """
+    if df.empty:
+        return df
+
+    groups = [group for _, group in df.groupby(by, sort=False)] if by else [df]
+    parts = []
+    for group in groups:
+        x = group["period"].to_numpy(dtype="datetime64[s]").astype(np.float64)
+        y = group[value].to_numpy(dtype=np.float64)
+        parts.append(group.iloc[lttb_indices(x, y, max_points)])
+
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,376 @@
+"""
+Единственный писатель и снимки чтения SQLite
+
+База работает в режиме WAL: читатели не блокируют писателя и друг
+друга. Чтобы записи из разных потоков и процессов (пересчёт
+материализованных таблиц, приём изменений из Bitrix, создание
+демо-базы) не натыкались на «database is locked»:
+
+- любая запись — приём событий, пересчёт материализованных таблиц —
+  оформляется заданием job(conn) и идёт через общую очередь процесса
+  (get_write_queue().run / submit): один поток забирает все накопившиеся
+  задания и фиксирует их одной транзакцией, каждое — в своей точке
+  сохранения (ошибка одного задания не откатывает остальные);
+- транзакция очереди — write_transaction(): транзакции выполняются
+  строго по одной — блокировкой потоков внутри процесса и файловой
+  блокировкой platrum.db.lock между процессами — и начинаются с
+  BEGIN IMMEDIATE, поэтому не обрываются посередине из-за чужой записи.
+  Мимо очереди, под теми же блокировками, пишут только чекпоинт и
+  создание демо-базы при первом запуске (data_loader): база создаётся
+  при импорте, до движка, и потоку очереди её ещё не открыть;
+- автоматические контрольные точки отключены. После записи журнал
+  переносится в базу PASSIVE-чекпоинтом, если WAL вырос больше
+  CHECKPOINT_WAL_BYTES (читатели при этом не ждут); усечение журнала —
+  вручную или по расписанию:
+      python -m dashboard.utils.writer --checkpoint
+- каждое соединение читает внутри транзакции (BEGIN), то есть из одного
+  снимка базы. read_snapshot() закрепляет снимок за потоком на весь
+  перезапуск страницы: все загрузчики (через read_connection) видят одну
+  версию данных, а кэши ключуются версией на момент открытия снимка.
+  Собственные записи потока (ensure_* внутри загрузчиков) сдвигают
+  снимок на новую версию.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict
+
+from sqlalchemy import event
+
+from .cache import pin_data_version, refresh_pinned_data_version
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: между процессами писателей разводит только сама SQLite
+    fcntl = None
+
+# Сколько ждать чужую блокировку, прежде чем вернуть «database is locked»
+BUSY_TIMEOUT_MS = 30_000
+# Чекпоинт после записи, если журнал больше этого размера
+CHECKPOINT_WAL_BYTES = 16 * 1024 * 1024
+# Размер, до которого SQLite усекает журнал после полного чекпоинта
+JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+# Заданий очереди в одной транзакции
+MAX_BATCH_JOBS = 500
+
+WRITE_OPTION = "ltv_write"
+
+_local = threading.local()
+_write_lock = threading.RLock()
+
+
+def _engine():
+    # Импорт внутри функции: data_loader сам использует этот модуль
+    from .data_loader import engine
+    return engine
+
+
+def _db_path():
+    from .data_loader import DB_PATH
+    return DB_PATH
+
+
+def configure_engine(engine) -> None:
+    """
+    Настраивает соединения движка: WAL, ожидание блокировок, транзакции.
+
+    Драйвер sqlite3 переводится в режим autocommit, а BEGIN выдаёт
+    SQLAlchemy: обычное соединение читает в транзакции-снимке, соединение
+    писателя (write_transaction) сразу берёт блокировку записи.
+
+    Args:
+        engine: Движок SQLAlchemy для SQLite
+    """
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute("PRAGMA wal_autocheckpoint = 0")
+        cursor.execute(f"PRAGMA journal_size_limit = {JOURNAL_SIZE_LIMIT}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(conn):
+        immediate = conn.get_execution_options().get(WRITE_OPTION)
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+
+@contextmanager
+def file_write_lock(db_path):
+    """
+    Межпроцессная блокировка писателя (файл <база>.lock рядом с базой).
+
+    Args:
+        db_path: Путь к файлу базы
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(f"{db_path}.lock", "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def wal_size() -> int:
+    """Текущий размер WAL-журнала в байтах (0, если журнала нет)."""
+    try:
+        return os.path.getsize(f"{_db_path()}-wal")
+    except OSError:
+        return 0
+
+
+def checkpoint(mode: str = "PASSIVE") -> Dict[str, int]:
+    """
+    Переносит журнал в базу.
+
+    PASSIVE не ждёт читателей и переносит то, что можно; TRUNCATE ждёт
+    завершения открытых снимков (до BUSY_TIMEOUT_MS) и обнуляет журнал.
+
+    Args:
+        mode: PASSIVE, FULL, RESTART или TRUNCATE
+
+    Returns:
+        Dict: busy, wal_pages, checkpointed_pages
+    """
+    mode = mode.upper()
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Неизвестный режим чекпоинта: {mode}")
+
+    with _write_lock, file_write_lock(_db_path()):
+        raw = _engine().raw_connection()
+        try:
+            busy, wal_pages, checkpointed = raw.driver_connection.execute(
+                f"PRAGMA wal_checkpoint({mode})"
+            ).fetchone()
+        finally:
+            raw.close()
+
+    return {"busy": busy, "wal_pages": wal_pages, "checkpointed_pages": checkpointed}
+
+
+def _after_write() -> None:
+    """После записи: снимок чтения этого потока переходит на новую версию."""
+    snapshot = getattr(_local, "snapshot", None)
+    if snapshot is not None:
+        snapshot.rollback()
+        refresh_pinned_data_version()
+
+
+def writer_busy() -> bool:
+    """
+    Идёт ли сейчас запись в другом потоке или процессе (проверка без ожидания).
+
+    Загрузчики страниц проверяют это перед необязательной
+    материализацией: если писатель занят, страница читает то, что уже
+    построено, а не ждёт конца чужой транзакции.
+    """
+    if getattr(_local, "writer", None) is not None:
+        return False
+    if not _write_lock.acquire(blocking=False):
+        return True
+    try:
+        if fcntl is None:
+            return False
+        with open(f"{_db_path()}.lock", "a") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            return False
+    finally:
+        _write_lock.release()
+
+
+@contextmanager
+def write_transaction():
+    """
+    Транзакция записи: единственный писатель, BEGIN IMMEDIATE, фиксация при выходе.
+
+    Вложенный вызов в том же потоке выполняется точкой сохранения
+    внутри текущей транзакции.
+
+    Yields:
+        Соединение SQLAlchemy в открытой транзакции
+    """
+    current = getattr(_local, "writer", None)
+    if current is not None:
+        with current.begin_nested():
+            yield current
+        return
+
+    with _write_lock, file_write_lock(_db_path()):
+        with _engine().connect() as conn:
+            conn.execution_options(**{WRITE_OPTION: True})
+            _local.writer = conn
+            try:
+                with conn.begin():
+                    yield conn
+            finally:
+                _local.writer = None
+
+            if wal_size() > CHECKPOINT_WAL_BYTES:
+                conn.connection.driver_connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    _after_write()
+
+
+@contextmanager
+def read_snapshot():
+    """
+    Закрепляет за потоком один снимок базы на время блока.
+
+    Загрузчики внутри блока читают через read_connection() из этого
+    снимка; версия данных для кэшей фиксируется на момент открытия.
+    Вложенный вызов использует уже открытый снимок.
+
+    Yields:
+        Соединение SQLAlchemy со снимком
+    """
+    if getattr(_local, "snapshot", None) is not None:
+        yield _local.snapshot
+        return
+
+    # Версия читается до снимка: данные снимка не старше версии, под
+    # которой кэшируются результаты
+    with pin_data_version(), _engine().connect() as conn:
+        conn.exec_driver_sql("SELECT 1 FROM sqlite_master LIMIT 1")
+        _local.snapshot = conn
+        try:
+            yield conn
+        finally:
+            _local.snapshot = None
+
+
+def read_connection():
+    """
+    Соединение для чтения: снимок потока, если он открыт, иначе новое.
+
+    Используется как `with read_connection() as conn:`.
+    """
+    snapshot = getattr(_local, "snapshot", None)
+    if snapshot is not None:
+        return nullcontext(snapshot)
+    return _engine().connect()
+
+
+class WriteQueue:
+    """
+    Очередь записи с пакетной фиксацией.
+
+    Задание — функция job(conn) -> результат. Поток очереди забирает
+    все накопившиеся задания (до max_batch) и выполняет их в одной
+    write_transaction, каждое в своей точке сохранения. Результат или
+    исключение задания приходит в Future после фиксации транзакции.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH_JOBS):
+        self.max_batch = max_batch
+        self.stats = {"batches": 0, "jobs": 0, "failed": 0}
+        self._jobs: queue.Queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, job: Callable[[Any], Any]) -> Future:
+        """Ставит задание в очередь, не дожидаясь записи."""
+        future = Future()
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="ltv-writer", daemon=True)
+                self._thread.start()
+        self._jobs.put((job, future))
+        return future
+
+    def run(self, job: Callable[[Any], Any]) -> Any:
+        """
+        Выполняет задание и ждёт фиксации.
+
+        Внутри уже открытой write_transaction (в том числе в задании
+        самой очереди) задание выполняется сразу в ней: ожидание очереди
+        из её же потока привело бы к взаимной блокировке. После записи
+        снимок чтения вызывающего потока переходит на новую версию.
+        """
+        if getattr(_local, "writer", None) is not None:
+            with write_transaction() as conn:
+                return job(conn)
+        result = self.submit(job).result()
+        _after_write()
+        return result
+
+    def join(self) -> None:
+        """Ждёт, пока все поставленные задания будут записаны."""
+        self._jobs.join()
+
+    def _worker(self) -> None:
+        while True:
+            batch = [self._jobs.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._run_batch(batch)
+            finally:
+                for _ in batch:
+                    self._jobs.task_done()
+
+    def _run_batch(self, batch) -> None:
+        done = []
+        try:
+            with write_transaction() as conn:
+                for job, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with conn.begin_nested():
+                            result = job(conn)
+                    except Exception as error:
+                        self.stats["failed"] += 1
+                        future.set_exception(error)
+                    else:
+                        done.append((future, result))
+        except Exception as error:
+            # Не удалась сама транзакция (BEGIN, блокировка, фиксация):
+            # ни одно задание пакета не записано, включая ещё не начатые
+            for _, future in batch:
+                if future.done():
+                    continue
+                if future.running() or future.set_running_or_notify_cancel():
+                    self.stats["failed"] += 1
+                    future.set_exception(error)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["jobs"] += len(done)
+        for future, result in done:
+            future.set_result(result)
+
+
+_queue = WriteQueue()
+
+
+def get_write_queue() -> WriteQueue:
+    """Общая очередь записи процесса."""
+    return _queue
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--checkpoint" in sys.argv:
+        result = checkpoint("TRUNCATE")
+        state = "⚠️ есть открытые снимки, журнал перенесён частично" if result["busy"] else "✅ журнал перенесён и усечён"
+        print(f"{state}: {result['checkpointed_pages']} из {result['wal_pages']} страниц")
+    else:
+        print(f"WAL: {wal_size() / 1024 / 1024:.1f} МБ")
@@ -0,0 +1,296 @@
+"""
+Приёмник вебхуков Bitrix
+
+Принимает исходящие вебхуки Bitrix о сделках и компаниях и применяет их
+к базе через utils/ingest.py: события пачками записываются в
+bitrix_deals / bitrix_companies, агрегаты компаний пересчитываются, а
+версия данных меняется — дашборд и API показывают изменения при
+следующем перезапуске страницы, без ночной выгрузки.
+
+Запуск:
+    python dashboard/webhook.py serve --port 8700
+
+В Bitrix (Разработчикам → Исходящий вебхук) указать адрес
+http://<хост>:8700/bitrix/webhook и события ONCRMDEALADD, ONCRMDEALUPDATE,
+ONCRMDEALDELETE, ONCRMCOMPANYADD, ONCRMCOMPANYUPDATE, ONCRMCOMPANYDELETE.
+Токен приложения из настроек вебхука задаётся переменной окружения
+LTV_WEBHOOK_TOKEN — события с другим токеном отклоняются.
+
+Эндпоинты:
+    POST /bitrix/webhook   — событие (form-urlencoded, как шлёт Bitrix) или JSON (событие или список)
+    GET  /bitrix/status    — статистика пачек и версия данных
+
+Имитация Bitrix для проверки — случайные изменения существующих сделок
+и компаний, по событию на запрос:
+    python dashboard/webhook.py send --events 200 --concurrency 8
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode
+from urllib.request import Request, urlopen
+
+# Добавить корневую директорию в PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from dashboard.utils.cache import get_data_version
+from dashboard.utils.ingest import EventBuffer, parse_event
+
+TOKEN_ENV = "LTV_WEBHOOK_TOKEN"
+# Сколько ждать записи пачки, прежде чем ответить ошибкой (Bitrix повторит)
+WRITE_TIMEOUT_SECONDS = 60
+MAX_BODY_BYTES = 1024 * 1024
+
+_KEY_PATTERN = re.compile(r"\[([^\]]*)\]")
+
+
+def parse_form(body: str) -> dict:
+    """
+    Разбирает form-urlencoded тело Bitrix во вложенный словарь.
+
+    "data[FIELDS][ID]=15" -> {"data": {"FIELDS": {"ID": "15"}}}
+    """
+    result: dict = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        head = key.split("[", 1)[0]
+        path = [head] + _KEY_PATTERN.findall(key[len(head):])
+        node = result
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = value
+    return result
+
+
+def encode_form(payload: dict, prefix: str = "") -> list:
+    """Обратное к parse_form: вложенный словарь -> пары для urlencode."""
+    pairs = []
+    for key, value in payload.items():
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if isinstance(value, dict):
+            pairs.extend(encode_form(value, name))
+        else:
+            pairs.append((name, "" if value is None else str(value)))
+    return pairs
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Обработчик вебхуков Bitrix."""
+
+    server_version = "FotofactorLTV-Webhook/1.0"
+    buffer = EventBuffer()
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != "/bitrix/webhook":
+            self._send_json(404, {"error": "Неизвестный эндпоинт"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {"error": "Слишком большой запрос"})
+            return
+        body = self.rfile.read(length).decode("utf-8")
+
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                payload = json.loads(body)
+            else:
+                payload = parse_form(body)
+            payloads = payload if isinstance(payload, list) else [payload]
+
+            token = os.environ.get(TOKEN_ENV)
+            if token and any((p.get("auth") or {}).get("application_token") != token for p in payloads):
+                self._send_json(403, {"error": "Неверный токен приложения"})
+                return
+
+            events = [parse_event(p) for p in payloads]
+        except (ValueError, AttributeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            result = self.buffer.add(events).result(timeout=WRITE_TIMEOUT_SECONDS)
+        except Exception as e:
+            self._send_json(500, {"error": f"Ошибка записи: {e}"})
+            return
+
+        self._send_json(200, {
+            "accepted": len(events),
+            "source_version": result["source_version"],
+            "data_version": get_data_version(),
+        })
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/bitrix/status":
+            self._send_json(404, {"error": "Неизвестный эндпоинт"})
+            return
+        self._send_json(200, {"data_version": get_data_version(), **self.buffer.stats})
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code="-", size="-"):
+        # Bitrix шлёт по запросу на событие: в журнал только ошибки
+        if str(getattr(code, "value", code)).startswith(("4", "5")):
+            super().log_request(code, size)
+
+
+# ============================================================================
+# ИМИТАЦИЯ BITRIX
+# ============================================================================
+
+STAGES = ["NEW", "PREPARATION", "PREPAYMENT_INVOICE", "EXECUTING", "FINAL_INVOICE", "WON", "LOSE"]
+
+
+def generate_events(count: int, token: str = None, seed: int = None) -> list:
+    """
+    Случайные события по существующим сделкам и компаниям базы.
+
+    Смесь: смена стадии и суммы сделки, новая сделка, перенос даты
+    закрытия, удаление сделки, переименование компании.
+
+    Args:
+        count: Количество событий
+        token: Токен приложения для auth[application_token]
+        seed: Зерно генератора
+
+    Returns:
+        Список событий в формате вебхука Bitrix
+    """
+    from sqlalchemy import text
+    from dashboard.utils.writer import read_connection
+
+    rng = random.Random(seed)
+    with read_connection() as conn:
+        deals = conn.execute(text("SELECT bitrix_id, company_id FROM bitrix_deals")).fetchall()
+        companies = conn.execute(text("SELECT bitrix_id, title FROM bitrix_companies")).fetchall()
+
+    today = date.today()
+    auth = {"application_token": token} if token else {}
+    events = []
+    for i in range(count):
+        kind = rng.choices(["stage", "add", "move", "delete", "company"], weights=[50, 25, 10, 5, 10])[0]
+        if kind == "company" and companies:
+            bitrix_id, title = rng.choice(companies)
+            fields = {"ID": bitrix_id, "TITLE": f"{title.split(' (')[0]} ({i})"}
+            event = "ONCRMCOMPANYUPDATE"
+        elif kind == "add" or not deals:
+            fields = {
+                "ID": f"HOOK_{int(time.time() * 1000)}_{i}",
+                "TITLE": f"Заказ с сайта #{i}",
+                "COMPANY_ID": rng.choice(companies)[0] if companies else 0,
+                "OPPORTUNITY": f"{rng.uniform(5_000, 80_000):.2f}|RUB",
+                "CLOSEDATE": (today + timedelta(days=rng.randint(0, 30))).isoformat() + "T03:00:00+03:00",
+                "STAGE_ID": "NEW",
+            }
+            event = "ONCRMDEALADD"
+        elif kind == "delete":
+            fields = {"ID": rng.choice(deals)[0]}
+            event = "ONCRMDEALDELETE"
+        elif kind == "move":
+            fields = {
+                "ID": rng.choice(deals)[0],
+                "CLOSEDATE": (today - timedelta(days=rng.randint(0, 400))).isoformat() + "T03:00:00+03:00",
+            }
+            event = "ONCRMDEALUPDATE"
+        else:
+            fields = {
+                "ID": rng.choice(deals)[0],
+                "STAGE_ID": rng.choice(STAGES),
+                "OPPORTUNITY": f"{rng.uniform(5_000, 80_000):.2f}",
+            }
+            event = "ONCRMDEALUPDATE"
+
+        events.append({"event": event, "data": {"FIELDS": fields}, "ts": int(time.time()), "auth": auth})
+    return events
+
+
+def send_events(url: str, events: list, concurrency: int = 4) -> dict:
+    """
+    Отправляет события по одному на запрос, как Bitrix.
+
+    Returns:
+        Dict: sent, failed, seconds, p50_ms, p95_ms
+    """
+    def post(event):
+        request = Request(
+            url,
+            data=urlencode(encode_form(event)).encode("utf-8"),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            method="POST"
+        )
+        started = time.perf_counter()
+        try:
+            with urlopen(request, timeout=WRITE_TIMEOUT_SECONDS) as response:
+                ok = response.status == 200
+        except OSError:
+            ok = False
+        return ok, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, events))
+    seconds = time.perf_counter() - started
+
+    latencies = sorted(ms for _, ms in results)
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0
+    return {
+        "sent": sum(ok for ok, _ in results),
+        "failed": sum(not ok for ok, _ in results),
+        "seconds": seconds,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Приёмник вебхуков Bitrix")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Принимать вебхуки")
+    serve.add_argument("--host", default="127.0.0.1", help="Адрес для прослушивания")
+    serve.add_argument("--port", type=int, default=8700, help="Порт")
+
+    send = commands.add_parser("send", help="Отправить случайные события (имитация Bitrix)")
+    send.add_argument("--url", default="http://127.0.0.1:8700/bitrix/webhook", help="Адрес приёмника")
+    send.add_argument("--events", type=int, default=100, help="Количество событий")
+    send.add_argument("--concurrency", type=int, default=4, help="Параллельных запросов")
+    send.add_argument("--seed", type=int, default=None, help="Зерно генератора")
+
+    args = parser.parse_args()
+
+    if args.command == "send":
+        events = generate_events(args.events, os.environ.get(TOKEN_ENV), args.seed)
+        result = send_events(args.url, events, args.concurrency)
+        print(
+            f"✅ Отправлено {result['sent']} событий за {result['seconds']:.1f} с "
+            f"({result['sent'] / max(result['seconds'], 1e-9):.0f}/с), ошибок: {result['failed']}; "
+            f"ответ p50 {result['p50_ms']:.0f} мс, p95 {result['p95_ms']:.0f} мс"
+        )
+        return
+
+    server = ThreadingHTTPServer((args.host, args.port), WebhookHandler)
+    print(f"✅ Приёмник вебхуков запущен: http://{args.host}:{args.port}/bitrix/webhook")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()